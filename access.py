@@ -0,0 +1,125 @@
+import csv
+import os
+import re
+import threading
+import time
+
+# --- Locations ---
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+ACCESS_CSV_PATH = os.environ.get('ACCESS_CSV', os.path.join(PROJECT_ROOT, 'access.csv'))
+
+# How often (in seconds) a worker re-stats access.csv to pick up permission changes.
+RELOAD_CHECK_INTERVAL = float(os.environ.get('ACCESS_RELOAD_INTERVAL', '5'))
+
+# Cell values that grant access ('Yes.' appears in the sheet as well as 'Yes').
+GRANTED_VALUES = {'yes', 'y', 'true', '1', 'x'}
+
+
+def _entity_key(name):
+    """Comparison key for entity names: case, punctuation, spacing and a trailing 'LLC' are ignored."""
+    key = re.sub(r'[^a-z0-9]+', ' ', str(name).lower()).split()
+    if key and key[-1] == 'llc':
+        key = key[:-1]
+    return ' '.join(key)
+
+
+def normalize_entity_name(name, known_entities):
+    """
+    Maps a loosely written entity name ('AMICO Dx', 'Amico DX LLC', 'FIRST BIO GENETICS LLC')
+    onto the matching entry of known_entities. Returns None if nothing matches.
+    """
+    key = _entity_key(name)
+    for entity in known_entities:
+        if _entity_key(entity) == key:
+            return entity
+    return None
+
+
+def _is_granted(value):
+    return (value or '').strip().rstrip('.').strip().lower() in GRANTED_VALUES
+
+
+class AccessGrid:
+    """One parsed version of access.csv: username -> bitmask over the matrix's entities."""
+
+    def __init__(self, masks, version, unknown_headers=()):
+        self.masks = masks
+        self.version = version
+        self.unknown_headers = list(unknown_headers)
+
+
+class AccessMatrix:
+    """
+    Users x entities permission grid loaded from access.csv. Each user is a single int with one
+    bit per entity (in the order of the entities passed in), so an entity check is a bit test.
+    The file is re-stat'ed at most every check_interval seconds and reparsed when it changes.
+    """
+
+    def __init__(self, entities, csv_path=ACCESS_CSV_PATH, check_interval=RELOAD_CHECK_INTERVAL):
+        self.entities = list(entities)
+        self.bits = {entity: 1 << position for position, entity in enumerate(self.entities)}
+        self.full_mask = (1 << len(self.entities)) - 1
+        self.csv_path = csv_path
+        self.check_interval = check_interval
+        self._grid = AccessGrid({}, None)
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the current AccessGrid, reparsing access.csv if it changed on disk."""
+        now = time.monotonic()
+        if self._last_check is not None and now - self._last_check < self.check_interval:
+            return self._grid
+
+        with self._lock:
+            self._last_check = now
+            try:
+                stat = os.stat(self.csv_path)
+            except FileNotFoundError:
+                # No grid: every user falls back to the entities assigned in models.users
+                self._grid = AccessGrid({}, None)
+                return self._grid
+            version = (stat.st_mtime_ns, stat.st_size)
+            if version != self._grid.version:
+                self._grid = self._parse(version)
+                if self._grid.unknown_headers:
+                    print(f"Ignoring unknown entity columns in {self.csv_path}: {self._grid.unknown_headers}")
+            return self._grid
+
+    def _parse(self, version):
+        with open(self.csv_path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            columns = []  # (column position, entity bit)
+            unknown_headers = []
+            for position, name in enumerate(header[1:], start=1):  # First column holds the username
+                entity = normalize_entity_name(name, self.entities)
+                if entity is None:
+                    unknown_headers.append(name)
+                else:
+                    columns.append((position, self.bits[entity]))
+
+            masks = {}
+            for row in reader:
+                if not row or not row[0].strip():
+                    continue
+                mask = 0
+                for position, bit in columns:
+                    if position < len(row) and _is_granted(row[position]):
+                        mask |= bit
+                masks[row[0].strip()] = mask
+        return AccessGrid(masks, version, unknown_headers)
+
+    def mask_for_user(self, username):
+        """The user's bitmask, or None if access.csv does not list them."""
+        return self.get().masks.get(username)
+
+    def mask_of(self, entities):
+        mask = 0
+        for entity in entities:
+            mask |= self.bits.get(entity, 0)
+        return mask
+
+    def entities_of(self, mask):
+        """Entities whose bits are set in mask, in matrix order."""
+        return [entity for entity in self.entities if mask & self.bits[entity]]
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+import time
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+import filestore
+import patient_catalog
+
+# --- Locations ---
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+STATIC_DIR = os.path.join(PROJECT_ROOT, 'static')
+# Written by build_static.py at deploy time: relative path -> content hash, size and mtime.
+ASSET_MANIFEST_PATH = os.environ.get('ASSET_MANIFEST', os.path.join(PROJECT_ROOT, '.cache', 'static_assets.json'))
+
+# Files worth precompressing. Images, video and archives are already compressed, and PDFs are
+# never served from static/ (see PRIVATE_EXTENSIONS).
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.json', '.svg', '.html', '.txt', '.csv', '.xml', '.map'}
+
+# Precompressed variants, in order of preference: Accept-Encoding token -> file suffix.
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# URLs carry ?v=<content hash>, so a versioned response can never go stale and is cached for a year.
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Unversioned static URLs (hardcoded in CSS, old bookmarks) still revalidate after this many seconds.
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', '3600'))
+
+HASH_LENGTH = 12
+
+# static/ also holds private documents (financial statement PDFs, download directories, results
+# left in the old patient_reports/ drop directory). Those are only sent by the login-checked
+# download routes; static_view answers 404 for them.
+PRIVATE_EXTENSIONS = {'.pdf'}
+
+# How often (in seconds) a worker re-stats a static file to notice it changed without a redeploy.
+VERSION_CHECK_INTERVAL = float(os.environ.get('STATIC_VERSION_CHECK_INTERVAL', '30'))
+
+
+def file_hash(path):
+    """Short sha256 of a file's contents, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def _accepted_encodings():
+    header = request.headers.get('Accept-Encoding', '')
+    accepted = set()
+    for part in header.split(','):
+        token, _, params = part.strip().partition(';')
+        if token and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(token.lower())
+    return accepted
+
+
+class AssetIndex:
+    """
+    Content hashes of static files, used to version their URLs. Hashes come from the manifest
+    built at deploy time; a file that is missing from it or changed since (size or mtime differ)
+    is hashed once on first use and remembered. A file is re-stat'ed at most every check_interval
+    seconds, so rendering url_for('static') links normally costs a dict lookup.
+    """
+
+    def __init__(self, static_dir=STATIC_DIR, manifest_path=ASSET_MANIFEST_PATH, check_interval=VERSION_CHECK_INTERVAL):
+        self.static_dir = static_dir
+        self.manifest_path = manifest_path
+        self.check_interval = check_interval
+        self._hashes = None  # relative path -> (size, mtime_ns, hash)
+        self._checked = {}  # relative path -> (monotonic time of last stat, hash or None)
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+        return {path: (item['size'], item['mtime_ns'], item['hash']) for path, item in manifest.items()}
+
+    def version(self, filename):
+        """Content hash for static/<filename>, or None if there is no such file."""
+        now = time.monotonic()
+        checked = self._checked.get(filename)
+        if checked is not None and now - checked[0] < self.check_interval:
+            return checked[1]
+        digest = self._current_hash(filename)
+        self._checked[filename] = (now, digest)
+        return digest
+
+    def _current_hash(self, filename):
+        if self._hashes is None:
+            with self._lock:
+                if self._hashes is None:
+                    self._hashes = self._load()
+        path = safe_join(self.static_dir, filename)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        known = self._hashes.get(filename)
+        if known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            return known[2]
+        digest = file_hash(path)
+        self._hashes[filename] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+
+def _private_roots():
+    return [os.path.abspath(root) for root in filestore.DOWNLOAD_ROOTS.values()] + [patient_catalog.LEGACY_REPORTS_DIR]
+
+
+def is_private(path):
+    """True for files under static/ that must not be served without a login (see PRIVATE_EXTENSIONS)."""
+    path = os.path.normcase(os.path.abspath(path))
+    if os.path.splitext(path)[1].lower() in PRIVATE_EXTENSIONS:
+        return True
+    return any(path.startswith(os.path.normcase(root) + os.sep) for root in _private_roots())
+
+
+def static_view(filename):
+    """
+    Replacement for Flask's static endpoint. Byte ranges and conditional requests come from
+    send_file. A precompressed .br/.gz sibling is sent when the client accepts it (but not for
+    a Range request: the range applies to the file itself), and a URL whose ?v= matches the
+    file's content hash is cached as immutable.
+    """
+    path = safe_join(asset_index.static_dir, filename)
+    if path is None or not os.path.isfile(path) or is_private(path):
+        abort(404)
+
+    compressible = os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS
+    served_path, content_encoding = path, None
+    if compressible and 'Range' not in request.headers:
+        accepted = _accepted_encodings()
+        for encoding, suffix in ENCODINGS:
+            if encoding in accepted and os.path.isfile(path + suffix):
+                served_path, content_encoding = path + suffix, encoding
+                break
+
+    requested_version = request.args.get('v')
+    immutable = requested_version is not None and requested_version == asset_index.version(filename)
+
+    response = send_file(
+        served_path,
+        mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream',  # Of the original, not .br/.gz
+        conditional=True,
+        max_age=IMMUTABLE_MAX_AGE if immutable else STATIC_MAX_AGE,
+    )
+    if content_encoding:
+        # The variant is its own file, so it already has its own ETag
+        response.headers['Content-Encoding'] = content_encoding
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+
+def add_static_version(endpoint, values):
+    """url_defaults hook: url_for('static', filename=...) gets ?v=<content hash> appended."""
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        version = asset_index.version(values['filename'])
+        if version:
+            values['v'] = version
+
+
+def init_app(app):
+    """Serves app.static_folder through static_view and versions every url_for('static') link."""
+    asset_index.static_dir = app.static_folder
+    app.view_functions['static'] = static_view
+    app.url_defaults(add_static_version)
+
+
+asset_index = AssetIndex()
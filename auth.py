@@ -1,10 +1,19 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, g
 from werkzeug.security import check_password_hash
 from functools import wraps
 import models # Import models from the same package
 
 auth_bp = Blueprint('auth', __name__)
 
+def current_entitlements():
+    """
+    Entitlements (entities, 'All Entities' access, report types) of the logged-in user,
+    looked up at most once per request.
+    """
+    if 'entitlements' not in g:
+        g.entitlements = models.get_entitlements(session.get('username'), session.get('user_role'))
+    return g.entitlements
+
 def login_required(f):
     """
     Decorator to check if the user is logged in and has a selected role.
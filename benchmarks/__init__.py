@@ -0,0 +1,10 @@
+"""
+Benchmarks for the report hot paths, run from the project root:
+
+- generate_data.py: synthetic data.csv files from 10k to 50M rows
+- bench_reports.py: pytest-benchmark timings of filters, the monthly bonus, pagination and full requests
+- load_test.py: concurrent HTTP load against a running server (login, dashboard, bonus, export, download)
+- results.py: stores every run under benchmarks/results/ and compares runs between commits
+
+Extra dependencies are in benchmarks/requirements.txt.
+"""
@@ -0,0 +1,108 @@
+"""
+Report hot-path benchmarks (pytest-benchmark), run from the project root:
+
+    BENCH_ROWS=1000000 python -m pytest benchmarks/bench_reports.py \
+        --benchmark-autosave --benchmark-storage=benchmarks/results/pytest
+
+Add --benchmark-compare (latest saved run) or --benchmark-compare=<run id> together with
+--benchmark-compare-fail=median:10% to fail on a regression. The data comes from
+generate_data.py and is cached in .cache/bench/ per row count.
+"""
+import pytest
+
+import datastore
+import models
+import reports
+
+pytest.importorskip('pytest_benchmark')
+
+REP_USERNAME = 'JayM'  # A single-username rep with a large share of rows
+
+
+# --- Loading ---
+def test_parse_csv(benchmark, bench_csv):
+    benchmark.pedantic(datastore.read_financial_csv, args=(bench_csv,), rounds=3, iterations=1)
+
+
+def test_build_snapshot_indexes(benchmark, snapshot):
+    benchmark.pedantic(
+        datastore.FinancialData, args=(snapshot.df, snapshot.version, snapshot.source_path, snapshot.source_mtime_ns),
+        rounds=3, iterations=1
+    )
+
+
+# --- Filters ---
+def test_filter_entity_month(benchmark, snapshot, latest_period):
+    year, month = latest_period
+    benchmark(models.filter_financial_data, snapshot.df, models.MASTER_ENTITIES[0], str(month), str(year))
+
+
+def test_filter_all_entities_month(benchmark, snapshot, latest_period):
+    year, month = latest_period
+    benchmark(models.filter_financial_data, snapshot.df, 'All Entities', str(month), str(year))
+
+
+def test_filter_username_all_periods(benchmark, snapshot):
+    benchmark(models.filter_financial_data, snapshot.df, 'All Entities', None, None, current_username=REP_USERNAME)
+
+
+# --- Monthly Bonus ---
+def test_monthly_bonus_unfiltered(benchmark, snapshot, latest_period):
+    year, month = latest_period
+    benchmark(models.get_monthly_bonus, str(month), str(year))
+
+
+def test_monthly_bonus_username(benchmark, snapshot, latest_period):
+    year, month = latest_period
+    benchmark(models.get_monthly_bonus, str(month), str(year), current_username=REP_USERNAME,
+              entities=models.MASTER_ENTITIES)
+
+
+# --- Pagination ---
+def test_paginate_sorted_page(benchmark, snapshot, latest_period):
+    year, month = latest_period
+    rows = models.filter_financial_data(snapshot.df, 'All Entities', str(month), str(year))
+    columns = models.FINANCIAL_REPORT_DEFINITIONS['revenue']['columns']
+    benchmark(models.paginate_report, rows, columns, page=3, sort_by='Reimbursement', descending=True)
+
+
+# --- Full Requests ---
+def _dashboard_url(report_type, year, month):
+    return f"/reports/dashboard?report_type={report_type}&entity=All+Entities&month={month}&year={year}"
+
+
+def test_generic_report_uncached(benchmark, admin_client, latest_period):
+    url = _dashboard_url('revenue', *latest_period)
+
+    def render():
+        reports.fragment_cache.clear()
+        return admin_client.get(url)
+
+    assert benchmark(render).status_code == 200
+
+
+def test_generic_report_cached(benchmark, admin_client, latest_period):
+    url = _dashboard_url('revenue', *latest_period)
+    admin_client.get(url)
+    assert benchmark(admin_client.get, url).status_code == 200
+
+
+def test_monthly_bonus_page_uncached(benchmark, admin_client, latest_period):
+    url = _dashboard_url('monthly_bonus', *latest_period)
+
+    def render():
+        reports.fragment_cache.clear()
+        return admin_client.get(url)
+
+    assert benchmark(render).status_code == 200
+
+
+def test_export_csv(benchmark, admin_client, latest_period):
+    year, month = latest_period
+    url = f"/reports/export/revenue?entity=All+Entities&month={month}&year={year}"
+
+    def export():
+        response = admin_client.get(url)
+        return response.status_code, len(response.get_data())  # Drains the streamed body
+
+    assert benchmark.pedantic(export, rounds=5, iterations=1)[0] == 200
@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# Size of the synthetic data.csv the benchmarks run against (10k to 50M rows).
+BENCH_ROWS = int(os.environ.get('BENCH_ROWS', '100000'))
+BENCH_DATA_DIR = os.environ.get('BENCH_DATA_DIR', os.path.join(PROJECT_ROOT, '.cache', 'bench'))
+
+# An admin from users.json: sees every entity, so reports touch the most rows.
+BENCH_ADMIN = os.environ.get('BENCH_ADMIN', 'SatishD')
+
+
+@pytest.fixture(scope='session')
+def bench_csv():
+    """Synthetic data.csv with BENCH_ROWS rows, generated once and reused across runs."""
+    from benchmarks import generate_data
+    path = os.path.join(BENCH_DATA_DIR, f"data-{BENCH_ROWS}.csv")
+    if not os.path.exists(path):
+        generate_data.generate(path, BENCH_ROWS)
+    return path
+
+
+@pytest.fixture(scope='session')
+def snapshot(bench_csv, tmp_path_factory):
+    """
+    Points the app's financial store at bench_csv (with its own segment cache) for the whole
+    session and returns the loaded snapshot.
+    """
+    import datastore
+    import financial
+    original = financial.financial_store
+    financial.financial_store = datastore.FinancialDataStore(
+        csv_path=bench_csv, cache_dir=str(tmp_path_factory.mktemp('segments'))
+    )
+    yield financial.financial_store.get()
+    financial.financial_store = original
+
+
+@pytest.fixture(scope='session')
+def latest_period(snapshot):
+    """(year, month) of the newest period in the data - the one dashboards open by default."""
+    return max(snapshot.periods)
+
+
+@pytest.fixture(scope='session')
+def app(snapshot):
+    import app as app_module
+    app_module.app.config['TESTING'] = True
+    return app_module.app
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = BENCH_ADMIN
+        session['selected_role'] = 'admin'
+        session['user_role'] = 'admin'
+    return client
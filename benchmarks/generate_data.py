@@ -0,0 +1,139 @@
+"""
+Synthetic data.csv generator for benchmarks:
+
+    python -m benchmarks.generate_data --rows 1000000 --out .cache/bench/data-1m.csv
+
+Writes a file with data.csv's columns and formats. The mix of entities, reps and Username
+values (including the comma-separated multi-username ones) follows the checked-in data.csv,
+spread over --months months ending at --end. Rows are generated and written in chunks, so
+50M rows need no more memory than 1M. The same --seed always produces the same file.
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import datastore
+import models
+
+COLUMNS = ['Date', 'Location', 'Reimbursement', 'COGS', 'Net', 'Commission', 'Entity',
+           'Associated Rep Name', 'Username', 'PatientID']
+
+CHUNK_ROWS = 1_000_000
+
+# Synthetic clinics added to the seed file's locations, so Location has a production-like cardinality.
+SYNTHETIC_LOCATIONS = 2000
+LOCATION_SUFFIXES = ['', ' - TOX', ' - CLINICAL', ' - PGX']
+
+# Share of rows that carry a patient ID (the rest are 'NA', as in data.csv).
+PATIENT_ID_SHARE = 0.3
+PATIENT_IDS = 200_000
+
+# The commission is this share of Net, as in data.csv.
+COMMISSION_RATE = 0.3
+COGS_TIERS = [50.0, 150.0, 250.0]
+
+
+def _seed_profile(seed_csv):
+    """Entity weights, (rep name, Username) pairs with weights and locations seen in seed_csv."""
+    entities, reps, locations = Counter(), Counter(), set()
+    with open(seed_csv, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            entities[row['Entity'].strip()] += 1
+            reps[(row['Associated Rep Name'].strip(), row['Username'].strip())] += 1
+            locations.add(row['Location'].strip())
+    # Every master entity appears, the rare ones at least as often as the rarest seen
+    entity_names = list(models.MASTER_ENTITIES)
+    entity_weights = np.array([max(entities.get(name, 0), 1) for name in entity_names], dtype='float64')
+    rep_pairs = sorted(reps)
+    rep_weights = np.array([reps[pair] for pair in rep_pairs], dtype='float64')
+    return (
+        entity_names, entity_weights / entity_weights.sum(),
+        rep_pairs, rep_weights / rep_weights.sum(),
+        sorted(locations),
+    )
+
+
+def _periods(months, end):
+    end_period = pd.Period(end, freq='M')
+    return [str((end_period - offset).to_timestamp().date()) for offset in range(months - 1, -1, -1)]
+
+
+def generate_chunk(rng, size, period, entity_names, entity_weights, rep_pairs, rep_weights, locations):
+    """One chunk of rows for a single period (a 'YYYY-MM-01' Date) as a DataFrame."""
+    reimbursement = np.round(rng.lognormal(mean=5.0, sigma=1.0, size=size), 2)
+    cogs = np.round(rng.choice(COGS_TIERS, size=size) * rng.uniform(0.9, 1.1, size=size), 2)
+    net = np.round(reimbursement - cogs, 2)
+    reps = rng.choice(len(rep_pairs), size=size, p=rep_weights)
+    # Location popularity is heavily skewed: a few clinics send most of the samples
+    location = (rng.zipf(1.3, size=size) - 1) % len(locations)
+    patient_ids = np.where(
+        rng.random(size) < PATIENT_ID_SHARE,
+        np.char.add('P', np.char.zfill(rng.integers(0, PATIENT_IDS, size=size).astype(str), 7)),
+        'NA'
+    )
+    chunk = pd.DataFrame({
+        'Date': period,
+        'Location': pd.Categorical.from_codes(location, categories=locations),
+        'Reimbursement': reimbursement,
+        'COGS': cogs,
+        'Net': net,
+        'Commission': np.round(net * COMMISSION_RATE, 2),
+        'Entity': pd.Categorical.from_codes(rng.choice(len(entity_names), size=size, p=entity_weights), categories=entity_names),
+        # Several reps share a name or a Username value, so these are looked up rather than categorical
+        'Associated Rep Name': np.array([name for name, _ in rep_pairs], dtype=object)[reps],
+        'Username': np.array([username for _, username in rep_pairs], dtype=object)[reps],
+        'PatientID': patient_ids,
+    }, columns=COLUMNS)
+    return chunk
+
+
+def generate(path, rows, months=24, end='2025-05', seed=42, seed_csv=datastore.DATA_CSV_PATH):
+    """Writes a synthetic data.csv with rows rows to path and returns path."""
+    rng = np.random.default_rng(seed)
+    entity_names, entity_weights, rep_pairs, rep_weights, seed_locations = _seed_profile(seed_csv)
+    synthetic = [f"CLINIC {i:04d}{LOCATION_SUFFIXES[i % len(LOCATION_SUFFIXES)]}" for i in range(SYNTHETIC_LOCATIONS)]
+    locations = seed_locations + synthetic
+    periods = _periods(months, end)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    started = time.perf_counter()
+    # Periods are written oldest first, so the file is in Date order like the real export
+    rows_per_period = rng.multinomial(rows, np.full(len(periods), 1 / len(periods)))
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        header = True
+        for period, period_rows in zip(periods, rows_per_period):
+            for start in range(0, period_rows, CHUNK_ROWS):
+                size = min(CHUNK_ROWS, period_rows - start)
+                chunk = generate_chunk(rng, size, period, entity_names, entity_weights, rep_pairs, rep_weights, locations)
+                chunk.to_csv(f, header=header, index=False, float_format='%.2f')
+                header = False
+    os.replace(tmp_path, path)
+    print(f"Wrote {rows:,} rows ({os.path.getsize(path) / 1024 ** 2:.1f} MB, {months} months) to {path} "
+          f"in {time.perf_counter() - started:.1f} s")
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000, help='number of rows (10k to 50M)')
+    parser.add_argument('--out', required=True, help='where to write the CSV')
+    parser.add_argument('--months', type=int, default=24, help='number of monthly periods')
+    parser.add_argument('--end', default='2025-05', help='last period (YYYY-MM)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+    generate(args.out, args.rows, months=args.months, end=args.end, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
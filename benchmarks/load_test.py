@@ -0,0 +1,212 @@
+"""
+HTTP load test against a running server (gunicorn or `python app.py`):
+
+    BENCH_PASSWORD=... python -m benchmarks.load_test --url http://localhost:10000 \
+        --scenarios login,dashboard,bonus,export,download --concurrency 8 --duration 30
+
+Each scenario runs on its own for --duration seconds with --concurrency threads, every thread
+logged in with its own session (the login scenario logs in on every iteration instead).
+Latency covers the whole response body. Results (throughput, error count, mean and p50/p90/
+p95/p99 latency) are printed and stored with results.save('load', ...); compare runs with
+`python -m benchmarks.results compare load`.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from benchmarks import results
+
+DEFAULT_URL = os.environ.get('BENCH_URL', 'http://localhost:10000')
+DEFAULT_USERNAME = os.environ.get('BENCH_USERNAME', 'SatishD')
+DEFAULT_ROLE = os.environ.get('BENCH_ROLE', 'admin')
+# A financial statement every admin can download (see models.get_financial_statements).
+DEFAULT_DOWNLOAD_PATH = '/download_report/financials/AMICO%20Dx%20LLC/Balance%20Sheet/Accrual/2024'
+
+PERCENTILES = (50, 90, 95, 99)
+REQUEST_TIMEOUT = 60
+
+
+class Session:
+    """One browser: a cookie jar plus an opener that follows redirects."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, path, data=None):
+        """(status, final path) after reading the whole body; redirects are followed."""
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(self.base_url + path, data=body, timeout=REQUEST_TIMEOUT) as response:
+                while response.read(1 << 16):
+                    pass
+                return response.status, urllib.parse.urlsplit(response.geturl()).path
+        except urllib.error.HTTPError as e:
+            return e.code, path
+
+    def login(self, username, password, role):
+        self.request('/auth/select_role', {'role': role})
+        status, final_path = self.request('/auth/login', {'username': username, 'password': password})
+        # A failed login renders the login page again instead of redirecting
+        return status == 200 and not final_path.startswith('/auth/')
+
+
+# --- Scenarios ---
+def _report_path(args, report_type):
+    query = {'report_type': report_type, 'entity': args.entity, 'month': args.month, 'year': args.year}
+    return '/reports/dashboard?' + urllib.parse.urlencode(query)
+
+
+def _ok(status, final_path):
+    # Pages that bounce back to login or role selection failed, whatever the status
+    return status == 200 and not final_path.startswith('/auth/')
+
+
+def scenario_login(session, args):
+    return Session(args.url).login(args.username, args.password, args.role)
+
+
+def scenario_dashboard(session, args):
+    return _ok(*session.request(_report_path(args, 'revenue')))
+
+
+def scenario_bonus(session, args):
+    return _ok(*session.request(_report_path(args, 'monthly_bonus')))
+
+
+def scenario_export(session, args):
+    query = {'entity': args.entity, 'month': args.month, 'year': args.year}
+    return _ok(*session.request('/reports/export/revenue?' + urllib.parse.urlencode(query)))
+
+
+def scenario_download(session, args):
+    return _ok(*session.request(args.download_path))
+
+
+SCENARIOS = {
+    'login': scenario_login,
+    'dashboard': scenario_dashboard,
+    'bonus': scenario_bonus,
+    'export': scenario_export,
+    'download': scenario_download,
+}
+
+
+# --- Runner ---
+def _percentile(sorted_values, percentile):
+    index = min(len(sorted_values) - 1, round(percentile / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    summary = {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': sum(latencies) / len(latencies) * 1000 if latencies else None,
+    }
+    for percentile in PERCENTILES:
+        summary[f"p{percentile}_ms"] = _percentile(latencies, percentile) * 1000 if latencies else None
+    return summary
+
+
+def run_scenario(name, args):
+    """Runs one scenario with args.concurrency threads for args.duration seconds."""
+    scenario = SCENARIOS[name]
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker():
+        session = Session(args.url)
+        if name != 'login' and not session.login(args.username, args.password, args.role):
+            with lock:
+                errors.append('login failed')
+            return
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = scenario(session, args)
+            except OSError:  # Connection refused/reset, timeouts
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(name)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, len(errors), time.monotonic() - started)
+
+
+def server_info(url):
+    """The server's /health/ready report: loaded data and warmup state (empty if it isn't ready)."""
+    try:
+        with urllib.request.urlopen(url.rstrip('/') + '/health/ready', timeout=REQUEST_TIMEOUT) as response:
+            return json.load(response)
+    except (OSError, ValueError):
+        return {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='HTTP load test for the report portal.')
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help='seconds per scenario')
+    parser.add_argument('--username', default=DEFAULT_USERNAME)
+    parser.add_argument('--password', default=os.environ.get('BENCH_PASSWORD'))
+    parser.add_argument('--role', default=DEFAULT_ROLE)
+    parser.add_argument('--entity', default='All Entities')
+    parser.add_argument('--month', help="default: the latest month in the server's data")
+    parser.add_argument('--year', help="default: the latest month's year")
+    parser.add_argument('--download-path', default=DEFAULT_DOWNLOAD_PATH)
+    parser.add_argument('--no-save', action='store_true', help="print results without storing them")
+    args = parser.parse_args(argv)
+    if not args.password:
+        parser.error('--password (or BENCH_PASSWORD) is required to log in')
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    info = server_info(args.url)
+    data = info.get('data', {})
+    if not (args.month and args.year):
+        # The period the server primed during warmup is the newest one in its data
+        primed = (info.get('warmup') or {}).get('primed_period')
+        if not primed:
+            parser.error(f"{args.url}/health/ready did not report a data period; pass --month and --year")
+        year, month = primed.split('-')
+        args.year, args.month = args.year or year, args.month or str(int(month))
+    print(f"{args.url}: {data.get('rows', '?')} rows (data version {data.get('version', '?')}), "
+          f"{args.month}/{args.year}, {args.concurrency} threads, {args.duration:g} s per scenario")
+    scenarios = {}
+    for name in names:
+        summary = scenarios[name] = run_scenario(name, args)
+        percentiles = ' '.join(
+            f"p{p}={summary[f'p{p}_ms']:.1f}ms" if summary[f'p{p}_ms'] is not None else f"p{p}=-" for p in PERCENTILES
+        )
+        print(f"  {name:<10} {summary['requests']:>7} ok {summary['errors']:>5} errors {summary['rps']:>8.1f} req/s  {percentiles}")
+
+    if not args.no_save:
+        results.save('load', scenarios, url=args.url, rows=data.get('rows'), data_version=data.get('version'),
+                     concurrency=args.concurrency, duration=args.duration, entity=args.entity,
+                     month=args.month, year=args.year)
+
+
+if __name__ == '__main__':
+    main()
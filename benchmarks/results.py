@@ -0,0 +1,120 @@
+"""
+Stored benchmark results, one JSON file per run under benchmarks/results/<kind>/, named
+<timestamp>-<commit>.json. Compare two runs (by default the latest against the one before):
+
+    python -m benchmarks.results list load
+    python -m benchmarks.results compare load [--base <commit>] [--head <commit>] [--threshold 0.10]
+
+pytest-benchmark runs keep their own format under benchmarks/results/pytest/ (see bench_reports.py).
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# A scenario counts as regressed when its metric got worse by more than this share.
+REGRESSION_THRESHOLD = 0.10
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=os.path.dirname(RESULTS_DIR), capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def save(kind, scenarios, **meta):
+    """
+    Writes one run. scenarios maps scenario name -> {metric: value}; meta (rows, concurrency,
+    ...) is stored alongside, with the commit, whether the tree was dirty and the machine.
+    """
+    commit = _git('rev-parse', '--short', 'HEAD') or 'unknown'
+    run = {
+        'commit': commit,
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'meta': meta,
+        'scenarios': scenarios,
+    }
+    directory = os.path.join(RESULTS_DIR, kind)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{commit}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(run, f, indent=1, sort_keys=True)
+    print(f"Saved results to {os.path.relpath(path)}")
+    return path
+
+
+def load_runs(kind):
+    """Every stored run of kind, oldest first."""
+    runs = []
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, kind, '*.json'))):
+        with open(path, encoding='utf-8') as f:
+            runs.append(dict(json.load(f), path=path))
+    return runs
+
+
+def _latest(runs, commit=None):
+    """The newest run (of commit, when given), or None."""
+    matching = [run for run in runs if commit is None or run['commit'].startswith(commit)]
+    return matching[-1] if matching else None
+
+
+def compare(kind, base=None, head=None, metric='p95_ms', threshold=REGRESSION_THRESHOLD):
+    """Prints metric per scenario for two runs; returns the names of scenarios that regressed."""
+    runs = load_runs(kind)
+    head_run = _latest(runs, head)
+    earlier = runs[:runs.index(head_run)] if head_run else []
+    base_run = _latest([run for run in runs if run is not head_run], base) if base else _latest(earlier)
+    if head_run is None or base_run is None:
+        print(f"Need two stored '{kind}' runs to compare (have {len(runs)}).")
+        return []
+
+    print(f"{metric}: {base_run['commit']} ({base_run['created']}) -> {head_run['commit']} ({head_run['created']})")
+    regressions = []
+    for name in sorted(set(base_run['scenarios']) | set(head_run['scenarios'])):
+        before = base_run['scenarios'].get(name, {}).get(metric)
+        after = head_run['scenarios'].get(name, {}).get(metric)
+        if before is None or after is None:
+            print(f"  {name:<24} {'-' if before is None else f'{before:.1f}':>10} {'-' if after is None else f'{after:.1f}':>10}")
+            continue
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"  {name:<24} {before:>10.1f} {after:>10.1f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='List or compare stored benchmark runs.')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    list_parser = subcommands.add_parser('list')
+    list_parser.add_argument('kind')
+    compare_parser = subcommands.add_parser('compare')
+    compare_parser.add_argument('kind')
+    compare_parser.add_argument('--base', help='commit to compare against (default: the run before the latest)')
+    compare_parser.add_argument('--head', help='commit to compare (default: the latest run)')
+    compare_parser.add_argument('--metric', default='p95_ms')
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for run in load_runs(args.kind):
+            print(f"{run['created']}  {run['commit']}{' (dirty)' if run['dirty'] else ''}  {json.dumps(run['meta'])}")
+        return 0
+    regressions = compare(args.kind, base=args.base, head=args.head, metric=args.metric, threshold=args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Deploy-time static asset build (run after `pip install`, see render.yaml):
+
+    python build_static.py
+
+Writes a precompressed .gz (and .br, when the brotli package is installed) next to every
+compressible file in static/ that shrinks by at least MIN_SAVING, and records each file's
+content hash in the asset manifest that versions url_for('static') links.
+"""
+import gzip
+import json
+import os
+import sys
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+import assets
+
+# A variant is only kept if it is at least this much smaller than the original.
+MIN_SAVING = 0.10
+
+VARIANT_SUFFIXES = tuple(suffix for _, suffix in assets.ENCODINGS)
+
+
+def _write_variant(path, suffix, data, original_size):
+    target = path + suffix
+    if len(data) > original_size * (1 - MIN_SAVING):
+        if os.path.exists(target):
+            os.remove(target)  # Stale variant from an earlier build
+        return False
+    tmp_path = target + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, target)
+    stat = os.stat(path)
+    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))  # Same Last-Modified as the original
+    return True
+
+
+def build(static_dir=assets.STATIC_DIR, manifest_path=assets.ASSET_MANIFEST_PATH):
+    manifest = {}
+    compressed = 0
+    for directory, subdirectories, filenames in os.walk(static_dir):
+        subdirectories[:] = [name for name in subdirectories if not name.startswith('.')]
+        for filename in filenames:
+            if filename.startswith('.') or filename.endswith(VARIANT_SUFFIXES):
+                continue
+            path = os.path.join(directory, filename)
+            if assets.is_private(path):
+                continue  # Never served from static/, so neither versioned nor precompressed
+            relative_path = os.path.relpath(path, static_dir).replace(os.sep, '/')
+            stat = os.stat(path)
+            manifest[relative_path] = {
+                'hash': assets.file_hash(path),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+            }
+
+            if os.path.splitext(filename)[1].lower() not in assets.COMPRESSIBLE_EXTENSIONS:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            if _write_variant(path, '.gz', gzip.compress(data, compresslevel=9, mtime=0), len(data)):
+                compressed += 1
+            if BROTLI_AVAILABLE:
+                _write_variant(path, '.br', brotli.compress(data, quality=11), len(data))
+
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    print(f"Hashed {len(manifest)} static files, precompressed {compressed}"
+          f"{'' if BROTLI_AVAILABLE else ' (gzip only: brotli is not installed)'}")
+    return manifest
+
+
+if __name__ == '__main__':
+    build(*sys.argv[1:2])
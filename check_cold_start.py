@@ -0,0 +1,67 @@
+"""
+Cold-start budget check for the non-report paths:
+
+    python check_cold_start.py
+
+In a fresh interpreter, imports the app and serves the first request to each route in
+COLD_ROUTES. Fails (exit status 1) if that takes longer than COLD_START_BUDGET_MS, or if any
+of HEAVY_MODULES got imported along the way: login, health checks and static files must not
+load the data layer. The best of a few runs is used so one noisy run doesn't fail the check.
+"""
+import json
+import os
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+
+COLD_START_BUDGET_MS = float(os.environ.get('COLD_START_BUDGET_MS', '1000'))
+RUNS = int(os.environ.get('COLD_START_RUNS', '3'))
+
+COLD_ROUTES = ['/health', '/health/live', '/auth/select_role', '/auth/login', '/static/style.css']
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'xlsxwriter']
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+client = app.app.test_client()
+statuses = {route: client.get(route).status_code for route in ROUTES}
+elapsed_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({'elapsed_ms': elapsed_ms, 'statuses': statuses,
+                  'heavy': [name for name in HEAVY if name in sys.modules]}))
+"""
+
+
+def probe():
+    """One cold start in a fresh interpreter; returns the probe's measurements."""
+    code = f"ROUTES = {COLD_ROUTES!r}\nHEAVY = {HEAVY_MODULES!r}\n" + _PROBE
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    results = [probe() for _ in range(RUNS)]
+    best = min(results, key=lambda result: result['elapsed_ms'])
+    print(f"Cold start (import + first request to {len(COLD_ROUTES)} routes): "
+          f"best {best['elapsed_ms']:.0f} ms of {RUNS} runs, budget {COLD_START_BUDGET_MS:.0f} ms")
+
+    failures = []
+    heavy = sorted({name for result in results for name in result['heavy']})
+    if heavy:
+        failures.append(f"heavy modules imported on the cold path: {', '.join(heavy)}")
+    if best['elapsed_ms'] > COLD_START_BUDGET_MS:
+        failures.append(f"{best['elapsed_ms']:.0f} ms is over the {COLD_START_BUDGET_MS:.0f} ms budget")
+    errors = {route: status for route, status in best['statuses'].items() if status >= 500}
+    if errors:
+        failures.append(f"server errors: {errors}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
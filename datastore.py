@@ -0,0 +1,354 @@
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import pandas as pd
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+import indexes
+import rollups
+import shared_frame
+
+# Filtered reports are slices of the shared frame; copy-on-write keeps a caller that
+# modifies its slice from corrupting the snapshot every other request is reading.
+pd.set_option('mode.copy_on_write', True)
+
+# --- Locations ---
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+DATA_CSV_PATH = os.environ.get('FINANCIAL_DATA_CSV', os.path.join(PROJECT_ROOT, 'data.csv'))
+CACHE_DIR = os.environ.get('FINANCIAL_DATA_CACHE_DIR', os.path.join(PROJECT_ROOT, '.cache'))
+
+# Bump whenever the cached frame's layout changes (sort order, dtypes) so stale caches are ignored.
+CACHE_FORMAT_VERSION = 3
+
+# How often (in seconds) a worker re-stats data.csv to look for changes.
+RELOAD_CHECK_INTERVAL = float(os.environ.get('FINANCIAL_DATA_RELOAD_INTERVAL', '5'))
+
+# Kept in CACHE_DIR: the data version of data.csv as of a given (mtime_ns, size), so workers
+# don't hash the whole file to find their segment, and the lock ingestion holds while it appends.
+VERSION_POINTER_FILE = 'financial-current.json'
+INGEST_LOCK_FILE = 'financial-ingest.lock'
+
+# --- Schema of data.csv ---
+CATEGORY_COLUMNS = ['Entity', 'Location', 'Associated Rep Name']
+# Money columns stay float64: the bonus report sums them, and float32 drifts by cents once
+# a month has a few hundred thousand rows.
+MONEY_COLUMNS = ['Reimbursement', 'COGS', 'Net', 'Commission']
+STRING_COLUMNS = ['Username', 'PatientID']
+DATE_COLUMN = 'Date'
+DATE_FORMAT = '%Y-%m-%d'
+
+CSV_DTYPES = {column: 'category' for column in CATEGORY_COLUMNS}
+CSV_DTYPES.update({column: 'float64' for column in MONEY_COLUMNS})
+CSV_DTYPES.update({column: 'object' for column in STRING_COLUMNS})
+CSV_DTYPES[DATE_COLUMN] = 'object'  # Parsed separately with a fixed format (much faster than inference)
+
+
+def _file_sha256(path, chunk_size=1024 * 1024):
+    """Hashes a file in chunks so large CSVs never have to fit in memory twice."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stat_fingerprint(path):
+    """Cheap change detector: (mtime_ns, size). None if the file is missing."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def read_financial_csv(path):
+    """Parses a financial CSV into the typed, columnar layout used throughout the app."""
+    df = pd.read_csv(path, dtype=CSV_DTYPES)
+    df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN], format=DATE_FORMAT, errors='coerce')
+    for column in STRING_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].str.strip()
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].cat.remove_unused_categories()
+    return df
+
+
+class FinancialData:
+    """An immutable, fully-loaded view of data.csv. Replaced wholesale on reload."""
+
+    def __init__(self, df, version, source_path, source_mtime_ns, usernames=None, partitions=None, bonus=None):
+        self.df = df
+        self.partitions = partitions if partitions is not None else indexes.PartitionIndex(df)
+        self.usernames = usernames if usernames is not None else indexes.UsernameIndex(df)
+        self.bonus = bonus if bonus is not None else rollups.BonusRollup(df)
+        self.version = version
+        self.source_path = source_path
+        self.source_mtime_ns = source_mtime_ns
+        self.loaded_at = time.time()
+
+    @property
+    def row_count(self):
+        return len(self.df)
+
+    @property
+    def periods(self):
+        """(year, month) of every period with dated rows, oldest first."""
+        return sorted(key for key in self.partitions.period_ranges if key != (indexes.MISSING, indexes.MISSING))
+
+    def index_stats(self):
+        """Sizes of the snapshot's indexes, for /health/ready."""
+        return {
+            'partitions': len(self.partitions.partitions),
+            'usernames': len(self.usernames.rows),
+            'bonus_periods': len(self.bonus.periods),
+        }
+
+    def with_appended_rows(self, df, usernames, added, version, source_mtime_ns):
+        """
+        The snapshot of df: this snapshot's frame with rows merged in by
+        indexes.merge_for_partitions, added mapping (entity, year, month) -> rows added. Partition
+        ranges are shifted rather than rebuilt, and only the bonus periods that got rows are
+        re-aggregated.
+        """
+        partitions = self.partitions.merged(df, added)
+        periods = sorted({(year, month) for _, year, month in added})
+        rows = [partitions.select(df, year=year, month=month) for year, month in periods]
+        bonus = self.bonus.updated(pd.concat(rows) if rows else df.iloc[0:0])
+        return FinancialData(df, version, self.source_path, source_mtime_ns, usernames, partitions, bonus)
+
+
+class FinancialDataStore:
+    """
+    Loads data.csv and hands out the current FinancialData snapshot.
+
+    The parsed frame and its Username index are written once to a segment under CACHE_DIR
+    (see shared_frame.py), keyed on the data version (the CSV's content hash, or for appended
+    data the version it extends plus the delta), and every worker memory-maps that segment
+    read-only: N workers share one physical copy, and restarts skip the CSV parse. New rows
+    are added with append() (see ingest.py) without re-parsing the history.
+    When the CSV changes (mtime/size differ) the next caller maps the new segment and swaps
+    the snapshot in; requests already holding the old snapshot keep the old mapping until
+    they finish. Without pyarrow each worker keeps its own parsed copy instead.
+    """
+
+    def __init__(self, csv_path=DATA_CSV_PATH, cache_dir=CACHE_DIR, check_interval=RELOAD_CHECK_INTERVAL):
+        self.csv_path = csv_path
+        self.cache_dir = cache_dir
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._fingerprint = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        """The snapshot handed out most recently, without checking the file (None before first load)."""
+        return self._snapshot
+
+    def get(self):
+        """Returns the current snapshot, loading or reloading it if data.csv changed."""
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - self._last_check < self.check_interval:
+            return snapshot
+
+        fingerprint = _stat_fingerprint(self.csv_path)
+        self._last_check = now
+        if snapshot is not None and fingerprint == self._fingerprint:
+            return snapshot
+        if snapshot is not None and self._ingest_in_progress():
+            return snapshot  # data.csv is being appended to; pick the new version up next time
+
+        with self._lock:
+            # Another thread may have finished the reload while we waited for the lock.
+            if self._snapshot is not None and fingerprint == self._fingerprint:
+                return self._snapshot
+            self._snapshot = self._load(fingerprint)
+            self._fingerprint = fingerprint
+            return self._snapshot
+
+    def reload(self):
+        """Forces a reload on the next get(), e.g. after the CSV was replaced in place."""
+        with self._lock:
+            self._fingerprint = None
+            self._last_check = 0.0
+
+    def _load(self, fingerprint):
+        if fingerprint is None:
+            raise FileNotFoundError(f"Financial data file not found: {self.csv_path}")
+
+        version = self._version_for(fingerprint)
+        mapped = self._open_segment(version)
+        if mapped is not None:
+            # A segment published by append() can be derived from the snapshot we already hold
+            lineage = shared_frame.read_lineage(self._segment_path(version))
+            if self._snapshot is not None and lineage and lineage.get('parent') == self._snapshot.version:
+                df, usernames = mapped
+                added = {(entity, year, month): count for entity, year, month, count in lineage['added']}
+                return self._snapshot.with_appended_rows(df, usernames, added, version, fingerprint[0])
+        if mapped is None:
+            df = indexes.sort_for_partitions(read_financial_csv(self.csv_path))
+            usernames = indexes.UsernameIndex(df)
+            if self._write_segment(version, df, usernames):
+                # Map what was just written so this worker shares pages with the others too
+                mapped = self._open_segment(version)
+            if mapped is None:
+                return FinancialData(df, version, self.csv_path, fingerprint[0], usernames)
+        df, usernames = mapped
+        return FinancialData(df, version, self.csv_path, fingerprint[0], usernames)
+
+    def append(self, delta, source=None):
+        """
+        Appends delta (new rows, typed like read_financial_csv's output) to data.csv and
+        publishes the result as a new data version, without re-parsing or re-sorting the rows
+        already loaded: they are merged with the delta into a new segment whose lineage names
+        the version it extends and the partitions that grew. Workers holding that version
+        then only shift their partition ranges and re-aggregate the affected bonus periods.
+        source (e.g. the delta file's hash) makes the new version unique. Returns the new snapshot.
+        """
+        with self._ingest_lock():
+            fingerprint = _stat_fingerprint(self.csv_path)
+            with self._lock:
+                if self._snapshot is None or fingerprint != self._fingerprint:
+                    self._snapshot = self._load(fingerprint)
+                    self._fingerprint = fingerprint
+                snapshot = self._snapshot
+
+            version = hashlib.sha256(f"{snapshot.version}:{source or time.time_ns()}".encode()).hexdigest()
+            self._write_appended(snapshot, delta, version)
+            self._append_csv(delta)
+            fingerprint = _stat_fingerprint(self.csv_path)
+            self._write_version_pointer(version, fingerprint)
+            with self._lock:
+                self._snapshot = self._load(fingerprint)
+                self._fingerprint = fingerprint
+                self._last_check = time.monotonic()
+                return self._snapshot
+
+    def _write_appended(self, snapshot, delta, version):
+        """Publishes the data of version: snapshot's rows plus delta, stored for _load() to find."""
+        df, old_positions, delta_positions, added = indexes.merge_for_partitions(
+            snapshot.df, snapshot.partitions, delta
+        )
+        delta_usernames = indexes.UsernameIndex(df.take(delta_positions))
+        usernames = snapshot.usernames.merged(old_positions, delta_usernames, delta_positions)
+        lineage = {
+            'parent': snapshot.version,
+            'added': [[entity, year, month, count] for (entity, year, month), count in sorted(
+                added.items(), key=lambda item: (item[0][0] or '', item[0][1], item[0][2]))],
+        }
+        self._write_segment(version, df, usernames, lineage)
+
+    def _append_csv(self, delta):
+        columns = pd.read_csv(self.csv_path, nrows=0).columns.tolist()  # data.csv's own column order
+        needs_newline = False
+        with open(self.csv_path, 'rb') as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n'
+        with open(self.csv_path, 'a', newline='', encoding='utf-8') as f:
+            if needs_newline:
+                f.write('\n')
+            delta[columns].to_csv(f, header=False, index=False, date_format=DATE_FORMAT)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # --- Version pointer and ingest lock ---
+    def _version_for(self, fingerprint):
+        """The data version of data.csv as it is now: from the pointer if it matches, else by hashing the file."""
+        try:
+            with open(os.path.join(self.cache_dir, VERSION_POINTER_FILE), encoding='utf-8') as f:
+                pointer = json.load(f)
+            if pointer.get('format') == CACHE_FORMAT_VERSION and (pointer['mtime_ns'], pointer['size']) == fingerprint:
+                return pointer['version']
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        version = _file_sha256(self.csv_path)
+        self._write_version_pointer(version, fingerprint)
+        return version
+
+    def _write_version_pointer(self, version, fingerprint):
+        path = os.path.join(self.cache_dir, VERSION_POINTER_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'format': CACHE_FORMAT_VERSION, 'version': version,
+                           'mtime_ns': fingerprint[0], 'size': fingerprint[1]}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write data version pointer {path}: {e}")
+
+    @contextlib.contextmanager
+    def _ingest_lock(self):
+        """Held (exclusively, across processes) while append() publishes a new version."""
+        if not FCNTL_AVAILABLE:
+            yield
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, INGEST_LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _ingest_in_progress(self):
+        if not FCNTL_AVAILABLE:
+            return False
+        try:
+            with open(os.path.join(self.cache_dir, INGEST_LOCK_FILE), 'r') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return True
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        except FileNotFoundError:
+            pass
+        return False
+
+    def _segment_path(self, version):
+        return os.path.join(self.cache_dir, f"financial-v{CACHE_FORMAT_VERSION}-{version[:16]}.segment")
+
+    def _open_segment(self, version):
+        if not shared_frame.ARROW_AVAILABLE:
+            return None
+        segment_path = self._segment_path(version)
+        if not os.path.isdir(segment_path):
+            return None
+        try:
+            return shared_frame.open_segment(segment_path)
+        except Exception as e:
+            print(f"Ignoring unreadable financial data segment {segment_path}: {e}")
+            return None
+
+    def _write_segment(self, version, df, usernames, lineage=None):
+        if not shared_frame.ARROW_AVAILABLE:
+            return False
+        segment_path = self._segment_path(version)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            shared_frame.write_segment(segment_path, df, usernames, lineage)
+        except Exception as e:
+            print(f"Could not write financial data segment {segment_path}: {e}")
+            return False
+        self._remove_stale_segments(segment_path)
+        return True
+
+    def _remove_stale_segments(self, keep_path):
+        # Safe while other workers still map them: unlinked files stay readable until unmapped
+        for path in glob.glob(os.path.join(self.cache_dir, 'financial-v*-*.segment')):
+            if path != keep_path:
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,37 @@
+import os
+import sqlite3
+import threading
+
+
+class ConnectionPool:
+    """
+    Hands out one SQLite connection per thread per process. A gunicorn worker forked from a
+    master that already opened the database gets fresh connections (SQLite handles must never
+    cross a fork). schema statements run once per pool, on the first connection.
+    """
+
+    def __init__(self, path, schema=()):
+        self.path = path
+        self.schema = list(schema)
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            local.connection.row_factory = sqlite3.Row
+            local.connection.execute('PRAGMA foreign_keys = ON')
+            local.connection.execute('PRAGMA journal_mode = WAL')  # Readers don't block the writer
+            local.pid = os.getpid()
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    for statement in self.schema:
+                        local.connection.execute(statement)
+                    self._schema_ready = True
+        return local.connection
@@ -0,0 +1,45 @@
+import csv
+import importlib.util
+import io
+
+# xlsxwriter is optional, and only imported once an Excel export is actually written.
+XLSX_AVAILABLE = importlib.util.find_spec('xlsxwriter') is not None
+
+# --- Export Formats ---
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def iter_csv(chunks, columns):
+    """Yields a CSV document piece by piece from an iterable of report frames."""
+    header = io.StringIO()
+    csv.writer(header, lineterminator='\n').writerow(columns)  # Same quoting as DataFrame.to_csv
+    yield header.getvalue()
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=False, date_format=DATE_FORMAT)
+
+
+def write_xlsx(chunks, columns, fileobj, sheet_name='Report'):
+    """
+    Writes an iterable of report frames to fileobj as an .xlsx workbook. xlsxwriter's
+    constant_memory mode flushes each row to disk as it goes, so memory stays flat.
+    """
+    if not XLSX_AVAILABLE:
+        raise RuntimeError("Excel export requires the 'xlsxwriter' package.")
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(fileobj, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd'})
+    worksheet = workbook.add_worksheet(sheet_name[:31])  # Excel caps sheet names at 31 characters
+    worksheet.write_row(0, 0, columns, workbook.add_format({'bold': True}))
+
+    row_number = 1
+    for chunk in chunks:
+        # Missing values (NaN/NaT) become blank cells
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for values in chunk.itertuples(index=False, name=None):
+            worksheet.write_row(row_number, 0, values)
+            row_number += 1
+    workbook.close()
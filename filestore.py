@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+
+from flask import abort, send_file
+
+import patient_catalog
+
+# --- Locations ---
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+STATIC_DIR = os.path.join(PROJECT_ROOT, 'static')
+
+# Download category -> directory its files are served from.
+DOWNLOAD_ROOTS = {
+    'reports': os.path.join(STATIC_DIR, 'reports'),
+    'marketing_material': os.path.join(STATIC_DIR, 'marketing_materials'),
+    'training_material': os.path.join(STATIC_DIR, 'training_materials'),
+    'patient_results': patient_catalog.PATIENT_REPORTS_DIR,  # Outside static/: patient data
+}
+
+# Categories that hold nothing user-specific, so shared proxies may cache them too.
+PUBLIC_CATEGORIES = {'marketing_material', 'training_material'}
+
+# How often (in seconds) a worker rescans the download directories for added or removed files.
+REFRESH_INTERVAL = float(os.environ.get('DOWNLOAD_REFRESH_INTERVAL', '30'))
+
+# Seconds a browser may reuse a download before revalidating it (a 304 via ETag/Last-Modified).
+DOWNLOAD_MAX_AGE = int(os.environ.get('DOWNLOAD_MAX_AGE', '300'))
+
+
+class FileEntry:
+    """One servable file: where it is, plus the validators sent with it."""
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+class DownloadManifest:
+    """
+    In-memory map of (category, relative path) -> FileEntry for everything under DOWNLOAD_ROOTS.
+    A download is a dict lookup: unknown names are a 404 without touching the disk, and nothing
+    is ever created. The directories are rescanned at most every refresh_interval seconds, so
+    files dropped in (or removed) show up without a restart.
+    """
+
+    def __init__(self, roots=DOWNLOAD_ROOTS, refresh_interval=REFRESH_INTERVAL):
+        self.roots = dict(roots)
+        self.refresh_interval = refresh_interval
+        self._files = {}
+        self._last_scan = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the current manifest, rescanning first if it is due."""
+        now = time.monotonic()
+        if self._last_scan is not None and now - self._last_scan < self.refresh_interval:
+            return self._files
+        if not self._lock.acquire(blocking=False):
+            return self._files  # Another thread is already scanning; serve what we have
+        try:
+            self._last_scan = now
+            self._files = self.scan()
+        finally:
+            self._lock.release()
+        return self._files
+
+    def scan(self):
+        files = {}
+        for category, root in self.roots.items():
+            for directory, subdirectories, filenames in os.walk(root):
+                subdirectories[:] = [name for name in subdirectories if not name.startswith('.')]
+                for filename in filenames:
+                    if filename.startswith('.'):
+                        continue
+                    path = os.path.join(directory, filename)
+                    relative_path = os.path.relpath(path, root).replace(os.sep, '/')
+                    try:
+                        files[(category, relative_path)] = FileEntry(path, os.stat(path))
+                    except FileNotFoundError:
+                        continue  # Removed while we were scanning
+        return files
+
+    def lookup(self, category, filename):
+        return self.get().get((category, filename))
+
+    def send(self, category, filename, as_attachment=False):
+        """Response for one download, or a 404 if the manifest doesn't list it."""
+        entry = self.lookup(category, filename)
+        if entry is None:
+            abort(404)
+        return send_entry(entry, public=category in PUBLIC_CATEGORIES, as_attachment=as_attachment)
+
+
+def send_entry(entry, public=False, as_attachment=False):
+    """
+    Serves a FileEntry through send_file (the server's sendfile/file wrapper) with ETag and
+    Last-Modified, so repeat requests are answered with 304 and byte ranges work.
+    """
+    try:
+        response = send_file(
+            entry.path,
+            as_attachment=as_attachment,
+            conditional=True,
+            etag=entry.etag,
+            last_modified=entry.mtime,
+            max_age=DOWNLOAD_MAX_AGE,
+        )
+    except FileNotFoundError:
+        abort(404)  # Deleted since the last scan
+    if not public:
+        # send_file marks everything public once max_age is set; keep these out of shared caches
+        response.cache_control.public = False
+        response.cache_control.private = True
+    return response
+
+
+downloads = DownloadManifest()
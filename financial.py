@@ -0,0 +1,189 @@
+"""
+The pandas-backed financial data layer: the shared snapshot, report filters, the monthly bonus
+and report pagination. Imported lazily through models (see models.FINANCIAL_ATTRIBUTES), so
+only requests that actually build a report load pandas and NumPy.
+"""
+import math
+import os
+
+import datastore
+import indexes
+import metrics
+import models
+import parquetstore
+
+# --- Financial Data ---
+# data.csv is parsed once and memory-mapped by every worker (see datastore.py), and reloaded
+# when the file changes. Read it through models.data_df or get_financial_data(); never cache the
+# frame across requests.
+# With FINANCIAL_DATA_BACKEND=parquet the rows stay on disk instead (see parquetstore.py):
+# models.data_df is then a FinancialScan, which the functions below accept wherever they take df.
+FINANCIAL_DATA_BACKEND = os.environ.get('FINANCIAL_DATA_BACKEND', 'memory')
+if FINANCIAL_DATA_BACKEND == 'parquet':
+    financial_store = parquetstore.ParquetFinancialDataStore()
+elif FINANCIAL_DATA_BACKEND == 'memory':
+    financial_store = datastore.FinancialDataStore()
+else:
+    raise ValueError(f"Unknown FINANCIAL_DATA_BACKEND {FINANCIAL_DATA_BACKEND!r} (expected 'memory' or 'parquet')")
+
+def get_financial_data():
+    """Returns the current FinancialData snapshot (frame plus version metadata)."""
+    return financial_store.get()
+
+# Helper to filter financial data based on entity, month, year, and username
+def filter_financial_data(df, selected_entity, selected_month, selected_year, current_username=None, entity_filter_enabled=True):
+    """
+    Filters are answered from the snapshot's (Entity, year, month) partition index and Username
+    index when df is the live models.data_df, so only the requested partitions are touched.
+    The result may be a view of the shared frame: treat it as read-only.
+    """
+    entity, year, month = _partition_filter(selected_entity, selected_month, selected_year, entity_filter_enabled)
+
+    # For 'monthly_bonus' report, filter by the associated username
+    username = current_username if current_username and current_username not in models.UNFILTERED_ACCESS_USERS else None
+
+    if isinstance(df, parquetstore.FinancialScan):
+        # Entity and period pick partition files; the username is matched while they are read
+        scan = df.where(entity=entity, year=year, month=month, username=username)
+        metrics.record_rows(scan.rows_scanned, len(scan))
+        return scan
+
+    snapshot = financial_store.current
+    if snapshot is not None and df is snapshot.df:
+        spans = snapshot.partitions.ranges(entity=entity, year=year, month=month)
+        if username:
+            # The 'Username' column may hold several comma-separated usernames; the snapshot's
+            # inverted index already knows which rows each one appears in.
+            filtered_df = snapshot.usernames.take(df, username, spans)
+        else:
+            filtered_df = snapshot.partitions.select(df, entity=entity, year=year, month=month)
+        # Only the matching partitions are looked at, not the whole frame
+        metrics.record_rows(len(df) if spans is None else sum(stop - start for start, stop in spans), len(filtered_df))
+        return filtered_df
+
+    # Frames that did not come from the store (ad-hoc or test data) have no index.
+    filtered_df = df
+    if entity:
+        filtered_df = filtered_df[filtered_df['Entity'] == entity]
+    if month:
+        filtered_df = filtered_df[
+            (filtered_df['Date'].dt.month == int(month)) &
+            (filtered_df['Date'].dt.year == int(year))
+        ]
+    if username and 'Username' in filtered_df.columns:
+        filtered_df = indexes.UsernameIndex(filtered_df).take(filtered_df, username)
+
+    metrics.record_rows(len(df), len(filtered_df))
+    return filtered_df
+
+
+def _partition_filter(selected_entity, selected_month, selected_year, entity_filter_enabled=True):
+    entity = selected_entity if selected_entity and selected_entity != 'All Entities' and entity_filter_enabled else None
+    month, year = (selected_month, selected_year) if selected_month and selected_year else (None, None)
+    return entity, year, month
+
+
+def count_partition_rows(selected_entity, selected_month, selected_year):
+    """
+    Rows in the (Entity, year, month) partitions a report filter covers, before any username
+    filter: a cheap upper bound on how much work the report is, read from the indexes alone.
+    """
+    entity, year, month = _partition_filter(selected_entity, selected_month, selected_year)
+    snapshot = financial_store.get()
+    if isinstance(snapshot.df, parquetstore.FinancialScan):
+        return snapshot.df.where(entity=entity, year=year, month=month).rows_scanned
+    spans = snapshot.partitions.ranges(entity=entity, year=year, month=month)
+    return snapshot.row_count if spans is None else sum(stop - start for start, stop in spans)
+
+
+def get_monthly_bonus(selected_month, selected_year, current_username=None, entities=None):
+    """
+    Monthly bonus totals per (Associated Rep Name, Entity), read from the snapshot's bonus cube.
+    Users outside UNFILTERED_ACCESS_USERS only see rows tagged with their username; entities,
+    when given, limits the result to those entities.
+    """
+    username = current_username if current_username and current_username not in models.UNFILTERED_ACCESS_USERS else None
+    bonus = financial_store.get().bonus
+    bonus_data = bonus.monthly_bonus(selected_year, selected_month, username=username, entities=entities)
+    metrics.record_rows(bonus.rows_in_period(selected_year, selected_month), len(bonus_data))
+    return bonus_data
+
+
+# --- Report Pagination ---
+# Generic reports are sorted and sliced on the filtered frame; only the rows actually shown
+# are ever turned into dicts, so a page costs the same whether the filter matched 10 rows or 10M.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+STREAM_CHUNK_SIZE = 1000
+
+def _report_order(df, sort_by=None, descending=False):
+    """Row positions of df in display order, or None to keep the frame's own order."""
+    if not sort_by or sort_by not in df.columns:
+        return None
+    column = df[sort_by].reset_index(drop=True)
+    return column.sort_values(ascending=not descending, kind='stable', na_position='last').index.to_numpy()
+
+def _report_records(rows, columns):
+    """Converts a (small) slice of report rows to the list of dicts the templates render."""
+    rows = rows[columns]
+    if 'Date' in columns:
+        rows = rows.assign(Date=rows['Date'].dt.strftime('%Y-%m-%d'))
+    return rows.to_dict(orient='records')
+
+def _report_rows(df, positions, start, stop):
+    return df.iloc[start:stop] if positions is None else df.take(positions[start:stop])
+
+def normalize_report_args(columns, sort_by=None, descending=False, page=1, per_page=DEFAULT_PAGE_SIZE, total_rows=None):
+    """
+    Returns (sort_by, descending, page, per_page) as a report applies them: sort_by must be one
+    of columns (anything else keeps the natural (Entity, Date) order), per_page is capped at
+    MAX_PAGE_SIZE and page is clamped to the pages total_rows fill (when it is known).
+    """
+    sort_by = sort_by if sort_by in columns else None
+    descending = bool(descending) and sort_by is not None
+    per_page = max(1, min(per_page or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    page = max(1, page or 1)
+    if total_rows is not None:
+        page = min(page, max(1, math.ceil(total_rows / per_page)))
+    return sort_by, descending, page, per_page
+
+def paginate_report(df, columns, page=1, per_page=DEFAULT_PAGE_SIZE, sort_by=None, descending=False):
+    """
+    Returns (records, pagination) for one page of a generic report, after normalize_report_args.
+    """
+    total_rows = len(df)
+    sort_by, descending, page, per_page = normalize_report_args(columns, sort_by, descending, page, per_page, total_rows)
+    page_count = max(1, math.ceil(total_rows / per_page))
+    start = (page - 1) * per_page
+
+    if isinstance(df, parquetstore.FinancialScan):
+        rows = df.page(columns, start, start + per_page, sort_by=sort_by, descending=descending)
+    else:
+        rows = _report_rows(df, _report_order(df, sort_by, descending), start, start + per_page)
+    records = _report_records(rows, columns)
+    pagination = {
+        'page': page,
+        'per_page': per_page,
+        'page_count': page_count,
+        'total_rows': total_rows,
+        'sort_by': sort_by,
+        'descending': descending,
+        'has_prev': page > 1,
+        'has_next': page < page_count,
+    }
+    return records, pagination
+
+def iter_report_chunks(df, columns, sort_by=None, descending=False, chunk_size=STREAM_CHUNK_SIZE):
+    """Yields the report's columns in display order as frames of at most chunk_size rows."""
+    sort_by = sort_by if sort_by in columns else None
+    if isinstance(df, parquetstore.FinancialScan):
+        yield from df.iter_chunks(columns, chunk_size, sort_by=sort_by, descending=descending)
+        return
+    positions = _report_order(df, sort_by, descending)
+    for start in range(0, len(df), chunk_size):
+        yield _report_rows(df, positions, start, start + chunk_size)[columns]
+
+def iter_report_records(df, columns, sort_by=None, descending=False, chunk_size=STREAM_CHUNK_SIZE):
+    """Yields every report row as a dict, converting chunk_size rows at a time (for streaming)."""
+    for chunk in iter_report_chunks(df, columns, sort_by, descending, chunk_size):
+        yield from _report_records(chunk, columns)
@@ -0,0 +1,61 @@
+"""
+gunicorn settings for the portal (gunicorn -c gunicorn.conf.py wsgi:app). Every value can be
+overridden from the environment, so render.yaml only has to set what differs per instance.
+"""
+import gc
+import multiprocessing
+import os
+
+import jobs
+
+wsgi_app = 'wsgi:app'
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+
+# --- Preload and fork ---
+# wsgi.py (imports, financial snapshot, indexes, templates) runs once in the master; workers
+# are forked from it and share those pages copy-on-write, so a worker boots in milliseconds.
+preload_app = True
+
+# --- Workers ---
+# RAM, not CPU, caps the worker count here, so stay at a couple of processes and get
+# concurrency from threads: report requests spend much of their time in pandas/NumPy and
+# SQLite, which release the GIL.
+workers = int(os.environ.get('WEB_CONCURRENCY', min(2, multiprocessing.cpu_count() * 2)))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+
+# Recycle workers now and then to cap slow leaks; the jitter keeps them from restarting together.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+
+# --- Background jobs ---
+# Large reports and exports run in a job runner forked from the master (see jobs.py) rather
+# than in the web workers; the master restarts it if it dies. Set JOB_RUNNER=0 when it runs
+# as a separate service instead.
+job_runner_enabled = os.environ.get('JOB_RUNNER', '1') == '1'
+job_runner = None  # jobs.RunnerSupervisor
+
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    # Everything loaded by the preload is long-lived: move it out of the garbage collector's
+    # view so collections in the workers don't touch (and so copy) those shared pages.
+    gc.collect()
+    gc.freeze()
+
+    if job_runner_enabled:
+        global job_runner
+        job_runner = jobs.RunnerSupervisor(log=server.log.warning)
+        job_runner.start()
+        server.log.info(f"Started job runner (pid {job_runner.pid})")
+
+
+def on_exit(server):
+    if job_runner is not None:
+        job_runner.stop(timeout=graceful_timeout)
@@ -0,0 +1,236 @@
+import bisect
+
+import numpy as np
+import pandas as pd
+
+# Partition key used for rows whose Date (or Entity) is missing.
+MISSING = 0
+
+
+def _partition_keys(df):
+    """Returns (entity_codes, years, months) as int arrays; missing values map to -1 / MISSING."""
+    entity_codes = df['Entity'].cat.codes.to_numpy()
+    dates = df['Date']
+    years = dates.dt.year.fillna(MISSING).to_numpy(dtype='int32')
+    months = dates.dt.month.fillna(MISSING).to_numpy(dtype='int32')
+    return entity_codes, years, months
+
+
+def sort_for_partitions(df):
+    """Orders rows by (Entity, year, month, Date) so every partition is one contiguous slice."""
+    entity_codes, years, months = _partition_keys(df)
+    order = np.lexsort((df['Date'].to_numpy(), months, years, entity_codes))
+    return df.take(order).reset_index(drop=True)
+
+
+class PartitionIndex:
+    """
+    Maps (Entity, year, month) to a [start, stop) row range of a frame sorted with
+    sort_for_partitions, so a dashboard request only slices its own partition.
+    """
+
+    def __init__(self, df):
+        entity_codes, years, months = _partition_keys(df)
+        categories = df['Entity'].cat.categories
+        row_count = len(df)
+
+        if row_count:
+            changed = (np.diff(entity_codes) != 0) | (np.diff(years) != 0) | (np.diff(months) != 0)
+            starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+        else:
+            starts = np.array([], dtype='int64')
+        stops = np.concatenate((starts[1:], [row_count])) if row_count else starts
+
+        spans = []
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            code = entity_codes[start]
+            spans.append(((categories[code] if code >= 0 else None, int(years[start]), int(months[start])), start, stop))
+        self._set_spans(spans)
+
+    def _set_spans(self, spans):
+        """spans: ((entity, year, month), start, stop) in row order."""
+        self.partitions = {}    # (entity, year, month) -> (start, stop)
+        self.entity_ranges = {}  # entity -> (start, stop) covering all of its months
+        self.period_ranges = {}  # (year, month) -> [(start, stop), ...] one per entity
+        for (entity, year, month), start, stop in spans:
+            self.partitions[(entity, year, month)] = (start, stop)
+            first, _ = self.entity_ranges.get(entity, (start, stop))
+            self.entity_ranges[entity] = (first, stop)
+            self.period_ranges.setdefault((year, month), []).append((start, stop))
+
+    def merged(self, df, added):
+        """
+        The index of df, the frame this index covers with rows merged in by merge_for_partitions.
+        added maps (entity, year, month) -> number of rows added to that partition. Only
+        partition sizes are updated; no row of df is looked at except for Entity's categories.
+        """
+        sizes = {key: stop - start for key, (start, stop) in self.partitions.items()}
+        for key, count in added.items():
+            sizes[key] = sizes.get(key, 0) + count
+        codes = {entity: code for code, entity in enumerate(df['Entity'].cat.categories)}
+        codes[None] = -1
+        index = PartitionIndex.__new__(PartitionIndex)
+        spans, start = [], 0
+        for key in sorted(sizes, key=lambda key: (codes[key[0]], key[1], key[2])):
+            spans.append((key, start, start + sizes[key]))
+            start += sizes[key]
+        index._set_spans(spans)
+        return index
+
+    def ranges(self, entity=None, year=None, month=None):
+        """
+        Row ranges matching the given filters. None means "don't filter on this key";
+        month and year must be given together.
+        """
+        if year is not None and month is not None:
+            key = (int(year), int(month))
+            if entity is not None:
+                span = self.partitions.get((entity,) + key)
+                return [span] if span else []
+            return list(self.period_ranges.get(key, []))
+        if entity is not None:
+            span = self.entity_ranges.get(entity)
+            return [span] if span else []
+        return None  # No filter: the whole frame
+
+    def select(self, df, entity=None, year=None, month=None):
+        """Returns the matching rows as slices of df (no copy unless several partitions are combined)."""
+        spans = self.ranges(entity, year, month)
+        if spans is None:
+            return df
+        if not spans:
+            return df.iloc[0:0]
+        if len(spans) == 1:
+            start, stop = spans[0]
+            return df.iloc[start:stop]
+        return pd.concat([df.iloc[start:stop] for start, stop in spans])
+
+
+def merge_for_partitions(df, partitions, delta):
+    """
+    Merges the rows of delta (same columns as df) into df, a frame sorted with
+    sort_for_partitions and indexed by partitions, without re-sorting df: each delta row goes
+    after the df rows of its partition whose Date is earlier or equal, just where a full sort
+    of the appended file would put it. Category values new in delta are appended to df's
+    categories, so df's codes (and the order of its partitions) keep their meaning.
+
+    Returns (merged, old_positions, delta_positions, added): the merged frame, the merged
+    position of every df row and of every row of the sorted delta, and the number of rows
+    added per (entity, year, month) partition.
+    """
+    categories = {}
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            known = df[column].cat.categories
+            extra = pd.Index(delta[column].dropna().unique()).difference(known, sort=False)
+            categories[column] = known.append(extra)
+    df = df.assign(**{column: df[column].cat.set_categories(values) for column, values in categories.items()})
+    delta = sort_for_partitions(delta[df.columns].assign(**{
+        column: pd.Categorical(delta[column], categories=values) for column, values in categories.items()
+    }))
+
+    entities = categories['Entity']
+    def sort_key(key):
+        return (-1 if key[0] is None else entities.get_loc(key[0]), key[1], key[2])
+    existing = sorted((sort_key(key), start) for key, (start, _) in partitions.partitions.items())
+    existing_keys = [key for key, _ in existing]
+
+    # Where each delta row goes, counted in df rows that sort before it
+    df_dates = df['Date'].to_numpy(dtype='datetime64[ns]').view('int64')
+    delta_dates = delta['Date'].to_numpy(dtype='datetime64[ns]').view('int64')
+    delta_codes, delta_years, delta_months = _partition_keys(delta)
+    insert_at = np.empty(len(delta), dtype='int64')
+    added = {}
+    if len(delta):
+        changed = (np.diff(delta_codes) != 0) | (np.diff(delta_years) != 0) | (np.diff(delta_months) != 0)
+        firsts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+        for first, last in zip(firsts.tolist(), np.append(firsts[1:], len(delta)).tolist()):
+            code = int(delta_codes[first])
+            key = (entities[code] if code >= 0 else None, int(delta_years[first]), int(delta_months[first]))
+            added[key] = last - first
+            span = partitions.partitions.get(key)
+            if span is not None:
+                start, stop = span
+                insert_at[first:last] = start + np.searchsorted(df_dates[start:stop], delta_dates[first:last], side='right')
+            else:
+                # A new partition starts where the first existing partition sorting after it starts
+                following = bisect.bisect_right(existing_keys, sort_key(key))
+                insert_at[first:last] = existing[following][1] if following < len(existing) else len(df)
+
+    delta_positions = insert_at + np.arange(len(delta), dtype='int64')
+    old_positions = np.arange(len(df), dtype='int64') + np.searchsorted(insert_at, np.arange(len(df)), side='right')
+    order = np.empty(len(df) + len(delta), dtype='int64')
+    order[old_positions] = np.arange(len(df))
+    order[delta_positions] = len(df) + np.arange(len(delta))
+    merged = pd.concat([df, delta], ignore_index=True).take(order).reset_index(drop=True)
+    return merged, old_positions, delta_positions, added
+
+
+# --- Username membership ---
+# The Username column holds one or more usernames separated by commas ("SatishD,ACG"),
+# sometimes with stray spaces. explode_usernames is the only tokenizer for it.
+USERNAME_DELIMITER = ','
+_NO_ROWS = np.array([], dtype='int64')
+
+
+def explode_usernames(usernames):
+    """Returns (row_positions, usernames) with one entry per (row, username) pair."""
+    tokens = usernames.reset_index(drop=True).str.split(USERNAME_DELIMITER).explode().str.strip()
+    tokens = tokens[tokens.notna() & (tokens != '')]
+    return tokens.index.to_numpy(dtype='int64'), tokens.to_numpy(dtype=object)
+
+
+class UsernameIndex:
+    """Inverted index from username to the sorted row positions tagged with it."""
+
+    def __init__(self, df):
+        positions, names = explode_usernames(df['Username'])
+        self.rows = {}
+        if not len(positions):
+            return
+        codes, uniques = pd.factorize(names)
+        order = np.argsort(codes, kind='stable')  # Stable: positions stay ascending within a user
+        boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+        for group in np.split(order, boundaries):
+            self.rows[uniques[codes[group[0]]]] = positions[group]
+
+    @classmethod
+    def from_arrays(cls, usernames, offsets, positions):
+        """Rebuilds an index from to_arrays() output; rows are views into positions (no copy)."""
+        index = cls.__new__(cls)
+        index.rows = {username: positions[offsets[i]:offsets[i + 1]] for i, username in enumerate(usernames)}
+        return index
+
+    def to_arrays(self):
+        """(usernames, offsets, positions): every user's rows concatenated, user i at offsets[i]:offsets[i + 1]."""
+        usernames = list(self.rows)
+        lengths = [len(self.rows[username]) for username in usernames]
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype='int64'))).astype('int64')
+        positions = np.concatenate([self.rows[username] for username in usernames]) if usernames else _NO_ROWS
+        return usernames, offsets, positions
+
+    def merged(self, old_positions, delta_index, delta_positions):
+        """
+        The index of a frame merged by merge_for_partitions: this index's rows and delta_index's
+        (built over the sorted delta) moved to their merged positions.
+        """
+        index = UsernameIndex.__new__(UsernameIndex)
+        index.rows = {username: old_positions[rows] for username, rows in self.rows.items()}
+        for username, rows in delta_index.rows.items():
+            moved = delta_positions[rows]
+            index.rows[username] = np.sort(np.concatenate((index.rows[username], moved))) if username in index.rows else moved
+        return index
+
+    def positions(self, username, spans=None):
+        """Row positions for username, optionally limited to [start, stop) row ranges."""
+        rows = self.rows.get(username, _NO_ROWS)
+        if spans is None:
+            return rows
+        if not spans:
+            return _NO_ROWS
+        return np.concatenate([rows[np.searchsorted(rows, start):np.searchsorted(rows, stop)]
+                               for start, stop in spans])
+
+    def take(self, df, username, spans=None):
+        """The rows of df (the frame this index was built from) tagged with username."""
+        return df.take(self.positions(username, spans))
@@ -0,0 +1,186 @@
+"""
+Appends new financial rows (e.g. a new month of billing data) to data.csv while the app runs:
+
+    python ingest.py delta-2025-06.csv [more.csv ...]
+    python ingest.py --drop-dir incoming/ [--watch]
+
+A delta file has data.csv's columns, in any order. Every row must have a valid Date
+(YYYY-MM-DD), a known Entity and numeric money columns; a file with any bad row is rejected
+as a whole, with the offending lines listed. Accepted rows are appended to data.csv and
+published as a new data version (see FinancialDataStore.append): running workers pick it up on
+their next data.csv check without a restart, and only re-index the partitions that grew.
+
+Files in the drop directory are processed in name order and moved to processed/ or to
+rejected/ (next to a .errors.txt saying why). Each file's hash goes into a ledger next to
+data.csv, so the same delta is never appended twice (--force overrides).
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import pandas as pd
+
+import datastore
+import financial
+import models
+
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+INGEST_DROP_DIR = os.environ.get('INGEST_DROP_DIR', os.path.join(PROJECT_ROOT, 'incoming'))
+# How often (in seconds) --watch looks for new files, and how long a file must have been left
+# alone before it is picked up (so half-copied files are not read).
+INGEST_POLL_INTERVAL = float(os.environ.get('INGEST_POLL_INTERVAL', '10'))
+INGEST_MIN_FILE_AGE = float(os.environ.get('INGEST_MIN_FILE_AGE', '5'))
+
+EXPECTED_COLUMNS = set(datastore.CATEGORY_COLUMNS + datastore.MONEY_COLUMNS + datastore.STRING_COLUMNS + [datastore.DATE_COLUMN])
+MAX_REPORTED_PROBLEMS = 20
+
+
+class IngestError(Exception):
+    """A delta file that can't be appended; problems lists why (one line each)."""
+
+    def __init__(self, path, problems):
+        super().__init__(f"{path}: {'; '.join(problems)}")
+        self.path = path
+        self.problems = problems
+
+
+def _ledger_path(store):
+    return store.csv_path + '.ingested.jsonl'
+
+
+def _ingested_digests(store):
+    try:
+        with open(_ledger_path(store), encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return {}
+    return {entry['sha256']: entry for entry in entries}
+
+
+def validate_delta(path):
+    """Returns the rows of path typed like data.csv, or raises IngestError listing every problem found."""
+    raw = pd.read_csv(path, dtype=str, keep_default_na=False)
+    raw.columns = raw.columns.str.strip()
+    missing = EXPECTED_COLUMNS - set(raw.columns)
+    unexpected = set(raw.columns) - EXPECTED_COLUMNS
+    if missing or unexpected:
+        problems = []
+        if missing:
+            problems.append(f"missing columns: {', '.join(sorted(missing))}")
+        if unexpected:
+            problems.append(f"unexpected columns: {', '.join(sorted(unexpected))}")
+        raise IngestError(path, problems)
+    if raw.empty:
+        raise IngestError(path, ['no rows'])
+
+    values = raw.apply(lambda column: column.str.strip())
+    invalid = {
+        datastore.DATE_COLUMN: pd.to_datetime(values[datastore.DATE_COLUMN], format=datastore.DATE_FORMAT, errors='coerce').isna(),
+        'Entity': ~values['Entity'].isin(models.MASTER_ENTITIES),
+    }
+    for column in datastore.MONEY_COLUMNS:
+        invalid[column] = pd.to_numeric(values[column], errors='coerce').isna()
+
+    problems = []
+    for column, mask in invalid.items():
+        for position in mask.to_numpy().nonzero()[0][:MAX_REPORTED_PROBLEMS]:
+            problems.append(f"line {position + 2}: invalid {column} {values[column].iat[position]!r}")
+    if problems:
+        total = sum(int(mask.sum()) for mask in invalid.values())
+        if total > len(problems):
+            problems.append(f"... {total - len(problems)} more")
+        raise IngestError(path, problems)
+    return datastore.read_financial_csv(path)
+
+
+def ingest_file(path, store=None, force=False):
+    """Validates path and appends it to the store (the app's by default). Returns the new snapshot."""
+    store = store or financial.financial_store
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    previous = _ingested_digests(store).get(digest)
+    if previous and not force:
+        raise IngestError(path, [f"already ingested at {previous['ingested_at']} (from {previous['file']})"])
+
+    delta = validate_delta(path)
+    started = time.perf_counter()
+    snapshot = store.append(delta, source=digest)
+    with open(_ledger_path(store), 'a', encoding='utf-8') as f:
+        f.write(json.dumps({
+            'sha256': digest, 'file': os.path.basename(path), 'rows': len(delta), 'version': snapshot.version,
+            'ingested_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        }) + '\n')
+    print(f"Ingested {len(delta):,} rows from {path} in {time.perf_counter() - started:.2f} s: "
+          f"data version {snapshot.version[:16]}, {snapshot.row_count:,} rows")
+    return snapshot
+
+
+def process_drop_dir(directory=INGEST_DROP_DIR, store=None, force=False):
+    """Ingests every settled *.csv in directory; returns (ingested, rejected) counts."""
+    ingested = rejected = 0
+    now = time.time()
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.lower().endswith('.csv') or not os.path.isfile(path):
+            continue
+        if now - os.path.getmtime(path) < INGEST_MIN_FILE_AGE:
+            continue  # Possibly still being copied in
+        try:
+            ingest_file(path, store=store, force=force)
+        except (IngestError, ValueError) as e:  # ValueError: not parseable as CSV at all
+            problems = _problems(e)
+            print(f"Rejected {path}: {'; '.join(problems)}")
+            _move(path, os.path.join(directory, 'rejected'))
+            with open(os.path.join(directory, 'rejected', name + '.errors.txt'), 'w', encoding='utf-8') as f:
+                f.write('\n'.join(problems) + '\n')
+            rejected += 1
+        else:
+            _move(path, os.path.join(directory, 'processed'))
+            ingested += 1
+    return ingested, rejected
+
+
+def _problems(error):
+    return error.problems if isinstance(error, IngestError) else [str(error)]
+
+
+def _move(path, directory):
+    os.makedirs(directory, exist_ok=True)
+    shutil.move(path, os.path.join(directory, os.path.basename(path)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Append new rows to data.csv without restarting the app.')
+    parser.add_argument('files', nargs='*', help='delta CSV files, ingested in the order given')
+    parser.add_argument('--drop-dir', nargs='?', const=INGEST_DROP_DIR, help=f"process a drop directory (default {INGEST_DROP_DIR})")
+    parser.add_argument('--watch', action='store_true', help='keep polling the drop directory')
+    parser.add_argument('--force', action='store_true', help='append files even if they were ingested before')
+    args = parser.parse_args(argv)
+    if not args.files and not args.drop_dir:
+        parser.error('give delta files or --drop-dir')
+
+    failed = 0
+    for path in args.files:
+        try:
+            ingest_file(path, force=args.force)
+        except (IngestError, ValueError) as e:
+            print(f"Rejected {path}: {'; '.join(_problems(e))}")
+            failed += 1
+    if args.drop_dir:
+        os.makedirs(args.drop_dir, exist_ok=True)
+        while True:
+            _, rejected = process_drop_dir(args.drop_dir, force=args.force)
+            failed += rejected
+            if not args.watch:
+                break
+            time.sleep(INGEST_POLL_INTERVAL)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,483 @@
+"""
+Background jobs for heavy reports and exports. Web workers only enqueue a job and poll its
+state; a runner process claims queued jobs and executes them in a process pool, writing each
+result to a file that later requests for the same work are served from.
+
+Under gunicorn the runner is forked from the master once the app is preloaded (see
+gunicorn.conf.py), so its pool processes start with the financial snapshot already loaded.
+Elsewhere run it next to the app:
+
+    python jobs.py [--workers N]
+
+The queue is a SQLite database shared by every process on the host. Jobs are deduplicated by
+their parameters: asking for a report that is already queued, running or done (and not yet
+expired) returns that job instead of starting another. Without a live runner, callers are
+expected to do the work inline (see runner_alive).
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+import db
+
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', os.path.join(PROJECT_ROOT, '.cache', 'jobs.db'))
+JOB_RESULTS_DIR = os.environ.get('JOB_RESULTS_DIR', os.path.join(PROJECT_ROOT, '.cache', 'jobs'))
+# Processes in the runner's pool, i.e. how many jobs run at once.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# How often (in seconds) the runner looks for queued jobs and refreshes its heartbeat.
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '0.5'))
+# How long (in seconds) a finished result is served to repeat requests before it is rebuilt.
+JOB_RESULT_TTL = float(os.environ.get('JOB_RESULT_TTL', '3600'))
+# A failed job stays on record (for its progress page) this long; asking again retries at once.
+JOB_FAILURE_TTL = float(os.environ.get('JOB_FAILURE_TTL', '60'))
+# A job whose runner died under it is queued again until it has been started this many times.
+JOB_MAX_ATTEMPTS = 3
+# The runner counts as alive while its heartbeat is younger than this (in seconds).
+RUNNER_HEARTBEAT_TIMEOUT = max(5.0, JOB_POLL_INTERVAL * 10)
+# How often (in seconds) the runner deletes expired jobs and their result files.
+PRUNE_INTERVAL = 60
+# How often (in seconds) a RunnerSupervisor checks that its runner is still up.
+RUNNER_WATCH_INTERVAL = float(os.environ.get('JOB_RUNNER_WATCH_INTERVAL', '5'))
+# Characters per piece when a text result is streamed back out.
+RESULT_CHUNK_SIZE = 64 * 1024
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL,
+        cache_key TEXT NOT NULL,
+        state TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        runner_pid INTEGER,
+        error TEXT,
+        result_path TEXT,
+        result_name TEXT,
+        result_mimetype TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_jobs_cache_key ON jobs (cache_key, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created_at)",
+    """
+    CREATE TABLE IF NOT EXISTS runners (
+        pid INTEGER PRIMARY KEY,
+        heartbeat_at REAL NOT NULL
+    )
+    """,
+]
+
+
+class JobPending(Exception):
+    """Raised instead of a result while job is queued or running (or has failed)."""
+
+    def __init__(self, job):
+        super().__init__(f"job {job['id']} is {job['state']}")
+        self.job = job
+
+
+# --- Handlers ---
+# kind -> handler(params, fileobj): writes the result to the binary fileobj and returns
+# (download_name, mimetype). Handlers are registered at import time by the modules that own
+# the work (see reports.py), so the runner imports the app before it starts.
+_handlers = {}
+_app = None
+
+
+def handler(kind):
+    def decorator(f):
+        _handlers[kind] = f
+        return f
+    return decorator
+
+
+def init_app(app):
+    """Lets handlers run inside a request context of app (templates use url_for)."""
+    global _app
+    _app = app
+
+
+# --- Queue ---
+def _job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    return job
+
+
+def _cache_key(kind, params):
+    return hashlib.sha256(json.dumps([kind, params], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class JobQueue:
+    def __init__(self, db_path=JOB_DB_PATH, results_dir=JOB_RESULTS_DIR):
+        self.results_dir = results_dir
+        self._pool = db.ConnectionPool(db_path, SCHEMA)
+
+    def submit(self, kind, params):
+        """
+        Returns the job for (kind, params): an existing one that is queued, running or done with
+        its result still on disk, or else a newly queued one (so a failed job is retried).
+        """
+        cache_key = _cache_key(kind, params)
+        now = time.time()
+        connection = self._pool.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            job = _job(connection.execute(
+                'SELECT * FROM jobs WHERE cache_key = ? ORDER BY created_at DESC LIMIT 1', (cache_key,)
+            ).fetchone())
+            if job is None or not self._reusable(job, now):
+                job_id = uuid.uuid4().hex
+                connection.execute(
+                    'INSERT INTO jobs (id, kind, params, cache_key, state, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                    (job_id, kind, json.dumps(params, sort_keys=True), cache_key, QUEUED, now)
+                )
+                job = _job(connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return job
+
+    @staticmethod
+    def _reusable(job, now):
+        if job['state'] in (QUEUED, RUNNING):
+            return True
+        if job['state'] == DONE:
+            return now - job['finished_at'] < JOB_RESULT_TTL and os.path.exists(job['result_path'])
+        return False
+
+    def get(self, job_id):
+        return _job(self._pool.connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def claim(self, runner_pid):
+        """Marks the oldest queued job as running under runner_pid and returns it (None if there is none)."""
+        return _job(self._pool.connection().execute(
+            """
+            UPDATE jobs SET state = ?, started_at = ?, runner_pid = ?, attempts = attempts + 1
+            WHERE id = (SELECT id FROM jobs WHERE state = ? ORDER BY created_at LIMIT 1)
+            RETURNING *
+            """,
+            (RUNNING, time.time(), runner_pid, QUEUED)
+        ).fetchone())
+
+    def finish(self, job_id, result_path, result_name, result_mimetype):
+        self._pool.connection().execute(
+            'UPDATE jobs SET state = ?, finished_at = ?, result_path = ?, result_name = ?, result_mimetype = ? WHERE id = ?',
+            (DONE, time.time(), result_path, result_name, result_mimetype, job_id)
+        )
+
+    def fail(self, job_id, error):
+        self._pool.connection().execute(
+            'UPDATE jobs SET state = ?, finished_at = ?, error = ? WHERE id = ?', (FAILED, time.time(), error, job_id)
+        )
+
+    def retry(self, job_id, error):
+        """Queues an interrupted job again, or fails it once it has used up its attempts."""
+        job = self.get(job_id)
+        if job is None:
+            return
+        if job['attempts'] < JOB_MAX_ATTEMPTS:
+            self._pool.connection().execute(
+                'UPDATE jobs SET state = ?, started_at = NULL, runner_pid = NULL WHERE id = ?', (QUEUED, job_id)
+            )
+        else:
+            self.fail(job_id, f"{error} (gave up after {job['attempts']} attempts)")
+
+    def requeue_orphans(self, runner_pid):
+        """Retries running jobs whose runner is gone (e.g. a runner that was killed mid-job)."""
+        rows = self._pool.connection().execute(
+            'SELECT id, runner_pid FROM jobs WHERE state = ?', (RUNNING,)
+        ).fetchall()
+        orphans = [row['id'] for row in rows if row['runner_pid'] != runner_pid and not _pid_alive(row['runner_pid'])]
+        for job_id in orphans:
+            self.retry(job_id, 'runner exited while the job was running')
+        return len(orphans)
+
+    def prune(self):
+        """Deletes finished jobs past their TTL along with their result files."""
+        now = time.time()
+        connection = self._pool.connection()
+        expired = connection.execute(
+            'SELECT id, result_path FROM jobs WHERE (state = ? AND finished_at < ?) OR (state = ? AND finished_at < ?)',
+            (DONE, now - JOB_RESULT_TTL, FAILED, now - JOB_FAILURE_TTL)
+        ).fetchall()
+        for row in expired:
+            if row['result_path']:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(row['result_path'])
+            connection.execute('DELETE FROM jobs WHERE id = ?', (row['id'],))
+        return len(expired)
+
+    def counts(self):
+        """{state: number of jobs} over the jobs still on record."""
+        rows = self._pool.connection().execute('SELECT state, COUNT(*) AS n FROM jobs GROUP BY state').fetchall()
+        return {row['state']: row['n'] for row in rows}
+
+    def result_path(self, job_id):
+        return os.path.join(self.results_dir, job_id)
+
+    def read_result(self, job):
+        with open(job['result_path'], 'rb') as f:
+            return f.read()
+
+    def iter_text_result(self, job, chunk_size=RESULT_CHUNK_SIZE):
+        """Yields a text result in pieces; the file is opened up front, so a pruned result fails before a response starts."""
+        f = open(job['result_path'], encoding='utf-8')
+
+        def pieces():
+            with f:
+                while piece := f.read(chunk_size):
+                    yield piece
+        return pieces()
+
+    # --- Runner heartbeat ---
+    def heartbeat(self, runner_pid):
+        self._pool.connection().execute(
+            'INSERT OR REPLACE INTO runners (pid, heartbeat_at) VALUES (?, ?)', (runner_pid, time.time())
+        )
+
+    def remove_runner(self, runner_pid):
+        self._pool.connection().execute('DELETE FROM runners WHERE pid = ?', (runner_pid,))
+
+    def runner_alive(self):
+        """True if a runner has checked in recently enough to pick up new jobs."""
+        row = self._pool.connection().execute('SELECT MAX(heartbeat_at) AS latest FROM runners').fetchone()
+        return row['latest'] is not None and time.time() - row['latest'] < RUNNER_HEARTBEAT_TIMEOUT
+
+    def heartbeat_age(self, runner_pid):
+        """Seconds since runner_pid last checked in (None if it never has, or has signed off)."""
+        row = self._pool.connection().execute('SELECT heartbeat_at FROM runners WHERE pid = ?', (runner_pid,)).fetchone()
+        return None if row is None else time.time() - row['heartbeat_at']
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+job_queue = JobQueue()
+
+
+# --- Execution ---
+def execute(job_id):
+    """Runs one claimed job (in a pool process) and records its result or error."""
+    job = job_queue.get(job_id)
+    started = time.perf_counter()
+    path = job_queue.result_path(job_id)
+    try:
+        run = _handlers.get(job['kind'])
+        if run is None:
+            raise ValueError(f"no handler for job kind {job['kind']!r}")
+        os.makedirs(job_queue.results_dir, exist_ok=True)
+        context = _app.test_request_context() if _app is not None else contextlib.nullcontext()
+        with context, open(path + '.tmp', 'wb') as f:
+            result_name, result_mimetype = run(job['params'], f)
+        os.replace(path + '.tmp', path)
+    except Exception as e:
+        traceback.print_exc()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path + '.tmp')
+        job_queue.fail(job_id, f"{type(e).__name__}: {e}")
+        print(f"Job {job_id} ({job['kind']}) failed after {time.perf_counter() - started:.2f} s: {e}")
+        return
+    job_queue.finish(job_id, path, result_name, result_mimetype)
+    print(f"Job {job_id} ({job['kind']}) done in {time.perf_counter() - started:.2f} s")
+
+
+def _new_pool(workers):
+    # Pool processes are forked from the runner, so they share its loaded snapshot copy-on-write
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+
+
+def run_runner(workers=JOB_WORKERS):
+    """Claims and executes queued jobs until SIGTERM or SIGINT."""
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    # A runner forked from the gunicorn master inherits its signal handlers: put back defaults
+    for name in ('SIGHUP', 'SIGQUIT', 'SIGCHLD', 'SIGUSR1', 'SIGUSR2', 'SIGTTIN', 'SIGTTOU', 'SIGWINCH'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    pid = os.getpid()
+    requeued = job_queue.requeue_orphans(pid)
+    print(f"Job runner {pid} started with {workers} workers ({requeued} interrupted jobs queued again)")
+    pool = _new_pool(workers)
+    running = {}  # future -> job id
+    last_prune = 0.0
+    try:
+        while not stopping:
+            job_queue.heartbeat(pid)
+            broken = False
+            for future in [future for future in running if future.done()]:
+                job_id, error = running.pop(future), future.exception()
+                if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+                    # A pool process died (e.g. killed for memory): the jobs it took down are retried
+                    broken = True
+                    job_queue.retry(job_id, 'worker process exited unexpectedly')
+                elif error is not None:
+                    job_queue.fail(job_id, f"{type(error).__name__}: {error}")
+            if broken:
+                pool.shutdown(wait=False)
+                pool = _new_pool(workers)
+            while len(running) < workers:
+                job = job_queue.claim(pid)
+                if job is None:
+                    break
+                running[pool.submit(execute, job['id'])] = job['id']
+            if time.monotonic() - last_prune > PRUNE_INTERVAL:
+                job_queue.prune()
+                last_prune = time.monotonic()
+            time.sleep(JOB_POLL_INTERVAL)
+    finally:
+        job_queue.remove_runner(pid)
+        # Jobs still running are left to finish; anything cut short is retried on the next start
+        pool.shutdown(wait=True, cancel_futures=True)
+        print(f"Job runner {pid} stopped")
+
+
+def start_runner(workers=JOB_WORKERS):
+    """
+    Forks a runner process from this one (which should already have the app loaded) and returns
+    its pid. A plain fork, not a multiprocessing.Process, so processes forked from this one later
+    (gunicorn's web workers) don't inherit it as a child of their own.
+    """
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            run_runner(workers)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+    return pid
+
+
+def stop_runner(pid, timeout=30):
+    """Asks the runner to finish its current jobs, then kills it if it takes longer than timeout."""
+    deadline = time.monotonic() + timeout
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            return
+        while sig == signal.SIGKILL or time.monotonic() < deadline:
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    return
+            except ChildProcessError:  # Already reaped (gunicorn's arbiter reaps every child)
+                return
+            time.sleep(0.1)
+
+
+class RunnerSupervisor:
+    """
+    Keeps a runner forked from this process (the gunicorn master) running: a daemon thread
+    restarts it when it exits or stops checking in, so large reports don't fall back to the
+    web workers for good.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, log=print, interval=RUNNER_WATCH_INTERVAL):
+        self.workers = workers
+        self.log = log
+        self.interval = interval
+        self.pid = None
+        self.restarts = 0
+        self._started_at = 0.0
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self._fork()
+        threading.Thread(target=self._watch, name='job-runner-supervisor', daemon=True).start()
+        return self.pid
+
+    def _fork(self):
+        self.pid = start_runner(self.workers)
+        self._started_at = time.monotonic()
+
+    def _problem(self):
+        # Why the runner needs restarting, or None while it is healthy
+        if not _pid_alive(self.pid):
+            return 'exited'
+        if time.monotonic() - self._started_at < RUNNER_HEARTBEAT_TIMEOUT:
+            return None  # Still starting up
+        age = job_queue.heartbeat_age(self.pid)
+        if age is None or age > RUNNER_HEARTBEAT_TIMEOUT:
+            return 'stopped checking in'
+        return None
+
+    def _watch(self):
+        while not self._stopping.wait(self.interval):
+            with self._lock:
+                if self._stopping.is_set():
+                    return
+                try:
+                    problem = self._problem()
+                    if problem is None:
+                        continue
+                    self.log(f"Job runner {self.pid} {problem}; starting a new one")
+                    stop_runner(self.pid, timeout=RUNNER_HEARTBEAT_TIMEOUT)
+                    self._fork()
+                    self.restarts += 1
+                    self.log(f"Started job runner (pid {self.pid}, restart {self.restarts})")
+                except Exception as e:  # e.g. the job database is locked: try again next time
+                    self.log(f"Could not check or restart the job runner: {e}")
+
+    def stop(self, timeout=30):
+        """Stops watching, then stops the runner (see stop_runner)."""
+        self._stopping.set()
+        with self._lock:
+            if self.pid is not None:
+                stop_runner(self.pid, timeout=timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run background report and export jobs.')
+    parser.add_argument('--workers', type=int, default=JOB_WORKERS, help='jobs run at once')
+    args = parser.parse_args(argv)
+    # The app registers the handlers (and calls init_app); load the snapshot before forking the pool
+    app = importlib.import_module('app')
+    app.warm_up()
+    run_runner(args.workers)
+
+
+if __name__ == '__main__':
+    # Run the copy of this module the app imports, which is the one its handlers register with
+    importlib.import_module('jobs').main()
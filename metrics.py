@@ -0,0 +1,293 @@
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, before_render_template, g, has_request_context, request, session, template_rendered
+
+try:
+    from pyinstrument import Profiler
+    PYINSTRUMENT_AVAILABLE = True
+except ImportError:
+    PYINSTRUMENT_AVAILABLE = False
+
+# --- Configuration ---
+# Requests slower than this (in milliseconds) are logged with their filters and stage timings.
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '1000'))
+# /metrics is served to logged-in admins, and when this is set also to "Authorization: Bearer <token>".
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Set to 1 to let admins profile a single request by adding ?profile=1 to its URL.
+PROFILING_ENABLED = os.environ.get('REQUEST_PROFILING') == '1'
+
+# Query parameters worth logging for a slow request. Patient IDs and searches are never logged.
+SLOW_REQUEST_FILTER_KEYS = ('report_type', 'entity', 'month', 'year', 'page', 'per_page', 'sort', 'order', 'stream', 'format')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (10, 100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+BYTE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2)
+
+
+# --- Metric Types ---
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per combination of label values."""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for label_values, series in items:
+            labels = list(zip(self.label_names, label_values))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, one series per combination of label values."""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._series.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(list(zip(self.label_names, label_values)))} {value}")
+        return lines
+
+
+class Gauge:
+    """
+    A value read at scrape time from callback(). kind='counter' exposes a running total that
+    is kept elsewhere (e.g. the fragment cache's hit count).
+    """
+
+    def __init__(self, name, help_text, callback, kind='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.kind = kind
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", f"{self.name} {self.callback()}"]
+
+
+# --- Registry ---
+# Values are per process: under gunicorn each scrape is answered by whichever worker takes it.
+request_latency = Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request.', ('endpoint', 'method', 'status'), LATENCY_BUCKETS
+)
+stage_latency = Histogram(
+    'report_stage_duration_seconds', 'Time spent in one stage of a request (filter, paginate, bonus, render, ...).',
+    ('endpoint', 'stage'), LATENCY_BUCKETS
+)
+rows_scanned = Histogram(
+    'report_rows_scanned', 'Financial rows the filters had to look at, per request.', ('endpoint',), ROW_BUCKETS
+)
+rows_returned = Histogram(
+    'report_rows_returned', 'Financial rows left after filtering, per request.', ('endpoint',), ROW_BUCKETS
+)
+response_bytes = Histogram(
+    'http_response_bytes', 'Size of the response body (streamed responses are not counted).', ('endpoint',), BYTE_BUCKETS
+)
+slow_requests = Counter('http_slow_requests_total', 'Requests slower than SLOW_REQUEST_MS.', ('endpoint',))
+
+registry = [request_latency, stage_latency, rows_scanned, rows_returned, response_bytes, slow_requests]
+
+
+def register(metric):
+    """Adds a metric (anything with render()) to what /metrics exposes."""
+    registry.append(metric)
+    return metric
+
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# --- Per-Request Recording ---
+class RequestMetrics:
+    """What one request spent its time on, collected in g while it runs."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # stage -> seconds (a stage entered twice accumulates)
+        self.rows_scanned = 0
+        self.rows_returned = 0
+        self.filtered = False
+        self._render_starts = []
+
+
+def _current():
+    return g.get('_request_metrics') if has_request_context() else None
+
+
+@contextmanager
+def stage(name):
+    """Times the enclosed block as one stage of the current request (no-op outside a request)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(name, time.perf_counter() - started)
+
+
+def add_stage_time(name, seconds):
+    current = _current()
+    if current is not None:
+        current.stages[name] = current.stages.get(name, 0.0) + seconds
+
+
+def record_rows(scanned, returned):
+    """Adds to the rows the current request's filters scanned and returned."""
+    current = _current()
+    if current is not None:
+        current.rows_scanned += scanned
+        current.rows_returned += returned
+        current.filtered = True
+
+
+def _on_before_render(sender, template, context, **extra):
+    current = _current()
+    if current is not None:
+        current._render_starts.append(time.perf_counter())
+
+
+def _on_rendered(sender, template, context, **extra):
+    current = _current()
+    if current is not None and current._render_starts:
+        add_stage_time('render', time.perf_counter() - current._render_starts.pop())
+
+
+# --- Request Hooks ---
+def _start_request():
+    g._request_metrics = RequestMetrics()
+    if PROFILING_ENABLED and request.args.get('profile') == '1' and session.get('user_role') == 'admin':
+        g._profiler = _start_profiler()
+
+
+def _finish_request(response):
+    current = g.pop('_request_metrics', None)
+    if current is None:
+        return response
+    elapsed = time.perf_counter() - current.started
+    endpoint = request.endpoint or 'unmatched'
+
+    request_latency.observe(elapsed, endpoint, request.method, str(response.status_code))
+    for name, seconds in current.stages.items():
+        stage_latency.observe(seconds, endpoint, name)
+    if current.filtered:
+        rows_scanned.observe(current.rows_scanned, endpoint)
+        rows_returned.observe(current.rows_returned, endpoint)
+    # Streamed responses are still being generated here: their latency covers the first chunk only
+    if not response.is_streamed and response.content_length is not None:
+        response_bytes.observe(response.content_length, endpoint)
+
+    if elapsed * 1000 >= SLOW_REQUEST_MS:
+        slow_requests.inc(endpoint)
+        filters = {key: request.args[key] for key in SLOW_REQUEST_FILTER_KEYS if key in request.args}
+        for key in ('selected_entity', 'selected_month', 'selected_year', 'report_type'):
+            if session.get(key) is not None:
+                filters.setdefault(key, session[key])
+        stages = ', '.join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in current.stages.items())
+        print(f"Slow request: {request.method} {request.path} -> {response.status_code} in {elapsed * 1000:.0f} ms "
+              f"(user={session.get('username')}, filters={filters}, stages: {stages or 'none'}, "
+              f"rows scanned={current.rows_scanned}, returned={current.rows_returned})")
+
+    profiler = g.pop('_profiler', None)
+    if profiler is not None:
+        return _profile_response(profiler)
+    return response
+
+
+# --- Profiling ---
+def _start_profiler():
+    if PYINSTRUMENT_AVAILABLE:
+        profiler = Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def _profile_response(profiler):
+    """Replaces the page with the profile of the request that produced it."""
+    if PYINSTRUMENT_AVAILABLE:
+        profiler.stop()
+        return Response(profiler.output_html(), mimetype='text/html')
+    profiler.disable()
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(50)
+    return Response(output.getvalue(), mimetype='text/plain')
+
+
+# --- Endpoint ---
+def _metrics_authorized():
+    # Scrapers present the token; without it only an admin session may read the metrics
+    if METRICS_TOKEN and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+        return True
+    return 'username' in session and session.get('user_role') == 'admin'
+
+
+def metrics_view():
+    if not _metrics_authorized():
+        return Response('Unauthorized', status=401)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Times every request, records template rendering as a stage and serves /metrics."""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_rendered, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -1,8 +1,13 @@
-import pandas as pd
 from werkzeug.security import generate_password_hash, check_password_hash
 import datetime
+import importlib
 import os
 
+import access
+import patient_catalog
+import statements
+import userstore
+
 # --- Master List of All Entities (Centralized here) ---
 MASTER_ENTITIES = sorted([
     'First Bio Lab',
@@ -14,38 +19,27 @@ MASTER_ENTITIES = sorted([
     'Stat Labs'
 ])
 
+# --- Entity Access Grid (access.csv) ---
+# The real user x entity permission grid. Users listed there get exactly the entities marked
+# in it; everyone else keeps the entities assigned in their user record (see users below).
+access_matrix = access.AccessMatrix(MASTER_ENTITIES)
+
 # --- Users with Unfiltered Access (for monthly bonus reports) ---
 UNFILTERED_ACCESS_USERS = ['SatishD', 'AshlieT', 'MinaK', 'BobS', 'NickT']
 
-# --- User Management (In-memory store, now centralized in models.py) ---
-# IMPORTANT: In a production application, this data should come from a secure database.
-users = {
-    # Full Access Admins
-    'SatishD': {'password_hash': generate_password_hash('password1'), 'entities': MASTER_ENTITIES, 'role': 'admin'},
-    'AshlieT': {'password_hash': generate_password_hash('password1'), 'entities': MASTER_ENTITIES, 'role': 'admin'},
-    'MinaK': {'password_hash': generate_password_hash('password1'), 'entities': MASTER_ENTITIES, 'role': 'admin'},
-
-    # Business Development Managers with specific entity access
-    'BobS': {'password_hash': generate_password_hash('password1'), 'entities': ['First Bio Lab', 'First Bio Genetics LLC'], 'role': 'business_dev_manager'},
-    'NickT': {'password_hash': generate_password_hash('password1'), 'entities': ['AIM Laboratories LLC', 'Enviro Labs LLC'], 'role': 'business_dev_manager'},
-
-    # Physician/Providers with single entity access
-    'DrSmith': {'password_hash': generate_password_hash('password1'), 'entities': ['First Bio Lab'], 'role': 'physician_provider', 'full_name': 'Dr. Alice Smith'},
-    'DrJones': {'password_hash': generate_password_hash('password1'), 'entities': ['AIM Laboratories LLC'], 'role': 'physician_provider', 'full_name': 'Dr. Bob Jones'},
-
-    # Patients (with single entity access, typically for their own results)
-    'patient1': {'password_hash': generate_password_hash('password1'), 'entities': ['First Bio Lab'], 'role': 'patient', 'patient_id': 'PAT123'},
-    'patient2': {'password_hash': generate_password_hash('password1'), 'entities': ['AIM Laboratories LLC'], 'role': 'patient', 'patient_id': 'PAT456'},
-}
+# --- User Management (SQLite user store, now centralized in models.py) ---
+# Users and their entity assignments live in a SQLite database shared by all workers (USER_DB_PATH),
+# seeded from users.json (precomputed password hashes) the first time it is opened. Nothing is
+# opened or hashed at import time.
+users = userstore.SqliteUserStore()
 
 def get_user(username):
-    """Retrieves user details from the in-memory store."""
+    """Retrieves user details from the user store."""
     return users.get(username)
 
 def register_user(username, password, role, entity=None, full_name=None, patient_id=None):
     """
-    Registers a new user in the in-memory store.
-    Note: For a real application, implement proper database storage and validation.
+    Registers a new user in the shared user store, visible to every worker immediately.
     """
     if username in users:
         return False, "Username already exists."
@@ -64,11 +58,33 @@ def register_user(username, password, role, entity=None, full_name=None, patient
         if not entity:
              new_user_data['entities'] = MASTER_ENTITIES # Give full access if not specified for broad roles
         
-    users[username] = new_user_data
+    try:
+        users.create(username, new_user_data)
+    except userstore.UsernameTaken:
+        # Registered concurrently through another worker
+        return False, "Username already exists."
+    invalidate_entitlements(username)
     return True, "User registered successfully."
 
 
+def get_assigned_entities(username):
+    """Entities granted to a user: their access.csv row if they have one, else their user record."""
+    mask = access_matrix.mask_for_user(username)
+    if mask is not None:
+        return access_matrix.entities_of(mask)
+    user_data = get_user(username)
+    return list(user_data.get('entities', [])) if user_data else []
+
+
 def get_available_entities_for_user(username, role):
+    """
+    Determines which entities a user has access to based on their role.
+    Returns a fresh list backed by the cached UserEntitlements for (username, role).
+    """
+    return list(get_entitlements(username, role).entities)
+
+
+def _compute_available_entities(username, role):
     """
     Determines which entities a user has access to based on their role.
     This function specifically handles entity access for admins and other roles.
@@ -77,7 +93,7 @@ def get_available_entities_for_user(username, role):
     if not user_data:
         return []
 
-    user_assigned_entities = user_data.get('entities', [])
+    user_assigned_entities = get_assigned_entities(username)
 
     if role in ['admin', 'business_dev_manager']:
         # Admins/Business Dev Managers can see 'All Entities' if they have broad access
@@ -139,6 +155,52 @@ def get_report_types_for_role(role):
     return []
 
 
+# --- Entitlements Cache ---
+# Entity lists and report types only change when a user is (re)registered or access.csv changes,
+# so they are computed once per (username, role) and shared. Each entry records the access.csv
+# version and user store generation it was built from, so a change made through any worker is
+# picked up by all of them. Use auth.current_entitlements() inside a request.
+class UserEntitlements:
+    """What a user may see under a given role. Shared between requests: treat as read-only."""
+
+    def __init__(self, username, role, versions=None):
+        self.username = username
+        self.role = role
+        self.versions = versions
+        self.entities = tuple(_compute_available_entities(username, role))
+        self.assigned_entities = tuple(get_assigned_entities(username))
+        self.has_all_entities = 'All Entities' in self.entities
+        self.entity_mask = access_matrix.mask_of(self.entities)
+        self.report_types = tuple(get_report_types_for_role(role))
+        self.report_type_values = frozenset(report['value'] for report in self.report_types)
+
+    def can_access_entity(self, entity):
+        """O(1) bit test against the entities available under this role."""
+        if entity == 'All Entities':
+            return self.has_all_entities
+        return bool(self.entity_mask & access_matrix.bits.get(entity, 0))
+
+_entitlements_cache = {}
+
+def get_entitlements(username, role):
+    """Returns the cached UserEntitlements for (username, role), building it on first use."""
+    key = (username, role)
+    versions = (access_matrix.get().version, users.generation())
+    entitlements = _entitlements_cache.get(key)
+    if entitlements is None or entitlements.versions != versions:
+        # Built on first use, and again after access.csv is reloaded or any worker changes a user
+        entitlements = _entitlements_cache[key] = UserEntitlements(username, role, versions)
+    return entitlements
+
+def invalidate_entitlements(username=None):
+    """Drops this worker's cached entitlements for one user (or everyone); other workers notice the generation."""
+    if username is None:
+        _entitlements_cache.clear()
+        return
+    for key in [key for key in _entitlements_cache if key[0] == username]:
+        _entitlements_cache.pop(key, None)
+
+
 # --- Financial Report Definitions ---
 FINANCIAL_REPORT_DEFINITIONS = {
     'revenue': {'name': 'Revenue Report', 'columns': ['Date', 'Location', 'Reimbursement', 'Entity', 'Associated Rep Name', 'Username']},
@@ -179,56 +241,62 @@ TRAINING_REPORT_DEFINITIONS = {
 }
 
 
-# --- Dummy Data for Patient Results (replace with actual database queries) ---
-# This dictionary simulates fetching patient reports based on patient_id and entity
-# In a real application, this would involve a database query
-def get_patient_reports_for_patient_id(patient_id, entity):
-    dummy_patient_reports = {
-        'PAT123': {
-            'First Bio Lab': {
-                '2025-03-15': [
-                    {'name': 'Patient Report AB123 - March 2025', 'webViewLink': '/patient_results/Patient_Report_AB123_2025_03.pdf'},
-                    {'name': 'Lab Results AB123 - March 2025', 'webViewLink': '/patient_results/Lab_Results_AB123_2025_03.pdf'}
-                ],
-                '2024-11-20': [
-                    {'name': 'Patient Report AB123 - Nov 2024', 'webViewLink': '/patient_results/Patient_Report_AB123_2024_11.pdf'}
-                ]
-            }
-        },
-        'PAT456': {
-            'AIM Laboratories LLC': {
-                '2025-05-10': [
-                    {'name': 'Patient Report IJ345 - May 2025', 'webViewLink': '/patient_results/Patient_Report_IJ345_2025_05.pdf'}
-                ]
-            }
-        }
-        # Add more dummy data as needed
-    }
+# --- Report Lookup (used by the reports blueprint) ---
+# Report types the dashboard shows as something other than a generic table of financial rows.
+OTHER_REPORT_NAMES = {
+    'monthly_bonus': 'Monthly Bonus Report',
+    'marketing_material': 'Marketing Materials',
+    'financials': 'Financial Statements',
+}
 
-    reports_for_patient_entity = dummy_patient_reports.get(patient_id, {}).get(entity, {})
-    return reports_for_patient_entity
+def get_report_definition(report_type):
+    """Returns {'name', 'columns'} for a dashboard report type, or None if there is no such report."""
+    if report_type in FINANCIAL_REPORT_DEFINITIONS:
+        return FINANCIAL_REPORT_DEFINITIONS[report_type]
+    if report_type in OTHER_REPORT_NAMES:
+        return {'name': OTHER_REPORT_NAMES[report_type], 'columns': []}
+    return None
 
-# Helper to filter financial data based on entity, month, year, and username
-def filter_financial_data(df, selected_entity, selected_month, selected_year, current_username=None, entity_filter_enabled=True):
-    filtered_df = df.copy()
+# --- Month and Year Choices for the Report Filters ---
+YEARS = list(range(datetime.date.today().year, datetime.date.today().year - 5, -1)) # Last 5 years including current
+MONTHS = [{'value': month, 'name': datetime.date(2000, month, 1).strftime('%B')} for month in range(1, 13)]
 
-    if selected_entity and selected_entity != 'All Entities' and entity_filter_enabled:
-        filtered_df = filtered_df[filtered_df['Entity'] == selected_entity]
+# --- Patient Results ---
+# Indexed catalog of result documents, fed from patient_reports_manifest.json and from PDFs dropped
+# into patient_reports/<Entity>/ (see patient_catalog.py). Lookups hit an on-disk index
+# keyed by (patient_id, entity) instead of rebuilding the data on every call.
+patient_results_catalog = patient_catalog.PatientResultsCatalog(MASTER_ENTITIES)
 
-    if selected_month and selected_year:
-        filtered_df = filtered_df[
-            (filtered_df['Date'].dt.month == int(selected_month)) &
-            (filtered_df['Date'].dt.year == int(selected_year))
-        ]
+def get_patient_reports_for_patient_id(patient_id, entity):
+    """Returns {date_of_service: [report, ...]} for the patient at entity, newest first."""
+    return patient_results_catalog.get_reports(patient_id, entity)
+
+# --- Financial Statements ---
+# Statement PDFs in static/, indexed by normalized (entity, statement type, year, basis) whatever
+# spelling their filenames use (see statements.py).
+statement_catalog = statements.StatementCatalog(MASTER_ENTITIES)
+
+def get_financial_statements(entity):
+    """Returns {year: [report, ...]} of the entity's financial statements, newest year first."""
+    files = {}
+    for statement in statement_catalog.for_entity(entity):
+        files.setdefault(statement.year, []).append({'name': statement.name, 'webViewLink': statement.link})
+    return files
+
+# --- Financial Data (lazy) ---
+# The pandas-backed data layer lives in financial.py and is only imported the first time a
+# report needs it, so login, health checks and static files never pay for pandas/NumPy.
+# models.data_df, models.filter_financial_data, models.paginate_report, ... keep working.
+FINANCIAL_ATTRIBUTES = {
+    'financial_store', 'get_financial_data', 'filter_financial_data', 'count_partition_rows', 'get_monthly_bonus',
+    'DEFAULT_PAGE_SIZE', 'MAX_PAGE_SIZE', 'STREAM_CHUNK_SIZE',
+    'normalize_report_args', 'paginate_report', 'iter_report_chunks', 'iter_report_records',
+}
 
-    # For 'monthly_bonus' report, filter by the associated username
-    if current_username and current_username not in UNFILTERED_ACCESS_USERS:
-        # Check if 'Username' column is present before filtering
-        if 'Username' in filtered_df.columns:
-            # The 'Username' column might contain multiple usernames separated by commas.
-            # We need to check if the current_username is present in any of the comma-separated strings.
-            filtered_df = filtered_df[
-                filtered_df['Username'].apply(lambda x: current_username in str(x).split(', '))
-            ]
-
-    return filtered_df
+def __getattr__(name):
+    if name == 'data_df':
+        # Resolved on every access so callers always see the latest snapshot.
+        return importlib.import_module('financial').financial_store.get().df
+    if name in FINANCIAL_ATTRIBUTES:
+        return getattr(importlib.import_module('financial'), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
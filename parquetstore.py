@@ -0,0 +1,568 @@
+"""
+Out-of-core financial data backend (FINANCIAL_DATA_BACKEND=parquet) for histories too large to
+keep in every worker's memory.
+
+data.csv is converted once (per data version) into a Parquet dataset under CACHE_DIR with one
+file per (Entity, year, month) partition, rows in Date order, and a manifest listing the files
+in the same (Entity, year, month, Date) order the in-memory frame uses. Reports never load the
+whole history:
+
+- entity and month/year filters pick partition files from the manifest, so other files are
+  never opened;
+- the username filter is evaluated on the Username column of each row group as it is read;
+- only the columns a report shows are read, one row group at a time;
+- monthly bonus sums are aggregated batch by batch in Arrow;
+- sorted pages keep only the rows up to the requested page, and sorted exports sort in runs
+  spilled to temporary files that are then merged.
+
+Memory per request is bounded by the row group size (PARQUET_ROW_GROUP_ROWS), the page depth
+and SORT_RUN_ROWS, not by the number of rows in data.csv.
+"""
+import csv
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+import datastore
+import indexes
+import rollups
+
+# Bump whenever the on-disk dataset layout changes.
+DATASET_FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+# Rows per Parquet row group: the unit a scan reads (and holds) at a time.
+PARQUET_ROW_GROUP_ROWS = int(os.environ.get('PARQUET_ROW_GROUP_ROWS', '131072'))
+# Bytes of data.csv parsed at a time while the dataset is built.
+CSV_BLOCK_BYTES = int(os.environ.get('PARQUET_CSV_BLOCK_BYTES', str(16 * 1024 * 1024)))
+# Rows sorted in memory at a time by a sorted export; larger results are merged from runs on disk.
+SORT_RUN_ROWS = int(os.environ.get('FINANCIAL_SORT_RUN_ROWS', '500000'))
+# Rows looked at per step of the external merge, across all runs.
+MERGE_WINDOW_ROWS = 262144
+# Partition files written to concurrently while data.csv is split up.
+MAX_OPEN_SPILL_FILES = 256
+# Workers read a dataset's files lazily, so one that still holds an older version needs its
+# files until its next reload check: superseded datasets are removed this many seconds later.
+STALE_DATASET_GRACE = float(os.environ.get('PARQUET_STALE_DATASET_GRACE', '300'))
+SUPERSEDED_FILE = 'superseded'
+
+_ROW_COLUMN = '__row'
+
+
+# --- Schema ---
+def _csv_type(column):
+    # Dates are read as text and parsed afterwards, so a bad date becomes null instead of an error
+    return pa.float64() if column in datastore.MONEY_COLUMNS else pa.string()
+
+
+def _column_type(column):
+    if column == datastore.DATE_COLUMN:
+        return pa.timestamp('ns')
+    return _csv_type(column)
+
+
+def _schema(columns):
+    return pa.schema([(column, _column_type(column)) for column in columns])
+
+
+def _typed(table):
+    """Parses Date and trims the string columns, as datastore.read_financial_csv does."""
+    for column in table.column_names:
+        if column == datastore.DATE_COLUMN:
+            values = pc.strptime(table[column], format=datastore.DATE_FORMAT, unit='ns', error_is_null=True)
+        elif column in datastore.STRING_COLUMNS:
+            values = pc.utf8_trim_whitespace(table[column])
+        else:
+            continue
+        table = table.set_column(table.schema.get_field_index(column), column, values)
+    return table
+
+
+def _read_csv_batches(csv_path):
+    """Yields data.csv as typed Arrow tables of about CSV_BLOCK_BYTES each."""
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        header = next(csv.reader(f), [])
+    reader = pyarrow.csv.open_csv(
+        csv_path,
+        read_options=pyarrow.csv.ReadOptions(block_size=CSV_BLOCK_BYTES),
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types={column: _csv_type(column) for column in header}, strings_can_be_null=True
+        ),
+    )
+    for batch in reader:
+        yield _typed(pa.Table.from_batches([batch]))
+
+
+# --- Partitions ---
+def _partition_order(key):
+    # Same order as indexes.sort_for_partitions: missing Entity first, then by name, year, month
+    entity, year, month = key
+    return (entity is not None, entity or '', year, month)
+
+
+def _split_partitions(table):
+    """Yields ((entity, year, month), rows) for each partition present in table; missing keys as in indexes.MISSING."""
+    entities, uniques = pd.factorize(table['Entity'].to_pandas())
+    dates = table[datastore.DATE_COLUMN]
+    years = pc.year(dates).fill_null(indexes.MISSING).to_numpy(zero_copy_only=False)
+    months = pc.month(dates).fill_null(indexes.MISSING).to_numpy(zero_copy_only=False)
+    groups = pd.DataFrame({'entity': entities, 'year': years, 'month': months}).groupby(
+        ['entity', 'year', 'month'], sort=False
+    ).indices
+    for (code, year, month), positions in groups.items():
+        key = (uniques[code] if code >= 0 else None, int(year), int(month))
+        yield key, table.take(positions)
+
+
+def _part_file(key):
+    return f"part-{hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]}.parquet"
+
+
+def _write_part(directory, key, rows):
+    """Writes one partition's rows in (Date, original row) order; returns its manifest entry."""
+    # Missing dates sort last (Arrow's default null placement)
+    order = pc.sort_indices(rows, sort_keys=[(datastore.DATE_COLUMN, 'ascending'), (_ROW_COLUMN, 'ascending')])
+    rows = rows.take(order).drop_columns([_ROW_COLUMN])
+    name = _part_file(key)
+    pq.write_table(rows, os.path.join(directory, name), row_group_size=PARQUET_ROW_GROUP_ROWS)
+    entity, year, month = key
+    return {'entity': entity, 'year': year, 'month': month, 'file': name, 'rows': rows.num_rows}
+
+
+def _publish(tmp_path, path, columns, parts):
+    parts.sort(key=lambda part: _partition_order((part['entity'], part['year'], part['month'])))
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'format': DATASET_FORMAT_VERSION, 'columns': columns, 'parts': parts}, f)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+        shutil.rmtree(tmp_path, ignore_errors=True)  # Another worker published it first
+
+
+def build_dataset(csv_path, path):
+    """
+    Converts csv_path into a partitioned dataset at path, holding at most one CSV block and
+    then one partition in memory: rows are first spilled per partition to Arrow files, then
+    each partition is sorted and written as Parquet. Built under a temporary name and renamed
+    into place, like shared_frame.write_segment.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    spill_dir = os.path.join(tmp_path, 'spill')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(spill_dir)
+    try:
+        spills = {}   # key -> [spill file, ...]
+        writers = {}  # key -> open stream writer, at most MAX_OPEN_SPILL_FILES of them
+        columns, row_offset = None, 0
+        for table in _read_csv_batches(csv_path):
+            columns = table.column_names
+            table = table.append_column(_ROW_COLUMN, pa.array(np.arange(row_offset, row_offset + table.num_rows)))
+            row_offset += table.num_rows
+            for key, rows in _split_partitions(table):
+                if key not in writers:
+                    if len(writers) >= MAX_OPEN_SPILL_FILES:
+                        writers.pop(next(iter(writers))).close()
+                    spill_path = os.path.join(spill_dir, f"{len(spills.get(key, []))}-{_part_file(key)}.arrow")
+                    spills.setdefault(key, []).append(spill_path)
+                    writers[key] = pa.ipc.new_stream(spill_path, rows.schema)
+                writers[key].write_table(rows)
+        for writer in writers.values():
+            writer.close()
+
+        parts = []
+        for key, spill_paths in spills.items():
+            rows = pa.concat_tables([pa.ipc.open_stream(spill_path).read_all() for spill_path in spill_paths])
+            parts.append(_write_part(tmp_path, key, rows))
+            for spill_path in spill_paths:
+                os.remove(spill_path)
+        os.rmdir(spill_dir)
+        if columns is None:
+            with open(csv_path, newline='', encoding='utf-8') as f:
+                columns = next(csv.reader(f), [])
+        _publish(tmp_path, path, columns, parts)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def append_to_dataset(dataset, delta, path):
+    """
+    Writes at path the dataset of dataset's rows plus delta (a frame typed like
+    datastore.read_financial_csv's output). Only partitions that get rows are rewritten; every
+    other file is hard-linked from dataset. Within a partition, delta rows go after existing
+    rows with the same Date, as in indexes.merge_for_partitions.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        table = pa.Table.from_pandas(delta[dataset.columns], preserve_index=False).cast(_schema(dataset.columns))
+        table = table.append_column(_ROW_COLUMN, pa.array(np.arange(table.num_rows)))
+        added = dict(_split_partitions(table))
+
+        parts = []
+        for part in dataset.parts:
+            key = (part['entity'], part['year'], part['month'])
+            source = os.path.join(dataset.path, part['file'])
+            if key in added:
+                rows = pq.read_table(source)
+                rows = rows.append_column(_ROW_COLUMN, pa.array(np.arange(-rows.num_rows, 0)))
+                parts.append(_write_part(tmp_path, key, pa.concat_tables([rows, added.pop(key)])))
+                continue
+            try:
+                os.link(source, os.path.join(tmp_path, part['file']))
+            except OSError:
+                shutil.copy2(source, os.path.join(tmp_path, part['file']))
+            parts.append(dict(part))
+        for key, rows in added.items():
+            parts.append(_write_part(tmp_path, key, rows))
+        _publish(tmp_path, path, dataset.columns, parts)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+class PartitionedDataset:
+    """A dataset written by build_dataset(): its manifest plus where the files are."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format') != DATASET_FORMAT_VERSION:
+            raise ValueError(f"Unsupported dataset format {manifest.get('format')!r}")
+        self.path = path
+        self.columns = manifest['columns']
+        self.parts = manifest['parts']  # In (Entity, year, month) order
+        self.partitions = {(part['entity'], part['year'], part['month']): part for part in self.parts}
+        self.row_count = sum(part['rows'] for part in self.parts)
+
+    @property
+    def periods(self):
+        return sorted({(part['year'], part['month']) for part in self.parts} - {(indexes.MISSING, indexes.MISSING)})
+
+    def select(self, entity=None, year=None, month=None, entities=None):
+        """Parts matching the filters, like indexes.PartitionIndex.ranges(); month and year go together."""
+        year, month = (int(year), int(month)) if year is not None and month is not None else (None, None)
+        return [
+            part for part in self.parts
+            if (entity is None or part['entity'] == entity)
+            and (entities is None or part['entity'] in entities)
+            and (year is None or (part['year'], part['month']) == (year, month))
+        ]
+
+    def size_bytes(self):
+        return sum(os.path.getsize(os.path.join(self.path, part['file'])) for part in self.parts)
+
+
+# --- Scans ---
+def _username_pattern(username):
+    # One of the comma-separated usernames, ignoring stray spaces (see indexes.explode_usernames)
+    delimiter = indexes.USERNAME_DELIMITER
+    return f"(^|{delimiter})\\s*{re.escape(username)}\\s*({delimiter}|$)"
+
+
+def _frame(table):
+    # Missing strings as NaN rather than None, like the in-memory frame's string columns
+    frame = table.to_pandas()
+    for column in frame.columns[frame.dtypes == object]:
+        frame[column] = frame[column].where(frame[column].notna(), np.nan)
+    return frame
+
+
+class FinancialScan:
+    """
+    The rows of some of a dataset's partitions, optionally only those tagged with one
+    username: what filter_financial_data returns with the parquet backend, in place of a
+    DataFrame. Nothing is read until rows are asked for (page(), iter_chunks(), len()).
+    """
+
+    def __init__(self, dataset, parts=None, username=None):
+        self.dataset = dataset
+        self.parts = dataset.parts if parts is None else parts
+        self.username = username
+        self._row_count = None if username else sum(part['rows'] for part in self.parts)
+
+    @property
+    def columns(self):
+        return self.dataset.columns
+
+    @property
+    def rows_scanned(self):
+        """Rows in the selected partitions, before the username filter."""
+        return sum(part['rows'] for part in self.parts)
+
+    def where(self, entity=None, year=None, month=None, username=None):
+        """The rows of this scan matching the filters (same meaning as PartitionIndex.ranges)."""
+        if username and self.username and username != self.username:
+            return FinancialScan(self.dataset, [], username)
+        files = {part['file'] for part in self.parts}
+        parts = [part for part in self.dataset.select(entity, year, month) if part['file'] in files]
+        return FinancialScan(self.dataset, parts, username or self.username)
+
+    def __len__(self):
+        if self._row_count is None:
+            self._row_count = sum(table.num_rows for table in self._tables([]))
+        return self._row_count
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def _tables(self, columns, skip=0):
+        """Yields the matching rows' columns one row group at a time, in order, after skipping skip rows."""
+        username_column = 'Username'
+        read_columns = list(dict.fromkeys(columns + [username_column])) if self.username else columns
+        for part in self.parts:
+            if not self.username and skip >= part['rows']:
+                skip -= part['rows']
+                continue
+            parquet_file = pq.ParquetFile(os.path.join(self.dataset.path, part['file']))
+            for row_group in range(parquet_file.num_row_groups):
+                group_rows = parquet_file.metadata.row_group(row_group).num_rows
+                if not self.username and skip >= group_rows:
+                    skip -= group_rows
+                    continue
+                table = parquet_file.read_row_group(row_group, columns=read_columns)
+                if self.username:
+                    table = table.filter(pc.match_substring_regex(table[username_column], _username_pattern(self.username)))
+                    table = table.select(columns)
+                if skip:
+                    dropped = min(skip, table.num_rows)
+                    table, skip = table.slice(dropped), skip - dropped
+                if table.num_rows:
+                    yield table
+
+    def _sort_keys(self, sort_by, descending):
+        return [(sort_by, 'descending' if descending else 'ascending'), ('__seq', 'ascending')]
+
+    def _sequenced(self, columns):
+        """_tables() with a __seq column numbering the rows in natural order (the sort tie-breaker)."""
+        seq = 0
+        for table in self._tables(columns):
+            yield table.append_column('__seq', pa.array(np.arange(seq, seq + table.num_rows)))
+            seq += table.num_rows
+
+    def page(self, columns, start, stop, sort_by=None, descending=False):
+        """Rows [start, stop) in display order as a DataFrame of columns."""
+        if not sort_by:
+            tables, remaining = [], stop - start
+            for table in self._tables(columns, skip=start):
+                tables.append(table.slice(0, remaining))
+                remaining -= tables[-1].num_rows
+                if remaining <= 0:
+                    break
+            return _frame(pa.concat_tables(tables) if tables else _schema(columns).empty_table())
+
+        # Top-(stop) rows: never more than stop rows plus one row group are held
+        read_columns = list(dict.fromkeys(columns + [sort_by]))
+        best = None
+        for table in self._sequenced(read_columns):
+            best = table if best is None else pa.concat_tables([best, table])
+            order = pc.sort_indices(best, sort_keys=self._sort_keys(sort_by, descending))
+            best = best.take(order[:stop])
+        if best is None:
+            return _frame(_schema(columns).empty_table())
+        return _frame(best.slice(start).select(columns))
+
+    def iter_chunks(self, columns, chunk_size, sort_by=None, descending=False):
+        """Yields every row in display order as DataFrames of at most chunk_size rows."""
+        tables = self._sorted_tables(columns, sort_by, descending) if sort_by else self._tables(columns)
+        for table in tables:
+            frame = _frame(table.select(columns))
+            for start in range(0, len(frame), chunk_size):
+                yield frame.iloc[start:start + chunk_size]
+
+    def _sorted_tables(self, columns, sort_by, descending):
+        """
+        External merge sort: runs of SORT_RUN_ROWS rows are sorted and spilled to temporary
+        Arrow files, which are then merged a window at a time.
+        """
+        read_columns = list(dict.fromkeys(columns + [sort_by]))
+        sort_keys = self._sort_keys(sort_by, descending)
+        with tempfile.TemporaryDirectory(prefix='financial-sort-') as tmp_dir:
+            runs, pending, pending_rows = [], [], 0
+
+            def spill():
+                table = pa.concat_tables(pending)
+                table = table.take(pc.sort_indices(table, sort_keys=sort_keys))
+                path = os.path.join(tmp_dir, f"run-{len(runs)}.arrow")
+                with pa.ipc.new_file(path, table.schema) as writer:
+                    writer.write_table(table)
+                # Memory-mapped: the merge reads runs from the page cache, not the heap
+                runs.append(pa.ipc.open_file(pa.memory_map(path)).read_all())
+
+            for table in self._sequenced(read_columns):
+                pending.append(table)
+                pending_rows += table.num_rows
+                if pending_rows >= SORT_RUN_ROWS:
+                    spill()
+                    pending, pending_rows = [], 0
+            if pending:
+                spill()
+            yield from _merge_runs(runs, sort_keys)
+
+
+def _merge_runs(runs, sort_keys):
+    """
+    Yields the rows of runs (tables each sorted by sort_keys, which end with the unique __seq)
+    in merged order. Each step sorts the next window of every run together and emits rows up
+    to the smallest window end among runs that have rows left beyond their window: nothing
+    outside the windows can sort before that row.
+    """
+    if not runs:
+        return
+    window_rows = max(1024, MERGE_WINDOW_ROWS // len(runs))
+    offsets = [0] * len(runs)
+    while True:
+        windows = [run.slice(offset, window_rows) for run, offset in zip(runs, offsets)]
+        combined = pa.concat_tables(windows)
+        if not combined.num_rows:
+            return
+        order = pc.sort_indices(combined, sort_keys=sort_keys).to_numpy()
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(len(order))
+
+        emit, window_end = len(order), 0
+        run_ids = np.empty(len(order), dtype='int64')
+        for run_id, (run, window) in enumerate(zip(runs, windows)):
+            run_ids[window_end:window_end + window.num_rows] = run_id
+            window_end += window.num_rows
+            if window.num_rows and offsets[run_id] + window.num_rows < run.num_rows:
+                emit = min(emit, ranks[window_end - 1] + 1)
+        emitted = order[:emit]
+        # Every run's emitted rows are a prefix of its window
+        for run_id, count in enumerate(np.bincount(run_ids[emitted], minlength=len(runs))):
+            offsets[run_id] += int(count)
+        yield combined.take(emitted)
+
+
+# --- Monthly Bonus ---
+class DatasetBonus:
+    """rollups.BonusRollup's monthly_bonus(), aggregated from the period's partition files."""
+
+    # Partial group sums kept before they are combined, so memory stays at a few batches' groups
+    MAX_PARTIALS = 64
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def rows_in_period(self, year, month):
+        return sum(part['rows'] for part in self.dataset.select(year=year, month=month))
+
+    def monthly_bonus(self, year, month, username=None, entities=None):
+        """Bonus totals per (Associated Rep Name, Entity) for one month, rounded to cents."""
+        dimensions, measures = rollups.BONUS_DIMENSIONS, rollups.BONUS_MEASURES
+        scan = FinancialScan(self.dataset, self.dataset.select(year=year, month=month, entities=entities), username)
+        partials = []
+        for table in scan._tables(dimensions + measures):
+            table = table.filter(pc.is_valid(table['Associated Rep Name']))
+            partials.append(_sum_groups(table, dimensions, measures))
+            if len(partials) >= self.MAX_PARTIALS:
+                partials = [_sum_groups(pa.concat_tables(partials), dimensions, measures)]
+        if not partials:
+            return pd.DataFrame(columns=dimensions + measures)
+
+        bonus_data = _frame(_sum_groups(pa.concat_tables(partials), dimensions, measures))
+        bonus_data = bonus_data.sort_values(dimensions, kind='stable').reset_index(drop=True)
+        bonus_data[measures] = bonus_data[measures].round(2)
+        return bonus_data
+
+
+def _sum_groups(table, dimensions, measures):
+    # min_count=0: a group whose values are all missing sums to 0, as in pandas
+    options = pc.ScalarAggregateOptions(min_count=0)
+    summed = table.group_by(dimensions).aggregate([(measure, 'sum', options) for measure in measures])
+    return summed.select(dimensions + [f"{measure}_sum" for measure in measures]).rename_columns(dimensions + measures)
+
+
+# --- Snapshot and Store ---
+class DatasetData:
+    """The parquet backend's snapshot: datastore.FinancialData's interface over a PartitionedDataset."""
+
+    def __init__(self, dataset, version, source_path, source_mtime_ns):
+        self.dataset = dataset
+        self.df = FinancialScan(dataset)
+        self.bonus = DatasetBonus(dataset)
+        self.version = version
+        self.source_path = source_path
+        self.source_mtime_ns = source_mtime_ns
+        self.loaded_at = time.time()
+
+    @property
+    def row_count(self):
+        return self.dataset.row_count
+
+    @property
+    def periods(self):
+        return self.dataset.periods
+
+    def index_stats(self):
+        return {'partitions': len(self.dataset.parts), 'bytes_on_disk': self.dataset.size_bytes()}
+
+
+class ParquetFinancialDataStore(datastore.FinancialDataStore):
+    """
+    FinancialDataStore that keeps the data in a partitioned Parquet dataset instead of an
+    in-memory frame. Versions, reload checks and append() work as in the base class; a worker
+    only holds the manifest.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if not PARQUET_AVAILABLE:
+            raise RuntimeError("FINANCIAL_DATA_BACKEND=parquet requires the 'pyarrow' package.")
+        super().__init__(*args, **kwargs)
+
+    def _load(self, fingerprint):
+        if fingerprint is None:
+            raise FileNotFoundError(f"Financial data file not found: {self.csv_path}")
+        version = self._version_for(fingerprint)
+        path = self._dataset_path(version)
+        if not os.path.isdir(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            build_dataset(self.csv_path, path)
+            self._remove_stale_datasets(path)
+        return DatasetData(PartitionedDataset(path), version, self.csv_path, fingerprint[0])
+
+    def _write_appended(self, snapshot, delta, version):
+        path = self._dataset_path(version)
+        append_to_dataset(snapshot.dataset, delta, path)
+        self._remove_stale_datasets(path)
+
+    def _dataset_path(self, version):
+        return os.path.join(self.cache_dir, f"financial-parquet-v{DATASET_FORMAT_VERSION}-{version[:16]}")
+
+    def _remove_stale_datasets(self, keep_path):
+        """Marks other datasets as superseded, and removes those superseded over STALE_DATASET_GRACE ago."""
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not name.startswith('financial-parquet-v') or name.endswith('.tmp') or path == keep_path:
+                continue
+            marker = os.path.join(path, SUPERSEDED_FILE)
+            try:
+                superseded_at = os.path.getmtime(marker)
+            except FileNotFoundError:
+                with open(marker, 'w'):
+                    pass
+                continue
+            if now - superseded_at > STALE_DATASET_GRACE:
+                shutil.rmtree(path, ignore_errors=True)
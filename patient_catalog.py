@@ -0,0 +1,252 @@
+import bisect
+import json
+import os
+import re
+import threading
+import time
+
+import access
+import db
+
+# --- Locations ---
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+# Result PDFs and the manifest are kept outside static/ on purpose: they hold patient data and must
+# only be served through the login-checked /patient_results routes.
+PATIENT_REPORTS_DIR = os.environ.get('PATIENT_REPORTS_DIR', os.path.join(PROJECT_ROOT, 'patient_reports'))
+MANIFEST_PATH = os.environ.get('PATIENT_REPORTS_MANIFEST', os.path.join(PROJECT_ROOT, 'patient_reports_manifest.json'))
+# Where results used to be dropped. Nothing there is indexed any more: move it to PATIENT_REPORTS_DIR.
+LEGACY_REPORTS_DIR = os.path.join(PROJECT_ROOT, 'static', 'patient_reports')
+CATALOG_DB_PATH = os.environ.get('PATIENT_CATALOG_DB', os.path.join(PROJECT_ROOT, '.cache', 'patient_catalog.db'))
+
+# How often (in seconds) a worker checks the drop directories and manifest for new results.
+REFRESH_INTERVAL = float(os.environ.get('PATIENT_CATALOG_REFRESH_INTERVAL', '30'))
+
+# Result PDFs dropped into PATIENT_REPORTS_DIR/<Entity>/ are named
+# Patient_<PatientID>_DOS_<YYYY-MM-DD>[_<Label>].pdf
+RESULT_FILENAME = re.compile(r'^Patient_(?P<patient_id>[A-Za-z0-9-]+)_DOS_(?P<dos>\d{4}-\d{2}-\d{2})(?:_(?P<label>.+))?\.pdf$', re.IGNORECASE)
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS patient_reports (
+        link TEXT PRIMARY KEY,
+        patient_id TEXT NOT NULL,
+        entity TEXT NOT NULL,
+        dos TEXT NOT NULL,
+        name TEXT NOT NULL,
+        source TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_patient_reports_lookup ON patient_reports (patient_id, entity, dos DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_patient_reports_source ON patient_reports (source)",
+    # Last seen mtime of each scanned directory (and of the manifest): unchanged sources are skipped.
+    """CREATE TABLE IF NOT EXISTS catalog_sources (
+        source TEXT PRIMARY KEY,
+        mtime_ns INTEGER NOT NULL
+    )""",
+    # Bumped on every change so each worker knows when to rebuild its in-memory patient ID index.
+    "CREATE TABLE IF NOT EXISTS catalog_generation (id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO catalog_generation (id, generation) VALUES (1, 0)",
+]
+
+# Patient ID search: at most this many results, and typo suggestions within this edit distance.
+MAX_SEARCH_RESULTS = 10
+MAX_SUGGESTION_DISTANCE = 1
+
+
+def parse_result_filename(filename):
+    """Returns (patient_id, dos, label) for a result PDF name, or None if it doesn't follow the convention."""
+    match = RESULT_FILENAME.match(filename)
+    if not match:
+        return None
+    label = (match.group('label') or 'Report').replace('_', ' ')
+    return match.group('patient_id'), match.group('dos'), label
+
+
+def _edits1(word, alphabet):
+    """Every string one insertion, deletion, substitution or transposition away from word."""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    deletes = [left + right[1:] for left, right in splits if right]
+    transposes = [left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1]
+    replaces = [left + c + right[1:] for left, right in splits if right for c in alphabet]
+    inserts = [left + c + right for left, right in splits for c in alphabet]
+    return set(deletes + transposes + replaces + inserts)
+
+
+class PatientIdIndex:
+    """
+    Sorted array of one entity's patient IDs (compared case-insensitively). Prefix search is a
+    bisect plus a short scan; typo suggestions probe the hash set with every edit of the query
+    (a few hundred lookups), so both stay well under a millisecond at a million IDs.
+    """
+
+    def __init__(self, patient_ids):
+        by_key = {patient_id.upper(): patient_id for patient_id in patient_ids}
+        self.keys = sorted(by_key)
+        self.original = by_key
+        self.alphabet = ''.join(sorted({c for key in self.keys for c in key}))
+
+    def with_prefix(self, prefix, limit=MAX_SEARCH_RESULTS):
+        prefix = prefix.upper()
+        matches = []
+        position = bisect.bisect_left(self.keys, prefix)
+        while position < len(self.keys) and len(matches) < limit and self.keys[position].startswith(prefix):
+            matches.append(self.original[self.keys[position]])
+            position += 1
+        return matches
+
+    def similar_to(self, query, limit=MAX_SEARCH_RESULTS):
+        query = query.upper()
+        candidates = {query}
+        for _ in range(MAX_SUGGESTION_DISTANCE):
+            candidates |= {edit for candidate in candidates for edit in _edits1(candidate, self.alphabet)}
+        return sorted(self.original[key] for key in candidates if key in self.original and key != query)[:limit]
+
+
+class PatientResultsCatalog:
+    """
+    Persistent index of patient result documents keyed by (patient_id, entity), newest date
+    of service first. It is fed from the manifest file and from PDFs dropped into per-entity
+    subdirectories of PATIENT_REPORTS_DIR; only sources whose mtime changed are re-read,
+    so picking up new results is incremental.
+    """
+
+    def __init__(self, entities, reports_dir=PATIENT_REPORTS_DIR, manifest_path=MANIFEST_PATH,
+                 db_path=CATALOG_DB_PATH, refresh_interval=REFRESH_INTERVAL):
+        self.entities = list(entities)
+        self.reports_dir = reports_dir
+        self.manifest_path = manifest_path
+        self.refresh_interval = refresh_interval
+        self._pool = db.ConnectionPool(db_path, SCHEMA)
+        self._last_refresh = None
+        self._refresh_lock = threading.Lock()
+        self._id_indexes = {}  # entity -> PatientIdIndex
+        self._id_indexes_generation = None
+        self._id_indexes_lock = threading.Lock()
+        if os.path.isdir(LEGACY_REPORTS_DIR) and os.path.abspath(reports_dir) != LEGACY_REPORTS_DIR:
+            print(f"Patient results in {LEGACY_REPORTS_DIR} are no longer indexed; move them to {reports_dir}")
+
+    def get_reports(self, patient_id, entity):
+        """{dos: [{'name', 'webViewLink'}, ...]} for one patient at one entity, newest DOS first."""
+        self._maybe_refresh()
+        results_by_dos = {}
+        rows = self._pool.connection().execute(
+            'SELECT dos, name, link FROM patient_reports WHERE patient_id = ? AND entity = ? ORDER BY dos DESC, name',
+            (patient_id, entity)
+        )
+        for row in rows:
+            results_by_dos.setdefault(row['dos'], []).append({'name': row['name'], 'webViewLink': row['link']})
+        return results_by_dos
+
+    def owner(self, link):
+        """(patient_id, entity) a result link belongs to, or None if the catalog doesn't list it."""
+        self._maybe_refresh()
+        row = self._pool.connection().execute(
+            'SELECT patient_id, entity FROM patient_reports WHERE link = ?', (link,)
+        ).fetchone()
+        return (row['patient_id'], row['entity']) if row else None
+
+    def search_patient_ids(self, query, entities, limit=MAX_SEARCH_RESULTS):
+        """
+        Typeahead for physicians: {'matches': IDs starting with query, 'suggestions': IDs within
+        MAX_SUGGESTION_DISTANCE edits of it}, both limited to the given entities.
+        """
+        query = (query or '').strip()
+        if not query:
+            return {'matches': [], 'suggestions': []}
+        indexes = self._patient_id_indexes()
+        matches, suggestions = set(), set()
+        for entity in entities:
+            index = indexes.get(entity)
+            if index is not None:
+                matches.update(index.with_prefix(query, limit))
+                suggestions.update(index.similar_to(query, limit))
+        return {'matches': sorted(matches)[:limit], 'suggestions': sorted(suggestions - matches)[:limit]}
+
+    def _patient_id_indexes(self):
+        self._maybe_refresh()
+        generation = self._pool.connection().execute('SELECT generation FROM catalog_generation').fetchone()[0]
+        if generation != self._id_indexes_generation:
+            with self._id_indexes_lock:
+                if generation != self._id_indexes_generation:
+                    ids_by_entity = {}
+                    for row in self._pool.connection().execute('SELECT DISTINCT entity, patient_id FROM patient_reports'):
+                        ids_by_entity.setdefault(row['entity'], []).append(row['patient_id'])
+                    self._id_indexes = {entity: PatientIdIndex(ids) for entity, ids in ids_by_entity.items()}
+                    self._id_indexes_generation = generation
+        return self._id_indexes
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        if self._last_refresh is not None and now - self._last_refresh < self.refresh_interval:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # Another thread is already refreshing; serve what we have
+        try:
+            self._last_refresh = now
+            self.refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def refresh(self):
+        """Re-reads every source whose mtime changed since it was last indexed."""
+        connection = self._pool.connection()
+        known = {row['source']: row['mtime_ns'] for row in connection.execute('SELECT source, mtime_ns FROM catalog_sources')}
+
+        mtime_ns = self._mtime_ns(self.manifest_path)
+        if mtime_ns is not None and known.get('manifest') != mtime_ns:
+            self._index_source(connection, 'manifest', mtime_ns, self._manifest_entries())
+
+        if not os.path.isdir(self.reports_dir):
+            return
+        for entry in os.scandir(self.reports_dir):
+            if not entry.is_dir():
+                continue
+            entity = access.normalize_entity_name(entry.name, self.entities)
+            if entity is None:
+                continue
+            source = f"dir:{entry.name}"
+            mtime_ns = entry.stat().st_mtime_ns
+            if known.get(source) != mtime_ns:
+                self._index_source(connection, source, mtime_ns, self._directory_entries(entry.path, entry.name, entity))
+
+    def _index_source(self, connection, source, mtime_ns, entries):
+        """Replaces everything indexed from one source with its current entries, atomically."""
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM patient_reports WHERE source = ?', (source,))
+            connection.executemany(
+                'INSERT OR REPLACE INTO patient_reports (link, patient_id, entity, dos, name, source) VALUES (?, ?, ?, ?, ?, ?)',
+                [(link, patient_id, entity, dos, name, source) for link, patient_id, entity, dos, name in entries]
+            )
+            connection.execute(
+                'INSERT OR REPLACE INTO catalog_sources (source, mtime_ns) VALUES (?, ?)', (source, mtime_ns)
+            )
+            connection.execute('UPDATE catalog_generation SET generation = generation + 1')
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _manifest_entries(self):
+        with open(self.manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        for item in manifest:
+            entity = access.normalize_entity_name(item['entity'], self.entities)
+            if entity is None:
+                print(f"Skipping patient result with unknown entity {item['entity']!r}: {item.get('webViewLink')}")
+                continue
+            yield item['webViewLink'], item['patient_id'], entity, item['dos'], item['name']
+
+    def _directory_entries(self, path, directory_name, entity):
+        for entry in os.scandir(path):
+            parsed = parse_result_filename(entry.name) if entry.is_file() else None
+            if parsed is None:
+                continue
+            patient_id, dos, label = parsed
+            link = f"/patient_results/{directory_name}/{entry.name}"
+            yield link, patient_id, entity, dos, f"{label} {patient_id} - {dos}"
+
+    @staticmethod
+    def _mtime_ns(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,71 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+# Memory budget (in bytes) for cached fragments per worker.
+MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# A single fragment larger than this share of the budget is rendered but not cached.
+MAX_ENTRY_SHARE = 0.25
+
+
+class FragmentCache:
+    """
+    LRU cache of rendered HTML fragments with a memory cap. Every entry belongs to one data
+    version (the financial snapshot's hash): the first lookup with a new version drops them all.
+    Keys must carry everything the fragment depends on besides the data - filters, paging and
+    whatever the user's entitlements restrict the rows to.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (fragment, size)
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, version, render):
+        """Returns the cached fragment for (key, version), calling render() to build it on a miss."""
+        with self._lock:
+            if version != self._version:
+                self._clear()
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Rendered outside the lock so one slow report doesn't hold up the others
+        fragment = render()
+        size = sys.getsizeof(fragment)
+        if size > self.max_bytes * MAX_ENTRY_SHARE:
+            return fragment
+
+        with self._lock:
+            if version == self._version and key not in self._entries:
+                self._entries[key] = (fragment, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self._bytes -= evicted_size
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,15 +1,280 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, send_from_directory
+from flask import Blueprint, render_template, stream_template, request, redirect, url_for, session, flash, send_from_directory, send_file, Response, jsonify, abort
+from werkzeug.utils import secure_filename
 from functools import wraps
-import pandas as pd
 import datetime
 import re
 import os # Ensure os is imported for path operations
+import tempfile
 
+import exports
+import filestore
+import jobs
+import metrics
+import render_cache
 import models # Changed: Import models using absolute import (from . import models removed)
-from auth import login_required, role_required # Changed: Import decorators using absolute import
+from auth import login_required, role_required, current_entitlements # Changed: Import decorators using absolute import
 
 reports_bp = Blueprint('reports', __name__)
 
+def _generic_report_rows(selected_entity, selected_month, selected_year, current_username, user_role):
+    """Filtered rows behind a generic financial report (shared by the dashboard and exports)."""
+    # Further filter by the current user's associated username if not an unfiltered access user
+    # (filter_financial_data skips the username filter for UNFILTERED_ACCESS_USERS)
+    with metrics.stage('filter'):
+        return models.filter_financial_data(
+            models.data_df,
+            selected_entity=selected_entity,
+            selected_month=selected_month,
+            selected_year=selected_year,
+            current_username=current_username if user_role not in ['admin'] else None
+        )
+
+# Rendered report bodies, shared by everyone whose entitlements give them the same rows
+fragment_cache = render_cache.FragmentCache()
+metrics.register(metrics.Gauge('report_fragment_cache_hits_total', 'Report fragments served from the cache.',
+                               lambda: fragment_cache.hits, kind='counter'))
+metrics.register(metrics.Gauge('report_fragment_cache_misses_total', 'Report fragments that had to be rendered.',
+                               lambda: fragment_cache.misses, kind='counter'))
+metrics.register(metrics.Gauge('report_fragment_cache_bytes', 'Memory held by cached report fragments.',
+                               lambda: fragment_cache.size_bytes))
+
+def _row_scope(current_username, user_role):
+    """The username a user's report rows are restricted to, or None if they see every row."""
+    if user_role == 'admin' or current_username in models.UNFILTERED_ACCESS_USERS:
+        return None
+    return current_username
+
+def _render_generic_report_body(report_type, report_columns, selected_entity, selected_month, selected_year,
+                                current_username, user_role, page, per_page, sort_by, descending):
+    """Filters, pages and renders the generic report table (the cacheable part of the page)."""
+    report_data, pagination, message = [], None, None
+    df_filtered = _generic_report_rows(selected_entity, selected_month, selected_year, current_username, user_role)
+    if df_filtered.empty:
+        message = "No data available for the selected criteria."
+    elif 'PatientID' in report_columns and 'PatientID' not in df_filtered.columns:
+        message = 'PatientID column not found in data for this report.'
+    else:
+        # Sort and slice first; only the requested page is converted to dicts
+        with metrics.stage('paginate'):
+            report_data, pagination = models.paginate_report(
+                df_filtered, report_columns, page=page, per_page=per_page, sort_by=sort_by, descending=descending
+            )
+    return render_template(
+        '_generic_report_body.html',
+        report_type=report_type,
+        report_columns=report_columns,
+        report_data=report_data,
+        selected_entity=selected_entity,
+        selected_month=selected_month,
+        selected_year=selected_year,
+        message=message,
+        pagination=pagination,
+        sort_by=sort_by,
+        descending=descending
+    )
+
+def _generic_report_key(report_type, selected_entity, selected_month, selected_year,
+                        current_username, user_role, page, per_page, sort_by, descending):
+    return ('generic_report', report_type, selected_entity, selected_month, selected_year,
+            _row_scope(current_username, user_role), page, per_page, sort_by, descending)
+
+def _render_bonus_table(selected_month, selected_year, current_username, user_entities):
+    with metrics.stage('bonus'):
+        bonus_data = models.get_monthly_bonus(
+            selected_month,
+            selected_year,
+            current_username=current_username,
+            entities=user_entities
+        )
+    with metrics.stage('to_dict'):
+        records = bonus_data.to_dict(orient='records')
+    return render_template('_monthly_bonus_table.html', data=records)
+
+def _bonus_table_key(selected_month, selected_year, current_username, user_entities):
+    bonus_scope = None if current_username in models.UNFILTERED_ACCESS_USERS else current_username
+    return ('monthly_bonus', selected_month, selected_year, bonus_scope,
+            tuple(user_entities) if user_entities is not None else None)
+
+def prime_report_caches(year, month):
+    """
+    Renders the unrestricted (admin) views of every financial report and the monthly bonus
+    table for one period into fragment_cache, with the dashboard's default paging and sort.
+    Month and year are passed as the strings the dashboard gets from the query string, so the
+    keys match real requests. Needs a request context (templates use url_for).
+    Returns the number of fragments rendered.
+    """
+    snapshot = models.get_financial_data()
+    selected_month, selected_year = str(month), str(year)
+    rendered = 0
+    for report_type, definition in models.FINANCIAL_REPORT_DEFINITIONS.items():
+        for selected_entity in ['All Entities'] + models.MASTER_ENTITIES:
+            args = (selected_entity, selected_month, selected_year, None, 'admin', 1, models.DEFAULT_PAGE_SIZE, None, False)
+            fragment_cache.get_or_render(
+                _generic_report_key(report_type, *args),
+                snapshot.version,
+                lambda: _render_generic_report_body(report_type, definition['columns'], *args)
+            )
+            rendered += 1
+    fragment_cache.get_or_render(
+        _bonus_table_key(selected_month, selected_year, None, None),
+        snapshot.version,
+        lambda: _render_bonus_table(selected_month, selected_year, None, None)
+    )
+    return rendered + 1
+
+# --- Background Jobs ---
+# Reports and exports covering more than this many rows are handed to the job runner (see
+# jobs.py) while one is running, so a slow All Entities report never ties up a web worker.
+JOB_ROW_THRESHOLD = int(os.environ.get('JOB_ROW_THRESHOLD', '250000'))
+
+metrics.register(metrics.Gauge('report_jobs_queued', 'Background report jobs waiting for the runner.',
+                               lambda: jobs.job_queue.counts().get(jobs.QUEUED, 0)))
+metrics.register(metrics.Gauge('report_jobs_running', 'Background report jobs being executed.',
+                               lambda: jobs.job_queue.counts().get(jobs.RUNNING, 0)))
+metrics.register(metrics.Gauge('report_job_runner_alive', '1 while a job runner is checking in, else 0.',
+                               lambda: int(jobs.job_queue.runner_alive())))
+
+def _run_as_job(selected_entity, selected_month, selected_year):
+    """True if a report over these filters is big enough to build in the background, and a runner is up to do it."""
+    if models.count_partition_rows(selected_entity, selected_month, selected_year) <= JOB_ROW_THRESHOLD:
+        return False
+    if not jobs.job_queue.runner_alive():
+        print(f"No job runner is alive: building the {selected_entity} {selected_year}-{selected_month} report inline")
+        return False
+    return True
+
+def _scope_user(scope):
+    # (current_username, user_role) that reproduces a row scope outside the requesting user's session
+    return (None, 'admin') if scope is None else (scope, None)
+
+def _export_download_name(report_type, selected_entity, selected_month, selected_year, export_format):
+    period = f"{selected_year}-{int(selected_month):02d}" if selected_month and selected_year else 'all'
+    return f"{report_type}-{secure_filename(selected_entity)}-{period}.{export_format}"
+
+def _job_report_body(params):
+    """The report body a finished job rendered; raises jobs.JobPending until it is there."""
+    job = jobs.job_queue.submit('report_body', params)
+    if job['state'] != jobs.DONE:
+        raise jobs.JobPending(job)
+    return jobs.job_queue.read_result(job).decode('utf-8')
+
+def _require_data_version(version):
+    # The runner may not have noticed a data.csv change the submitting worker already saw. A result
+    # rendered from another snapshot must not be stored under this version's key: fail the job so
+    # the next request queues it again instead.
+    if models.get_financial_data().version == version:
+        return
+    models.financial_store.reload()
+    current = models.get_financial_data().version
+    if current != version:
+        raise RuntimeError(f"financial data is at version {current[:12]}, not {version[:12]}")
+
+@jobs.handler('report_body')
+def _report_body_job(params, fileobj):
+    _require_data_version(params['version'])
+    definition = models.FINANCIAL_REPORT_DEFINITIONS[params['report_type']]
+    body = _render_generic_report_body(
+        params['report_type'], definition['columns'], params['entity'], params['month'], params['year'],
+        *_scope_user(params['scope']), params['page'], params['per_page'], params['sort_by'], params['descending']
+    )
+    fileobj.write(body.encode('utf-8'))
+    return None, 'text/html'
+
+@jobs.handler('report_stream')
+def _report_stream_job(params, fileobj):
+    # Every row of the report table (the ?stream=1 view), rendered chunk by chunk into the result file
+    _require_data_version(params['version'])
+    report_columns = models.FINANCIAL_REPORT_DEFINITIONS[params['report_type']]['columns']
+    df_filtered = _generic_report_rows(params['entity'], params['month'], params['year'], *_scope_user(params['scope']))
+    report_data, message = [], None
+    if df_filtered.empty:
+        message = "No data available for the selected criteria."
+    else:
+        report_data = models.iter_report_records(df_filtered, report_columns, sort_by=params['sort_by'], descending=params['descending'])
+    for piece in stream_template(
+        '_generic_report_body.html',
+        report_type=params['report_type'],
+        report_columns=report_columns,
+        report_data=report_data,
+        selected_entity=params['entity'],
+        selected_month=params['month'],
+        selected_year=params['year'],
+        message=message,
+        pagination=None,
+        sort_by=params['sort_by'],
+        descending=params['descending']
+    ):
+        fileobj.write(piece.encode('utf-8'))
+    return None, 'text/html'
+
+@jobs.handler('export')
+def _export_job(params, fileobj):
+    _require_data_version(params['version'])
+    report_type, export_format = params['report_type'], params['format']
+    definition = models.FINANCIAL_REPORT_DEFINITIONS[report_type]
+    columns = definition['columns']
+    df_filtered = _generic_report_rows(params['entity'], params['month'], params['year'], *_scope_user(params['scope']))
+    chunks = models.iter_report_chunks(df_filtered, columns, sort_by=params['sort_by'], descending=params['descending'])
+    if export_format == 'csv':
+        for piece in exports.iter_csv(chunks, columns):
+            fileobj.write(piece.encode('utf-8'))
+    else:
+        exports.write_xlsx(chunks, columns, fileobj, sheet_name=definition['name'])
+    download_name = _export_download_name(report_type, params['entity'], params['month'], params['year'], export_format)
+    return download_name, exports.EXPORT_MIMETYPES[export_format]
+
+def _job_for_user(job_id):
+    """The job, if the current user may see it: same row scope and access to its entity. 404 otherwise."""
+    job = jobs.job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    params = job['params']
+    entitlements = current_entitlements()
+    if params['scope'] != _row_scope(session.get('username'), session.get('user_role')):
+        abort(404)
+    if params['report_type'] not in entitlements.report_type_values:
+        abort(404)
+    if not (params['entity'] == 'All Entities' or entitlements.can_access_entity(params['entity'])):
+        abort(404)
+    if job['kind'] == 'export' and session.get('selected_role') not in ['admin', 'business_dev_manager']:
+        abort(404)
+    return job
+
+def _job_status(job):
+    status = {key: job[key] for key in ('id', 'kind', 'state', 'error', 'created_at', 'started_at', 'finished_at')}
+    status['result_url'] = url_for('reports.job_result', job_id=job['id']) if job['state'] == jobs.DONE else None
+    return status
+
+@reports_bp.route('/jobs/<job_id>')
+@login_required
+def job_page(job_id):
+    """Progress page for a background export; it polls job_status and offers the file when it's done."""
+    job = _job_for_user(job_id)
+    definition = models.FINANCIAL_REPORT_DEFINITIONS[job['params']['report_type']]
+    return render_template(
+        'report_job.html',
+        current_username=session.get('username'),
+        available_report_types=current_entitlements().report_types,
+        job=job,
+        status=_job_status(job),
+        report_title=definition['name']
+    )
+
+@reports_bp.route('/jobs/<job_id>/status')
+@login_required
+def job_status(job_id):
+    return jsonify(_job_status(_job_for_user(job_id)))
+
+@reports_bp.route('/jobs/<job_id>/result')
+@login_required
+def job_result(job_id):
+    job = _job_for_user(job_id)
+    if job['state'] != jobs.DONE or not os.path.exists(job['result_path']):
+        abort(404)
+    if job['kind'] in ('report_body', 'report_stream'):
+        return send_file(job['result_path'], mimetype=job['result_mimetype'])
+    return send_file(job['result_path'], mimetype=job['result_mimetype'], as_attachment=True, download_name=job['result_name'])
+
 @reports_bp.route('/')
 @login_required
 def index():
@@ -31,16 +296,17 @@ def dashboard():
     if selected_role == 'patient':
         return redirect(url_for('reports.patient_results'))
 
+    entitlements = current_entitlements()
+
     # If user selected physician and has only one entity, redirect to patient results for that entity
     if selected_role == 'physician_provider':
-        available_entities = models.get_available_entities_for_user(current_username, user_role)
-        if len(available_entities) == 1:
-            session['selected_entity'] = available_entities[0] # Automatically select the only entity
+        if len(entitlements.entities) == 1:
+            session['selected_entity'] = entitlements.entities[0] # Automatically select the only entity
             return redirect(url_for('reports.patient_results'))
 
     # For other roles, or if physician has multiple entities:
     # Get available report types based on the user's actual role
-    available_report_types = models.get_report_types_for_role(user_role)
+    available_report_types = entitlements.report_types
 
     # Get the selected entity, month, and year from session or request
     selected_entity = request.args.get('entity', session.get('selected_entity'))
@@ -60,6 +326,14 @@ def dashboard():
     report_title = "Dashboard"
     files = {}
     message = "Please select a report type from the sidebar."
+    pagination = None
+    report_body = None
+    report_body_pieces = None
+
+    # Generic report paging/sorting options; stream=1 renders every row as a chunked response instead
+    sort_by = request.args.get('sort')
+    descending = request.args.get('order') == 'desc'
+    stream_rows = request.args.get('stream') == '1'
 
     if report_type:
         definition = models.get_report_definition(report_type)
@@ -73,6 +347,12 @@ def dashboard():
         if report_type == 'marketing_material':
             files = models.get_marketing_materials(selected_entity)
             message = None # No generic message needed for marketing materials
+        elif report_type == 'financials':
+            if not selected_entity or not entitlements.can_access_entity(selected_entity):
+                flash('Please select an entity you have access to.', 'error')
+                return redirect(url_for('reports.select_entity'))
+            files = models.get_financial_statements(selected_entity)
+            message = None
         elif report_type == 'monthly_bonus':
             # Monthly bonus report logic
             if not selected_month or not selected_year:
@@ -80,53 +360,18 @@ def dashboard():
                 return redirect(url_for('reports.select_report', report_type='monthly_bonus'))
             else:
                 # Special handling for monthly bonus, it's always for the logged-in user's entities
-                # Admins and specific users get all data; others filtered by their associated rep name/username
-                df_filtered = models.filter_financial_data(
-                    models.data_df,
-                    selected_entity=None, # Monthly bonus is not entity-filtered in the same way
-                    selected_month=selected_month,
-                    selected_year=selected_year,
-                    current_username=current_username,
-                    entity_filter_enabled=False # Filter by username in this case
-                )
-
-                # Filter by entity if the user is NOT an unfiltered access user
+                # Admins and specific users get all data; others filtered by their associated username
+                # and assigned entities. Totals come pre-aggregated from the bonus cube.
+                user_entities = None
                 if current_username not in models.UNFILTERED_ACCESS_USERS:
-                    user_info = models.get_user(current_username)
-                    if user_info:
-                        user_entities = user_info.get('entities', [])
-                        df_filtered = df_filtered[df_filtered['Entity'].isin(user_entities)]
-
-                # Group by 'Associated Rep Name' (and 'Entity' if it's not All Entities)
-                group_cols = ['Associated Rep Name']
-                if selected_entity and selected_entity != 'All Entities':
-                    group_cols.append('Entity')
+                    user_entities = list(entitlements.assigned_entities)
 
-                # Filter to current user's associated rep name if they are not unfiltered access
-                if current_username not in models.UNFILTERED_ACCESS_USERS:
-                    df_filtered = df_filtered[df_filtered['Username'].apply(lambda x: current_username in x.split(','))]
-
-                if not df_filtered.empty:
-                    # Aggregate the relevant columns for monthly bonus
-                    bonus_data = df_filtered.groupby(['Associated Rep Name', 'Entity']).agg(
-                        Reimbursement=pd.NamedAgg(column='Reimbursement', aggfunc='sum'),
-                        COGS=pd.NamedAgg(column='COGS', aggfunc='sum'),
-                        Net=pd.NamedAgg(column='Net', aggfunc='sum'),
-                        Commission=pd.NamedAgg(column='Commission', aggfunc='sum')
-                    ).reset_index()
-
-                    # Round numeric columns to 2 decimal places
-                    numeric_cols = ['Reimbursement', 'COGS', 'Net', 'Commission']
-                    for col in numeric_cols:
-                        if col in bonus_data.columns:
-                            bonus_data[col] = bonus_data[col].round(2)
-
-                    report_data = bonus_data.to_dict(orient='records')
-                    report_columns = ['Associated Rep Name', 'Entity', 'Reimbursement', 'COGS', 'Net', 'Commission']
-                else:
-                    message = "No data available for the selected month/year and your associated entities."
-                    report_data = [] # Ensure report_data is an empty list if no data
-                    report_columns = [] # Ensure report_columns is empty
+                # Everyone with the same username filter and entities sees the same table
+                bonus_table = fragment_cache.get_or_render(
+                    _bonus_table_key(selected_month, selected_year, current_username, user_entities),
+                    models.get_financial_data().version,
+                    lambda: _render_bonus_table(selected_month, selected_year, current_username, user_entities)
+                )
 
             return render_template(
                 'monthly_bonus.html',
@@ -138,7 +383,8 @@ def dashboard():
                 selected_year=selected_year,
                 months=models.MONTHS,
                 years=models.YEARS,
-                message=message
+                message=message,
+                bonus_table=bonus_table
             )
         else: # Generic financial reports
             if not selected_entity:
@@ -150,43 +396,73 @@ def dashboard():
                     # For other roles like physician/patient, this case should ideally not happen
                     # as they are redirected earlier or forced to select entity.
                     return redirect(url_for('reports.dashboard'))
-
-            df_filtered = models.filter_financial_data(
-                models.data_df,
-                selected_entity=selected_entity,
-                selected_month=selected_month,
-                selected_year=selected_year
+            if not entitlements.can_access_entity(selected_entity) and selected_entity != 'All Entities':
+                flash('You do not have permission to access the selected entity.', 'error')
+                return redirect(url_for('reports.select_entity'))
+
+            # Normalized before any cache key or job is built, so every spelling of the same page shares
+            # one entry and one job (pages are clamped to the partition row count, an upper bound)
+            sort_by, descending, page, per_page = models.normalize_report_args(
+                report_columns, sort_by, descending,
+                request.args.get('page', 1, type=int),
+                request.args.get('per_page', models.DEFAULT_PAGE_SIZE, type=int),
+                models.count_partition_rows(selected_entity, selected_month, selected_year)
             )
-
-            # Further filter by the current user's associated username if not an unfiltered access user
-            if current_username not in models.UNFILTERED_ACCESS_USERS and user_role not in ['admin']:
-                if 'Username' in df_filtered.columns:
-                    df_filtered = df_filtered[df_filtered['Username'].apply(lambda x: current_username in str(x).split(', '))]
+            if stream_rows and _run_as_job(selected_entity, selected_month, selected_year):
+                # Large tables are rendered by the job runner; this worker only streams the finished file out
+                job = jobs.job_queue.submit('report_stream', dict(
+                    version=models.get_financial_data().version, report_type=report_type, entity=selected_entity,
+                    month=selected_month, year=selected_year, scope=_row_scope(current_username, user_role),
+                    sort_by=sort_by, descending=descending
+                ))
+                if job['state'] == jobs.DONE:
+                    report_body_pieces = jobs.job_queue.iter_text_result(job)
                 else:
-                    flash('Error: "Username" column not found in data for filtering.', 'error')
-                    report_data = []
-
-            if not df_filtered.empty:
-                # Select only the relevant columns and convert to list of dicts
-                if 'PatientID' in report_columns and 'PatientID' not in df_filtered.columns:
-                    # This handles the case where PatientID might not be in all dummy data
-                    # In real data, you'd expect it to be present if column is requested
-                    flash('PatientID column not found in data for this report.', 'error')
-                    report_data = []
+                    report_body = render_template('_report_job_pending.html', job=job, status=_job_status(job))
+            elif stream_rows:
+                df_filtered = _generic_report_rows(selected_entity, selected_month, selected_year, current_username, user_role)
+                if not df_filtered.empty:
+                    # Rows are converted chunk by chunk while the response is being written
+                    report_data = models.iter_report_records(df_filtered, report_columns, sort_by=sort_by, descending=descending)
                 else:
-                    report_data = df_filtered[report_columns].to_dict(orient='records')
+                    message = "No data available for the selected criteria."
+                    report_data = []
             else:
-                message = "No data available for the selected criteria."
-                report_data = []
-
-    # Render generic_report for most financial reports and marketing materials
-    if report_type == 'marketing_material':
+                version = models.get_financial_data().version
+
+                def render():
+                    if _run_as_job(selected_entity, selected_month, selected_year):
+                        return _job_report_body(dict(
+                            version=version, report_type=report_type, entity=selected_entity, month=selected_month,
+                            year=selected_year, scope=_row_scope(current_username, user_role), page=page,
+                            per_page=per_page, sort_by=sort_by, descending=descending
+                        ))
+                    return _render_generic_report_body(
+                        report_type, report_columns, selected_entity, selected_month, selected_year,
+                        current_username, user_role, page, per_page, sort_by, descending
+                    )
+
+                # Reps opening the same month's report share one rendered table until data.csv changes
+                try:
+                    report_body = fragment_cache.get_or_render(
+                        _generic_report_key(report_type, selected_entity, selected_month, selected_year,
+                                            current_username, user_role, page, per_page, sort_by, descending),
+                        version,
+                        render
+                    )
+                except jobs.JobPending as pending:
+                    # Not cached: the page polls the job and reloads once the table is ready
+                    report_body = render_template('_report_job_pending.html', job=pending.job,
+                                                  status=_job_status(pending.job))
+
+    # Render generic_report for most financial reports; statements and marketing materials are file lists
+    if report_type in ('marketing_material', 'financials'):
         return render_template(
             'dashboard.html',
             current_username=current_username,
             user_role=user_role,
             selected_entity=selected_entity,
-            available_entities=models.get_available_entities_for_user(current_username, user_role),
+            available_entities=list(entitlements.entities),
             available_report_types=available_report_types,
             report_type=report_type,
             report_title=report_title,
@@ -194,12 +470,11 @@ def dashboard():
             message=message
         )
     else:
-        return render_template(
-            'generic_report.html',
+        template_context = dict(
             current_username=current_username,
             user_role=user_role,
             selected_entity=selected_entity,
-            available_entities=models.get_available_entities_for_user(current_username, user_role),
+            available_entities=list(entitlements.entities),
             available_report_types=available_report_types,
             report_type=report_type,
             report_title=report_title,
@@ -209,9 +484,85 @@ def dashboard():
             selected_year=selected_year,
             months=models.MONTHS,
             years=models.YEARS,
-            message=message
+            message=message,
+            pagination=pagination,
+            sort_by=sort_by,
+            descending=descending
+        )
+        if report_body_pieces is not None:
+            template_context['report_body_pieces'] = report_body_pieces
+            return Response(stream_template('generic_report.html', **template_context))
+        if stream_rows and report_data:
+            return Response(stream_template('generic_report.html', **template_context))
+        if report_body is not None:
+            template_context['report_body'] = report_body
+        return render_template('generic_report.html', **template_context)
+
+
+@reports_bp.route('/export/<report_type>')
+@login_required
+@role_required(['admin', 'business_dev_manager'])
+def export_report(report_type):
+    """
+    Downloads a generic financial report as CSV (streamed) or XLSX (?format=xlsx), applying
+    the same entity/month/year filters and username restriction as the dashboard.
+    """
+    current_username = session.get('username')
+    user_role = session.get('user_role')
+    export_format = request.args.get('format', 'csv')
+
+    entitlements = current_entitlements()
+    definition = models.FINANCIAL_REPORT_DEFINITIONS.get(report_type)
+    if not definition or report_type not in entitlements.report_type_values:
+        flash(f'Invalid report type: {report_type}', 'error')
+        return redirect(url_for('reports.dashboard'))
+    if export_format not in exports.EXPORT_MIMETYPES:
+        flash(f'Unsupported export format: {export_format}', 'error')
+        return redirect(url_for('reports.dashboard'))
+
+    selected_entity = request.args.get('entity', session.get('selected_entity'))
+    selected_month = request.args.get('month', session.get('selected_month'))
+    selected_year = request.args.get('year', session.get('selected_year'))
+
+    if not selected_entity or not (selected_entity == 'All Entities' or entitlements.can_access_entity(selected_entity)):
+        flash('You do not have permission to access the selected entity.', 'error')
+        return redirect(url_for('reports.select_entity'))
+
+    if export_format == 'xlsx' and not exports.XLSX_AVAILABLE:
+        flash('Excel export is not available on this server. Please download CSV instead.', 'error')
+        return redirect(url_for('reports.dashboard'))
+
+    sort_by, descending, _, _ = models.normalize_report_args(
+        definition['columns'], request.args.get('sort'), request.args.get('order') == 'desc'
+    )
+    if _run_as_job(selected_entity, selected_month, selected_year):
+        # Large exports are written by the job runner; the progress page links to the file
+        job = jobs.job_queue.submit('export', dict(
+            version=models.get_financial_data().version, report_type=report_type, format=export_format,
+            entity=selected_entity, month=selected_month, year=selected_year,
+            scope=_row_scope(current_username, user_role), sort_by=sort_by, descending=descending
+        ))
+        return redirect(url_for('reports.job_page', job_id=job['id']))
+
+    columns = definition['columns']
+    df_filtered = _generic_report_rows(selected_entity, selected_month, selected_year, current_username, user_role)
+    chunks = models.iter_report_chunks(df_filtered, columns, sort_by=sort_by, descending=descending)
+    download_name = _export_download_name(report_type, selected_entity, selected_month, selected_year, export_format)
+
+    if export_format == 'csv':
+        return Response(
+            exports.iter_csv(chunks, columns),
+            mimetype=exports.EXPORT_MIMETYPES['csv'],
+            headers={'Content-Disposition': f'attachment; filename="{download_name}"'}
         )
 
+    # The workbook is spooled to a temporary file (deleted when the response closes it)
+    workbook_file = tempfile.TemporaryFile()
+    with metrics.stage('export'):
+        exports.write_xlsx(chunks, columns, workbook_file, sheet_name=definition['name'])
+    workbook_file.seek(0)
+    return send_file(workbook_file, mimetype=exports.EXPORT_MIMETYPES['xlsx'], as_attachment=True, download_name=download_name)
+
 
 @reports_bp.route('/select_entity', methods=['GET', 'POST'])
 @login_required # Ensure login_required decorator is imported and used
@@ -224,7 +575,7 @@ def select_entity():
     if user_role == 'patient':
         return redirect(url_for('reports.patient_results'))
 
-    available_entities = models.get_available_entities_for_user(current_username, user_role)
+    available_entities = list(current_entitlements().entities)
 
     # If only one entity is available for a physician/provider, automatically select it and go to dashboard
     if user_role == 'physician_provider' and len(available_entities) == 1:
@@ -238,7 +589,7 @@ def select_entity():
                 session['selected_entity'] = entity_name
                 flash('All Entities selected.', 'info')
                 return redirect(url_for('reports.dashboard'))
-            elif entity_name in available_entities:
+            elif current_entitlements().can_access_entity(entity_name):
                 session['selected_entity'] = entity_name
                 flash(f'Entity "{entity_name}" selected successfully.', 'success')
                 return redirect(url_for('reports.dashboard'))
@@ -275,8 +626,9 @@ def select_report():
         return redirect(url_for('reports.select_entity'))
 
 
-    available_report_types = models.get_report_types_for_role(user_role)
-    available_entities = models.get_available_entities_for_user(current_username, user_role)
+    entitlements = current_entitlements()
+    available_report_types = entitlements.report_types
+    available_entities = list(entitlements.entities)
 
     # For admin/BDM, add 'All Entities' option for selection if not already there
     if user_role in ['admin', 'business_dev_manager'] and 'All Entities' not in available_entities:
@@ -375,8 +727,7 @@ def patient_results():
             return redirect(url_for('reports.select_entity'))
         
         # Verify physician has access to this entity
-        available_entities = models.get_available_entities_for_user(current_username, user_role)
-        if target_entity not in available_entities:
+        if not current_entitlements().can_access_entity(target_entity):
             flash(f"You do not have access to view patient results for {target_entity}.", 'error')
             return redirect(url_for('reports.select_entity'))
 
@@ -387,7 +738,8 @@ def patient_results():
     patient_name = models.get_user(current_username).get('full_name', current_username) if user_role == 'physician_provider' else current_username
 
     if user_role == 'patient':
-        results_by_dos = models.get_patient_reports_for_patient_id(patient_id, target_entity)
+        with metrics.stage('patient_lookup'):
+            results_by_dos = models.get_patient_reports_for_patient_id(patient_id, target_entity)
         if not results_by_dos:
             message = "No patient results found for your ID at this entity."
         else:
@@ -400,10 +752,17 @@ def patient_results():
         results_by_dos = {}
         message = None
 
+        suggestions = []
+
         if search_patient_id:
-            results_by_dos = models.get_patient_reports_for_patient_id(search_patient_id, target_entity)
+            with metrics.stage('patient_lookup'):
+                results_by_dos = models.get_patient_reports_for_patient_id(search_patient_id, target_entity)
             if not results_by_dos:
                 message = f"No results found for Patient ID: {search_patient_id} at {target_entity}."
+                # Offer close matches (typos, partial IDs) at this entity
+                with metrics.stage('patient_search'):
+                    found = models.patient_results_catalog.search_patient_ids(search_patient_id, [target_entity])
+                suggestions = found['matches'] + found['suggestions']
             else:
                 message = f"Results for Patient ID: {search_patient_id} at {target_entity}."
         else:
@@ -415,12 +774,31 @@ def patient_results():
             results_by_dos=results_by_dos,
             message=message,
             current_search_patient_id=search_patient_id,
+            suggestions=suggestions,
             selected_entity=target_entity, # Pass selected entity to template
             show_search_form=True # Indicate to the template to show the search form
         )
     return redirect(url_for('reports.dashboard')) # Fallback
 
 
+@reports_bp.route('/patient_ids/autocomplete')
+@login_required
+@role_required(['physician_provider'])
+def patient_id_autocomplete():
+    """
+    JSON typeahead for the physician patient search: IDs starting with ?q= plus close
+    (one-edit) matches, limited to ?entity= or else to every entity the physician can access.
+    """
+    entitlements = current_entitlements()
+    entity = request.args.get('entity')
+    if entity and not entitlements.can_access_entity(entity):
+        return jsonify({'error': 'You do not have access to this entity.'}), 403
+    entities = [entity] if entity else list(entitlements.entities)
+    with metrics.stage('patient_search'):
+        found = models.patient_results_catalog.search_patient_ids(request.args.get('q', ''), entities)
+    return jsonify(found)
+
+
 @reports_bp.route('/privacy_policy')
 def privacy_policy():
     return render_template('privacy.html')
@@ -431,43 +809,34 @@ def unauthorized():
 
 @reports_bp.route('/marketing_material/<path:filename>')
 def serve_marketing_material(filename):
-    """Serves dummy marketing material files."""
-    marketing_dir = os.path.join(reports_bp.root_path, 'static', 'marketing_materials')
-    os.makedirs(marketing_dir, exist_ok=True) # Ensure directory exists
-    
-    dummy_file_path = os.path.join(marketing_dir, filename)
-    if not os.path.exists(dummy_file_path):
-        with open(dummy_file_path, 'wb') as f:
-            f.write(b'%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj 2 0 obj<</Type/Pages/Count 1/Kids[3 0 R]>>endobj 3 0 obj<</Type/Page/MediaBox[0 0 612 792]/Contents 4 0 R/Parent 2 0 R>>endobj 4 0 obj<</Length 55>>stream\nBT /F1 24 Tf 100 700 Td (This is a dummy Marketing Material: ' + filename.encode() + b') Tj ET\\nendstream\\nendobj\\nxref\\n0 5\\n0000000000 65535 f\\n0000000009 00000 n\\n0000000055 00000 n\\n0000000104 00000 n\\n0000000192 00000 n\\ntrailer<</Size 5/Root 1 0 R>>startxref\\n296\\n%%EOF')
-        print(f"Created dummy Marketing Material: {dummy_file_path}")
-    
-    return send_from_directory(marketing_dir, filename, as_attachment=False)
+    """Serves marketing material listed in the download manifest (404 otherwise)."""
+    return filestore.downloads.send('marketing_material', filename)
 
 @reports_bp.route('/training_material/<path:filename>')
 def serve_training_material(filename):
-    """Serves dummy training material files."""
-    training_dir = os.path.join(reports_bp.root_path, 'static', 'training_materials')
-    os.makedirs(training_dir, exist_ok=True) # Ensure directory exists
-    
-    dummy_file_path = os.path.join(training_dir, filename)
-    if not os.path.exists(dummy_file_path):
-        with open(dummy_file_path, 'wb') as f:
-            f.write(b'%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj 2 0 obj<</Type/Pages/Count 1/Kids[3 0 R]>>endobj 3 0 obj<</Type/Page/MediaBox[0 0 612 792]/Contents 4 0 R/Parent 2 0 R>>endobj 4 0 obj<</Length 55>>stream\nBT /F1 24 Tf 100 700 Td (This is a dummy Training Material: ' + filename.encode() + b') Tj ET\\nendstream\\nendobj\\nxref\\n0 5\\n0000000000 65535 f\\n0000000009 00000 n\\n0000000055 00000 n\\n0000000104 00000 n\\n0000000192 00000 n\\ntrailer<</Size 5/Root 1 0 R>>startxref\\n296\\n%%EOF')
-        print(f"Created dummy Training Material: {dummy_file_path}")
-    
-    return send_from_directory(training_dir, filename, as_attachment=False)
+    """Serves training material listed in the download manifest (404 otherwise)."""
+    return filestore.downloads.send('training_material', filename)
+
 
+def _may_view_patient_result(patient_id, entity):
+    # Patients see their own results at their entity; physicians see results at entities they are entitled to
+    user_role = session.get('user_role')
+    if user_role == 'patient':
+        user_info = models.get_user(session.get('username')) or {}
+        return patient_id == session.get('patient_id') and entity in (user_info.get('entities') or [])
+    if user_role == 'physician_provider':
+        return current_entitlements().can_access_entity(entity)
+    return False
+
+def send_patient_result(filename):
+    """Serves a patient result file to the patient it belongs to or an entitled physician (404 otherwise)."""
+    owner = models.patient_results_catalog.owner(f"/patient_results/{filename}")
+    if owner is None or not _may_view_patient_result(*owner):
+        abort(404)
+    return filestore.downloads.send('patient_results', filename)
 
 @reports_bp.route('/patient_results/<path:filename>')
+@login_required
 def serve_patient_results(filename):
-    """Serves dummy patient result files."""
-    patient_reports_dir = os.path.join(reports_bp.root_path, 'static', 'patient_reports')
-    os.makedirs(patient_reports_dir, exist_ok=True) # Ensure directory exists
-    
-    dummy_file_path = os.path.join(patient_reports_dir, filename)
-    if not os.path.exists(dummy_file_path):
-        with open(dummy_file_path, 'wb') as f:
-            f.write(b'%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj 2 0 obj<</Type/Pages/Count 1/Kids[3 0 R]>>endobj 3 0 obj<</Type/Page/MediaBox[0 0 612 792]/Contents 4 0 R/Parent 2 0 R>>endobj 4 0 obj<</Length 55>>stream\nBT /F1 24 Tf 100 700 Td (This is a dummy Patient Report: ' + filename.encode() + b') Tj ET\\nendstream\\nendobj\\nxref\\n0 5\\n0000000000 65535 f\\n0000000009 00000 n\\n0000000055 00000 n\\n0000000104 00000 n\\n0000000192 00000 n\\ntrailer<</Size 5/Root 1 0 R>>startxref\\n296\\n%%EOF')
-        print(f"Created dummy Patient Report: {dummy_file_path}")
-    
-    return send_from_directory(patient_reports_dir, filename, as_attachment=False)
+    """Serves patient result files listed in the patient results catalog and the download manifest."""
+    return send_patient_result(filename)
@@ -0,0 +1,75 @@
+import pandas as pd
+
+import indexes
+
+BONUS_DIMENSIONS = ['Associated Rep Name', 'Entity']
+BONUS_MEASURES = ['Reimbursement', 'COGS', 'Net', 'Commission']
+# Username is kept as the raw (possibly comma-separated) value so that rows shared by several
+# users are counted once when the cube is rolled up for an unfiltered user.
+CUBE_KEYS = ['Entity', 'Associated Rep Name', 'Username']
+
+
+class BonusPeriod:
+    """Pre-aggregated bonus rows for one (year, month), plus a Username index over them."""
+
+    def __init__(self, cube):
+        self.cube = cube.reset_index(drop=True)
+        self.usernames = indexes.UsernameIndex(self.cube)
+
+
+class BonusRollup:
+    """
+    Materialized cube of monthly bonus sums keyed by (year, month, Entity, Associated Rep Name,
+    Username). Built when a snapshot loads; a bonus page is a lookup plus a groupby over the
+    handful of cube rows for that month instead of over the raw rows.
+    """
+
+    def __init__(self, df):
+        self.periods = {}
+        self.update(df)
+
+    def update(self, df):
+        """(Re)builds the periods present in df, leaving other months untouched."""
+        rows = df[df['Date'].notna() & df['Associated Rep Name'].notna()]
+        if rows.empty:
+            return
+        # Username may be missing; fill so groupby keeps those rows (they count for unfiltered users).
+        cube = rows.assign(
+            year=rows['Date'].dt.year,
+            month=rows['Date'].dt.month,
+            Username=rows['Username'].fillna(''),
+        ).groupby(['year', 'month'] + CUBE_KEYS, observed=True)[BONUS_MEASURES].sum().reset_index()
+
+        for (year, month), period_cube in cube.groupby(['year', 'month']):
+            self.periods[(int(year), int(month))] = BonusPeriod(period_cube.drop(columns=['year', 'month']))
+
+    def updated(self, rows):
+        """A new rollup with the periods in rows rebuilt from rows; every other period is shared with this one."""
+        rollup = BonusRollup.__new__(BonusRollup)
+        rollup.periods = dict(self.periods)
+        rollup.update(rows)
+        return rollup
+
+    def rows_in_period(self, year, month):
+        """Cube rows a monthly_bonus() call for the period looks at."""
+        period = self.periods.get((int(year), int(month)))
+        return len(period.cube) if period is not None else 0
+
+    def monthly_bonus(self, year, month, username=None, entities=None):
+        """
+        Bonus totals per (Associated Rep Name, Entity) for one month, rounded to cents.
+        username limits the rows to those tagged with it; entities limits the Entity values.
+        """
+        period = self.periods.get((int(year), int(month)))
+        if period is None:
+            return pd.DataFrame(columns=BONUS_DIMENSIONS + BONUS_MEASURES)
+
+        cube = period.cube
+        if username:
+            cube = period.usernames.take(cube, username)
+        if entities is not None:
+            cube = cube[cube['Entity'].isin(entities)]
+
+        bonus_data = cube.groupby(BONUS_DIMENSIONS, observed=True)[BONUS_MEASURES].sum().reset_index()
+        bonus_data[BONUS_MEASURES] = bonus_data[BONUS_MEASURES].round(2)
+        return bonus_data
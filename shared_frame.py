@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+import indexes
+
+# Bump whenever the on-disk segment layout changes.
+SEGMENT_FORMAT_VERSION = 1
+
+FRAME_FILE = 'frame.arrow'
+USERNAMES_FILE = 'usernames.arrow'
+META_FILE = 'meta.json'
+
+# Missing dates are stored as this int64 (it is what NaT is underneath).
+_NAT = np.iinfo('int64').min
+
+
+# --- Writing ---
+def _encode_column(series):
+    """(arrow array, meta) for one column, laid out so reading it back never copies."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        return pa.array(codes), {'kind': 'category', 'categories': series.cat.categories.tolist()}
+    if pd.api.types.is_datetime64_dtype(series.dtype):
+        values = series.to_numpy(dtype='datetime64[ns]').view('int64')
+        return pa.array(values), {'kind': 'datetime'}
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        # from_pandas=False keeps NaN as a value instead of a null, so the column stays zero-copy
+        return pa.array(series.to_numpy(), from_pandas=False), {'kind': 'numeric'}
+    values = series.astype(object).where(series.notna(), None)
+    return pa.array(values.tolist(), type=pa.large_string()), {'kind': 'string'}
+
+
+def write_segment(path, df, usernames, lineage=None):
+    """
+    Writes df and its UsernameIndex to the segment directory path. The segment is built under
+    a temporary name and renamed into place, so readers only ever see a complete segment.
+    lineage (JSON-serializable) records how the segment was derived; see read_lineage().
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        arrays, columns = [], []
+        for name in df.columns:
+            array, meta = _encode_column(df[name])
+            arrays.append(array)
+            columns.append(dict(meta, name=name))
+        frame = pa.Table.from_arrays(arrays, names=list(df.columns))
+        _write_arrow(os.path.join(tmp_path, FRAME_FILE), frame)
+
+        names, offsets, positions = usernames.to_arrays()
+        _write_arrow(os.path.join(tmp_path, USERNAMES_FILE), pa.table({'position': pa.array(positions)}))
+
+        meta = {
+            'format': SEGMENT_FORMAT_VERSION,
+            'row_count': len(df),
+            'columns': columns,
+            'usernames': {'names': names, 'offsets': offsets.tolist()},
+            'lineage': lineage,
+        }
+        with open(os.path.join(tmp_path, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+            shutil.rmtree(tmp_path, ignore_errors=True)  # Another worker published it first
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def _write_arrow(path, table):
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+# --- Reading ---
+def _map_arrow(path):
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def _numpy_view(column):
+    return column.chunk(0).to_numpy(zero_copy_only=True) if column.num_chunks else np.array([], dtype=column.type.to_pandas_dtype())
+
+
+def _decode_column(column, meta):
+    kind = meta['kind']
+    if kind == 'category':
+        return pd.Categorical.from_codes(_numpy_view(column), categories=meta['categories'], validate=False)
+    if kind == 'datetime':
+        return _numpy_view(column).view('datetime64[ns]')
+    if kind == 'numeric':
+        return _numpy_view(column)
+    # Arrow-backed strings with NaN for missing values, like the object columns they replace
+    return pd.StringDtype('pyarrow', na_value=np.nan).__from_arrow__(column)
+
+
+def read_lineage(path):
+    """The lineage a segment was written with (None for segments built from a full parse)."""
+    with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+        return json.load(f).get('lineage')
+
+
+def open_segment(path):
+    """
+    Maps a segment read-only and returns (df, UsernameIndex) backed directly by the mapped
+    pages: every worker that opens the same segment shares one physical copy of the data.
+    """
+    with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('format') != SEGMENT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported segment format {meta.get('format')!r}")
+
+    frame = _map_arrow(os.path.join(path, FRAME_FILE))
+    # copy=False keeps one block per column (no consolidation), so nothing is copied out of the map
+    df = pd.DataFrame(
+        {column['name']: _decode_column(frame.column(column['name']), column) for column in meta['columns']},
+        copy=False
+    )
+
+    positions = _numpy_view(_map_arrow(os.path.join(path, USERNAMES_FILE)).column('position'))
+    usernames = indexes.UsernameIndex.from_arrays(
+        meta['usernames']['names'], np.asarray(meta['usernames']['offsets'], dtype='int64'), positions
+    )
+    return df, usernames
@@ -0,0 +1,168 @@
+import os
+import re
+import threading
+import time
+from urllib.parse import quote
+
+import access
+import filestore
+
+# --- Locations ---
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+STATEMENTS_DIR = os.environ.get('STATEMENTS_DIR', os.path.join(PROJECT_ROOT, 'static'))
+
+# How often (in seconds) a worker re-stats the statements directory for added or removed PDFs.
+REFRESH_INTERVAL = float(os.environ.get('STATEMENTS_REFRESH_INTERVAL', '30'))
+
+# Statements are named '<Entity> - <Statement> - <Year> - <Cash|Accrual> Basis.pdf', with spacing
+# around the dashes and capitalisation varying from file to file.
+STATEMENT_FILENAME = re.compile(
+    r'^(?P<entity>.+?)\s*-\s*(?P<statement>[^-]+?)\s*-\s*(?P<year>\d{4})\s*-\s*(?P<basis>cash|accrual)\s+basis\.pdf$',
+    re.IGNORECASE
+)
+
+# Canonical statement names, keyed by their lowercased, single-spaced form.
+STATEMENT_TYPES = {
+    'balance sheet': 'Balance Sheet',
+    'profit and loss account': 'Profit and Loss',
+    'profit and loss': 'Profit and Loss',
+    'ytd management report': 'YTD Management Report',
+}
+
+BASES = {'cash': 'Cash', 'accrual': 'Accrual'}
+
+
+def _collapse(text):
+    return ' '.join(str(text).lower().split())
+
+
+def normalize_statement_type(name):
+    key = _collapse(name)
+    return STATEMENT_TYPES.get(key, ' '.join(word.capitalize() for word in key.split()))
+
+
+def normalize_basis(basis):
+    return BASES.get(_collapse(basis).replace(' basis', ''))
+
+
+class Statement:
+    """One financial statement PDF and its normalized (entity, statement type, year, basis)."""
+
+    def __init__(self, entity, statement_type, year, basis, filename, file_entry):
+        self.entity = entity
+        self.statement_type = statement_type
+        self.year = year
+        self.basis = basis
+        self.filename = filename
+        self.file_entry = file_entry
+
+    @property
+    def key(self):
+        return (self.entity, self.statement_type, self.year, self.basis)
+
+    @property
+    def name(self):
+        return f"{self.statement_type} {self.year} ({self.basis} Basis)"
+
+    @property
+    def link(self):
+        parts = [self.entity, self.statement_type, self.basis, str(self.year)]
+        return '/download_report/financials/' + '/'.join(quote(part, safe='') for part in parts)
+
+
+def parse_statement_filename(filename, known_entities):
+    """Returns (entity, statement_type, year, basis) for a statement PDF name, or None."""
+    match = STATEMENT_FILENAME.match(filename)
+    if not match:
+        return None
+    entity = access.normalize_entity_name(match.group('entity'), known_entities)
+    if entity is None:
+        return None
+    return (
+        entity,
+        normalize_statement_type(match.group('statement')),
+        int(match.group('year')),
+        BASES[match.group('basis').lower()],
+    )
+
+
+class StatementIndex:
+    """One scan of the statements directory: lookups by key and per-entity listings."""
+
+    def __init__(self, statements, version, skipped=()):
+        self.by_key = {statement.key: statement for statement in statements}
+        self.by_entity = {}
+        for statement in sorted(self.by_key.values(), key=lambda s: (-s.year, s.statement_type, s.basis)):
+            self.by_entity.setdefault(statement.entity, []).append(statement)
+        self.version = version
+        self.skipped = list(skipped)
+
+
+class StatementCatalog:
+    """
+    Financial statements in STATEMENTS_DIR, indexed by normalized (entity, statement type, year,
+    basis) so 'Amico DX LLC - Balance sheet' and 'AMICO Dx LLC - Balance Sheet' are the same
+    statement. The directory is scanned once and re-scanned only when its mtime changes (checked
+    at most every check_interval seconds); lookups and listings are dict reads.
+    """
+
+    def __init__(self, entities, directory=STATEMENTS_DIR, check_interval=REFRESH_INTERVAL):
+        self.entities = list(entities)
+        self.directory = directory
+        self.check_interval = check_interval
+        self._index = StatementIndex([], None)
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the current StatementIndex, rescanning the directory if it changed."""
+        now = time.monotonic()
+        if self._last_check is not None and now - self._last_check < self.check_interval:
+            return self._index
+
+        with self._lock:
+            self._last_check = now
+            try:
+                version = os.stat(self.directory).st_mtime_ns
+            except FileNotFoundError:
+                self._index = StatementIndex([], None)
+                return self._index
+            if version != self._index.version:
+                self._index = self._scan(version)
+                if self._index.skipped:
+                    print(f"Ignoring unrecognised statement files in {self.directory}: {self._index.skipped}")
+            return self._index
+
+    def _scan(self, version):
+        found = {}
+        skipped = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or not entry.name.lower().endswith('.pdf'):
+                continue
+            parsed = parse_statement_filename(entry.name, self.entities)
+            if parsed is None:
+                if not entry.name.startswith('Patient_'):
+                    skipped.append(entry.name)
+                continue
+            statement = Statement(*parsed, entry.name, filestore.FileEntry(entry.path, entry.stat()))
+            # The same statement is often uploaded more than once under differently spelled names;
+            # the most recently modified copy wins.
+            current = found.get(statement.key)
+            if current is None or (statement.file_entry.mtime, statement.filename) > (current.file_entry.mtime, current.filename):
+                found[statement.key] = statement
+        return StatementIndex(found.values(), version, sorted(skipped))
+
+    def lookup(self, entity, statement_type, year, basis):
+        """The Statement for these (loosely written) values, or None."""
+        if entity not in self.entities:  # Links carry the canonical name; anything else is normalized
+            entity = access.normalize_entity_name(entity, self.entities)
+        basis = normalize_basis(basis)
+        try:
+            year = int(year)
+        except (TypeError, ValueError):
+            return None
+        return self.get().by_key.get((entity, normalize_statement_type(statement_type), year, basis))
+
+    def for_entity(self, entity):
+        """The entity's statements, newest year first."""
+        return self.get().by_entity.get(entity, [])
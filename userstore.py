@@ -0,0 +1,232 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+
+import db
+
+# --- Locations ---
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+USERS_JSON_PATH = os.environ.get('USERS_JSON', os.path.join(PROJECT_ROOT, 'users.json'))
+USER_DB_PATH = os.environ.get('USER_DB_PATH', os.path.join(PROJECT_ROOT, 'users.db'))
+
+# Seconds a user record stays in a worker's read-through cache before it is re-read.
+CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+
+# Plain SQL with standard types so the schema carries over to Postgres unchanged
+# (only the '?' placeholders would become '%s' under psycopg).
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL,
+        full_name TEXT,
+        patient_id TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS user_entities (
+        username TEXT NOT NULL REFERENCES users (username) ON DELETE CASCADE,
+        entity TEXT NOT NULL,
+        PRIMARY KEY (username, entity)
+    )""",
+    # One row, bumped in the same transaction as every write: workers compare it to notice changes
+    """CREATE TABLE IF NOT EXISTS user_generation (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        generation INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_users_role ON users (role)",
+    "CREATE INDEX IF NOT EXISTS idx_users_patient_id ON users (patient_id)",
+]
+
+
+def load_seed_users(path=USERS_JSON_PATH):
+    """Reads the seeded accounts (with precomputed password hashes) from users.json."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+class UsernameTaken(Exception):
+    pass
+
+
+class SqliteUserStore(MutableMapping):
+    """
+    Dict-like user and entitlement store backed by SQLite, shared by every gunicorn worker.
+
+    Each thread of each worker process keeps one open connection (reopened after a fork), and
+    records are served from a per-worker read-through cache so get_user stays a dict lookup.
+    Nothing is opened until the first lookup. An empty database is seeded from users.json.
+    """
+
+    def __init__(self, db_path=USER_DB_PATH, seed_path=USERS_JSON_PATH, cache_ttl=CACHE_TTL):
+        self.db_path = db_path
+        self.seed_path = seed_path
+        self.cache_ttl = cache_ttl
+        self._pool = db.ConnectionPool(db_path, SCHEMA)
+        self._cache = {}  # username -> (loaded_at, record)
+        self._generation = None  # Last generation this worker saw
+        self._seeded = False
+        self._seed_lock = threading.Lock()
+
+    # --- Connections ---
+    def _connection(self):
+        connection = self._pool.connection()
+        if not self._seeded:
+            self._seed(connection)
+        return connection
+
+    def _seed(self, connection):
+        with self._seed_lock:
+            if self._seeded:
+                return
+            if connection.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 0:
+                for username, record in load_seed_users(self.seed_path).items():
+                    try:
+                        self.create(username, record, connection=connection)
+                    except UsernameTaken:
+                        pass  # Another worker seeded it first
+            self._seeded = True
+
+    # --- Queries ---
+    def _fetch(self, username):
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT username, password_hash, role, full_name, patient_id FROM users WHERE username = ?',
+            (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        entities = [entity for (entity,) in connection.execute(
+            'SELECT entity FROM user_entities WHERE username = ? ORDER BY entity', (username,)
+        )]
+        return {
+            'password_hash': row['password_hash'],
+            'role': row['role'],
+            'entities': entities,
+            'full_name': row['full_name'],
+            'patient_id': row['patient_id'],
+        }
+
+    def get(self, username, default=None):
+        cached = self._cache.get(username)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+            return cached[1]
+        record = self._fetch(username)
+        if record is None:
+            # Misses are not cached: the user may be registered by another worker any moment.
+            self._cache.pop(username, None)
+            return default
+        self._cache[username] = (time.monotonic(), record)
+        return record
+
+    def create(self, username, record, connection=None):
+        """Inserts a new user; raises UsernameTaken if the username already exists."""
+        connection = connection or self._connection()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'INSERT INTO users (username, password_hash, role, full_name, patient_id) VALUES (?, ?, ?, ?, ?)',
+                (username, record['password_hash'], record['role'], record.get('full_name'), record.get('patient_id'))
+            )
+            self._insert_entities(connection, username, record)
+            self._bump_generation(connection)
+            connection.execute('COMMIT')
+        except sqlite3.IntegrityError:
+            connection.execute('ROLLBACK')
+            raise UsernameTaken(username)
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        self._cache.pop(username, None)
+
+    @staticmethod
+    def _insert_entities(connection, username, record):
+        connection.executemany(
+            'INSERT INTO user_entities (username, entity) VALUES (?, ?)',
+            [(username, entity) for entity in dict.fromkeys(record.get('entities') or [])]
+        )
+
+    @staticmethod
+    def _bump_generation(connection):
+        connection.execute(
+            'INSERT INTO user_generation (id, generation) VALUES (0, 1) '
+            'ON CONFLICT (id) DO UPDATE SET generation = generation + 1'
+        )
+
+    def generation(self):
+        """
+        Counter bumped by every write from any worker. Whatever a worker derived from user records
+        (e.g. cached entitlements) is stale once it changes; this worker's record cache is dropped then.
+        """
+        row = self._connection().execute('SELECT generation FROM user_generation WHERE id = 0').fetchone()
+        generation = row[0] if row else 0
+        if generation != self._generation:
+            self._cache.clear()
+            self._generation = generation
+        return generation
+
+    def usernames_with_role(self, role):
+        return [username for (username,) in self._connection().execute(
+            'SELECT username FROM users WHERE role = ? ORDER BY username', (role,)
+        )]
+
+    def get_by_patient_id(self, patient_id):
+        row = self._connection().execute('SELECT username FROM users WHERE patient_id = ?', (patient_id,)).fetchone()
+        return self.get(row[0]) if row else None
+
+    # --- Mapping interface ---
+    def __getitem__(self, username):
+        record = self.get(username)
+        if record is None:
+            raise KeyError(username)
+        return record
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def __setitem__(self, username, record):
+        # Upsert and entity rewrite in one transaction: other workers never see the user missing
+        connection = self._connection()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                """
+                INSERT INTO users (username, password_hash, role, full_name, patient_id) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (username) DO UPDATE SET
+                    password_hash = excluded.password_hash, role = excluded.role,
+                    full_name = excluded.full_name, patient_id = excluded.patient_id
+                """,
+                (username, record['password_hash'], record['role'], record.get('full_name'), record.get('patient_id'))
+            )
+            connection.execute('DELETE FROM user_entities WHERE username = ?', (username,))
+            self._insert_entities(connection, username, record)
+            self._bump_generation(connection)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        self._cache.pop(username, None)
+
+    def __delitem__(self, username):
+        connection = self._connection()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            deleted = connection.execute('DELETE FROM users WHERE username = ?', (username,)).rowcount
+            self._bump_generation(connection)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        self._cache.pop(username, None)
+        if deleted == 0:
+            raise KeyError(username)
+
+    def __iter__(self):
+        return iter([username for (username,) in self._connection().execute('SELECT username FROM users ORDER BY username')])
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM users').fetchone()[0]
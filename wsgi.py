@@ -0,0 +1,12 @@
+"""
+Production entry point:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py sets preload_app, so this module is imported once in the gunicorn master:
+the app is built and warmed up there, and every worker forked afterwards starts with it
+already loaded.
+"""
+from app import app, warm_up
+
+warm_up()